@@ -0,0 +1,366 @@
+"""Headless load generator: N bot matches speaking the pong.js protocol.
+
+Usage: python -m benchmarks.loadgen [--matches N] [--duration S] [--ramp S]
+                                    [--spectators N] [--json]
+                                    [--url ws://host/pong/] [--output FILE]
+
+Without --url the bots run in this process against PongConsumer on the
+in-memory channel layer, so server CPU can be reported; note that the bots
+share that process. With --url they connect to a running server (needs the
+``websockets`` package) and latency is reported relative to the fastest
+frame each bot saw, since the server clock is not shared. --spectators
+(in-process only) adds that many watchers to the first match.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import time
+
+import numpy as np
+
+from pong.protocol import SUBPROTOCOL_BINARY, FrameDecoder
+
+# Bots only start tracking the ball once it is this far (arena units) from
+# the bar centre, and change keys no faster than a human would.
+DEADBAND = 0.1
+REACTION_TIME = (0.12, 0.25)
+
+# A bot that hears nothing for this long gives up.
+RECV_TIMEOUT = 30
+
+
+class ConnectionClosed(Exception):
+	pass
+
+
+class LocalConnection:
+	def __init__(self, application, subprotocols, path='/pong/'):
+		from channels.testing import WebsocketCommunicator
+		self.communicator = WebsocketCommunicator(application, path, subprotocols=subprotocols)
+
+	async def connect(self):
+		connected, _ = await self.communicator.connect(timeout=10)
+		if not connected:
+			raise ConnectionClosed()
+
+	async def send(self, text):
+		await self.communicator.send_to(text_data=text)
+
+	async def recv(self, timeout):
+		message = await self.communicator.receive_output(timeout)
+		if message['type'] == 'websocket.close':
+			raise ConnectionClosed()
+		return message.get('bytes') or message.get('text')
+
+	async def close(self):
+		if not self.communicator.future.done():
+			await self.communicator.disconnect()
+
+
+class RemoteConnection:
+	def __init__(self, url, subprotocols):
+		self.url = url
+		self.subprotocols = subprotocols
+
+	async def connect(self):
+		import websockets
+		self.socket = await websockets.connect(self.url, subprotocols=self.subprotocols or None, max_size=None)
+
+	async def send(self, text):
+		await self.socket.send(text)
+
+	async def recv(self, timeout):
+		import websockets
+		try:
+			return await asyncio.wait_for(self.socket.recv(), timeout)
+		except websockets.ConnectionClosed:
+			raise ConnectionClosed()
+
+	async def close(self):
+		await self.socket.close()
+
+
+class Stats:
+	def __init__(self):
+		self.frames = 0
+		self.bytes = 0
+		self.inputs = 0
+		self.keyframe_requests = 0
+		self.spectator_frames = 0
+		self.latency = []
+		self.jitter = []
+
+
+class Bot:
+	"""One player. Holds the arrow key that moves its bar toward the ball."""
+
+	def __init__(self, connection, stats, clock_ms, relative):
+		self.connection = connection
+		self.stats = stats
+		self.clock_ms = clock_ms
+		self.relative = relative
+		self.decoder = FrameDecoder()
+		self.player_num = None
+		# Frame coordinates of the ball this bot follows and of its own bar,
+		# along the axis the bar slides on.
+		self.ball_coord = 1
+		self.bar_coord = None
+		self.interval = None
+		self.held = None
+		self.wanted = None
+		self.wanted_since = 0.0
+		self.reaction = random.uniform(*REACTION_TIME)
+		self.seq = 0
+		self.latency = []
+		self.last_arrival = None
+
+	async def send(self, message):
+		await self.connection.send(json.dumps(message))
+
+	async def send_key(self, kind, keycode):
+		self.seq += 1
+		self.stats.inputs += 1
+		await self.send({'type': kind, 'keycode': keycode, 'seq': self.seq})
+
+	async def run(self, until):
+		await self.connection.connect()
+		try:
+			await asyncio.wait_for(self.play(), until - time.monotonic())
+		except (asyncio.TimeoutError, ConnectionClosed):
+			pass
+		finally:
+			await self.connection.close()
+		if self.relative and self.latency:
+			floor = min(self.latency)
+			self.latency = [sample - floor for sample in self.latency]
+		self.stats.latency.extend(self.latency)
+
+	async def play(self):
+		while await self.receive(await self.connection.recv(RECV_TIMEOUT)):
+			pass
+
+	async def receive(self, data):
+		arrival = time.monotonic()
+		self.stats.bytes += len(data)
+		if isinstance(data, bytes):
+			frame = self.decoder.decode(data)
+			if frame is None:
+				self.stats.keyframe_requests += 1
+				await self.send({'type': 'keyframe_request'})
+				return True
+			_, server_time, coords = frame
+		else:
+			message = json.loads(data)
+			if message['type'] == 'player_num':
+				self.player_num = message['player_num']
+				self.interval = 1.0 / message['broadcast_rate']
+				self.follow(message.get('arena'))
+				return True
+			if message['type'] == 'disconnect_message':
+				return False
+			if message['type'] == 'score':
+				return True
+			server_time = message['time']
+			if 'sphere_positions' in message:
+				coords = sum(message['sphere_positions'] + message['bar_positions'], [])
+			else:
+				coords = message['sphere_position'] + message['p1_bar_position'] + message['p2_bar_position']
+
+		self.stats.frames += 1
+		self.latency.append(self.clock_ms() - server_time)
+		if self.last_arrival is not None and self.interval is not None:
+			self.stats.jitter.append(arrival - self.last_arrival - self.interval)
+		self.last_arrival = arrival
+		if self.bar_coord is not None:
+			await self.steer(coords, arrival)
+		return True
+
+	def follow(self, arena):
+		if arena is None:
+			self.bar_coord = 1 + 3 * self.player_num
+			return
+		bar = arena['bars'][self.player_num - 1]
+		axis = 1 if bar['size'][1] > bar['size'][0] else 0
+		self.ball_coord = axis
+		self.bar_coord = 3 * (arena['balls'] + self.player_num - 1) + axis
+		self.decoder = FrameDecoder(coords=3 * (arena['balls'] + len(arena['bars'])))
+
+	async def steer(self, coords, now):
+		offset = coords[self.ball_coord] - coords[self.bar_coord]
+		wanted = 'ArrowUp' if offset > DEADBAND else 'ArrowDown' if offset < -DEADBAND else None
+		if wanted != self.wanted:
+			self.wanted = wanted
+			self.wanted_since = now
+		if wanted == self.held or now - self.wanted_since < self.reaction:
+			return
+		if self.held is not None:
+			await self.send_key('keyup', self.held)
+		if wanted is not None:
+			await self.send_key('keydown', wanted)
+		self.held = wanted
+
+
+async def spectate(connection, stats, until):
+	"""Count the frames one watcher receives until the match or run ends."""
+	await connection.connect()
+	try:
+		while time.monotonic() < until:
+			data = await connection.recv(until - time.monotonic())
+			if isinstance(data, bytes) or json.loads(data)['type'] == 'positions':
+				stats.spectator_frames += 1
+			elif json.loads(data)['type'] == 'disconnect_message':
+				break
+	except (asyncio.TimeoutError, ConnectionClosed):
+		pass
+	finally:
+		await connection.close()
+
+
+def percentiles(samples, points=(50, 95, 99)):
+	if not samples:
+		return [float('nan')] * len(points)
+	return np.percentile(samples, points).tolist()
+
+
+async def run_bots(args, connection, clock_ms, relative):
+	stats = Stats()
+	subprotocols = [] if args.json else [SUBPROTOCOL_BINARY]
+	tasks = []
+	start = time.monotonic()
+	until = start + args.duration
+	# Connect match by match so consecutive bots land in the same match.
+	for _ in range(args.matches):
+		for _ in range(args.players):
+			bot = Bot(connection(subprotocols), stats, clock_ms, relative)
+			tasks.append(asyncio.create_task(bot.run(until)))
+		await asyncio.sleep(args.ramp / args.matches)
+	await asyncio.gather(*tasks)
+	return stats, time.monotonic() - start
+
+
+async def run_local(args):
+	from django.test import override_settings
+
+	with override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}):
+		from channels.routing import URLRouter
+
+		from pong.consumers import PongConsumer
+		from pong.routing import websocket_urlpatterns
+
+		scheduler = PongConsumer.scheduler
+		tick = scheduler.tick
+		busy = [0.0]
+
+		async def timed_tick():
+			started = time.perf_counter()
+			await tick()
+			busy[0] += time.perf_counter() - started
+
+		scheduler.tick = timed_tick
+		application = URLRouter(websocket_urlpatterns)
+
+		audience = Stats()
+
+		async def watch_first_match():
+			while not any(match.handle is not None for match in PongConsumer.groups_info.values()):
+				await asyncio.sleep(0.01)
+			match_id = next(iter(PongConsumer.groups_info))
+			path = f'/pong/watch/{match_id}/'
+			until = time.monotonic() + args.duration
+			subprotocols = [] if args.json else [SUBPROTOCOL_BINARY]
+			await asyncio.gather(*(
+				spectate(LocalConnection(application, subprotocols, path), audience, until)
+				for _ in range(args.spectators)
+			))
+
+		cpu = time.process_time()
+		watchers = asyncio.create_task(watch_first_match()) if args.spectators else None
+		stats, elapsed = await run_bots(
+			args,
+			lambda subprotocols: LocalConnection(application, subprotocols),
+			lambda: (time.monotonic() - scheduler._epoch) * 1000,
+			relative=False)
+		if watchers is not None:
+			await watchers
+			stats.spectator_frames = audience.spectator_frames
+		server = {
+			'tick_busy': busy[0] / elapsed,
+			'process_cpu': (time.process_time() - cpu) / elapsed,
+			'skipped_ticks': scheduler.skipped_ticks,
+		}
+		return stats, elapsed, server
+
+
+async def run_remote(args):
+	stats, elapsed = await run_bots(
+		args,
+		lambda subprotocols: RemoteConnection(args.url, subprotocols),
+		lambda: time.monotonic() * 1000,
+		relative=True)
+	return stats, elapsed, None
+
+
+def summarize(stats, elapsed, server):
+	latency = percentiles(stats.latency)
+	jitter = [abs(sample) * 1000 for sample in stats.jitter]
+	summary = {
+		'frames_per_sec': stats.frames / elapsed,
+		'bytes_per_sec': stats.bytes / elapsed,
+		'inputs_per_sec': stats.inputs / elapsed,
+		'keyframe_requests': stats.keyframe_requests,
+		'spectator_frames_per_sec': stats.spectator_frames / elapsed,
+		'latency_ms': dict(zip(('p50', 'p95', 'p99'), latency)),
+		'jitter_ms': dict(zip(('p50', 'p95', 'p99'), percentiles(jitter))),
+		'jitter_stdev_ms': statistics.pstdev(stats.jitter) * 1000 if stats.jitter else float('nan'),
+	}
+	if server is not None:
+		summary['server'] = server
+	return summary
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument('--matches', type=int, default=100)
+	parser.add_argument('--duration', type=float, default=10.0, help="seconds, including the ramp")
+	parser.add_argument('--ramp', type=float, default=1.0, help="seconds over which matches connect")
+	parser.add_argument('--players', type=int, default=2, help="players per match; must match PONG_ARENA")
+	parser.add_argument('--spectators', type=int, default=0, help="watchers of the first match (in-process only)")
+	parser.add_argument('--json', action='store_true', help="use JSON frames instead of binary")
+	parser.add_argument('--url', help="ws:// URL of a running server; default is in-process")
+	parser.add_argument('--output', help="also write the summary as JSON to this file")
+	args = parser.parse_args()
+
+	if args.url:
+		stats, elapsed, server = asyncio.run(run_remote(args))
+	else:
+		os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'multi_pong.settings')
+		import django
+		django.setup()
+		stats, elapsed, server = asyncio.run(run_local(args))
+
+	summary = summarize(stats, elapsed, server)
+	print(f"{'matches':<20}{args.matches:>12}")
+	print(f"{'frames/s':<20}{summary['frames_per_sec']:>12.0f}")
+	print(f"{'bytes/s':<20}{summary['bytes_per_sec']:>12.0f}")
+	print(f"{'inputs/s':<20}{summary['inputs_per_sec']:>12.0f}")
+	print(f"{'keyframe requests':<20}{summary['keyframe_requests']:>12}")
+	if args.spectators:
+		print(f"{'spectator frames/s':<20}{summary['spectator_frames_per_sec']:>12.0f}")
+	print(f"{'':<20}{'p50':>12}{'p95':>12}{'p99':>12}")
+	for name in ('latency_ms', 'jitter_ms'):
+		print(f"{name:<20}" + ''.join(f"{value:>12.2f}" for value in summary[name].values()))
+	print(f"{'jitter stdev ms':<20}{summary['jitter_stdev_ms']:>12.2f}")
+	if server is not None:
+		print(f"{'server tick busy':<20}{server['tick_busy']:>12.1%}")
+		print(f"{'process cpu':<20}{server['process_cpu']:>12.1%}")
+		print(f"{'skipped ticks':<20}{server['skipped_ticks']:>12}")
+	if args.output:
+		with open(args.output, 'w') as f:
+			json.dump(summary, f, indent=2)
+
+
+if __name__ == '__main__':
+	main()
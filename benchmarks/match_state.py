@@ -0,0 +1,147 @@
+"""Per-match memory footprint and per-tick cost: legacy dict layout vs MatchState.
+
+Usage: python -m benchmarks.match_state [--matches N] [--ticks N]
+"""
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+from pong.engine import BatchEngine
+from pong.state import MatchState
+
+RADIUS = 0.04
+BAR_POSITION = 2.5
+BAR_WIDTH = 0.08
+BAR_HEIGHT = 0.7
+BAR_DEPTH = 0.1
+
+
+def legacy_group_info():
+	# The groups_info entry the consumer used to build for every match.
+	direction = np.array([1.0, 1.0, 0.0]) / np.sqrt(2.0)
+	return {
+		'sphere_direction': [direction[0], direction[1], direction[2]],
+		'sphere_position': [0.0, 0.0, 0.0],
+		'sphere_speed': 0.03,
+		'player_1_score': 0,
+		'player_2_score': 0,
+		'p1_bar_position': [-BAR_POSITION, 0.0, 0.0],
+		'p2_bar_position': [BAR_POSITION, 0.0, 0.0],
+		'p1_moving_up': False,
+		'p1_moving_down': False,
+		'p2_moving_up': False,
+		'p2_moving_down': False,
+		'sphere_bounding_box': {
+			'x_min': -RADIUS, 'x_max': RADIUS,
+			'y_min': -RADIUS, 'y_max': RADIUS,
+			'z_min': -RADIUS, 'z_max': RADIUS,
+		},
+		'p2_bar_box': {
+			'x_min': BAR_POSITION - BAR_WIDTH / 2, 'x_max': BAR_POSITION + BAR_WIDTH / 2,
+			'y_min': -BAR_HEIGHT / 2, 'y_max': BAR_HEIGHT / 2,
+			'z_min': -BAR_DEPTH / 2, 'z_max': BAR_DEPTH / 2,
+		},
+		'p1_bar_box': {
+			'x_min': -BAR_POSITION - BAR_WIDTH / 2, 'x_max': -BAR_POSITION + BAR_WIDTH / 2,
+			'y_min': -BAR_HEIGHT / 2, 'y_max': BAR_HEIGHT / 2,
+			'z_min': -BAR_DEPTH / 2, 'z_max': BAR_DEPTH / 2,
+		},
+		'upper_plane_normal': [0.0, -1.0, 0.0],
+		'upper_plane_constant': 1.5,
+		'lower_plane_normal': [0.0, 1.0, 0.0],
+		'lower_plane_constant': 1.5,
+		'left_plane_normal': [1.0, 0.0, 0.0],
+		'left_plane_constant': 3.0,
+		'right_plane_normal': [-1.0, 0.0, 0.0],
+		'right_plane_constant': 3.0,
+	}
+
+
+def legacy_box_plane(box, normal, constant):
+	lo = hi = 0.0
+	for axis, key in enumerate('xyz'):
+		if normal[axis] > 0:
+			lo += normal[axis] * box[key + '_min']
+			hi += normal[axis] * box[key + '_max']
+		else:
+			lo += normal[axis] * box[key + '_max']
+			hi += normal[axis] * box[key + '_min']
+	return lo <= -constant and hi >= -constant
+
+
+def legacy_box_box(a, b):
+	return not (a['x_max'] < b['x_min'] or a['x_min'] > b['x_max'] or
+		a['y_max'] < b['y_min'] or a['y_min'] > b['y_max'] or
+		a['z_max'] < b['z_min'] or a['z_min'] > b['z_max'])
+
+
+def legacy_step(groups_info, group):
+	# Synchronous port of the old check_sphere_collision + position update.
+	box = groups_info[group]['sphere_bounding_box']
+	for wall in ('upper', 'lower', 'left', 'right'):
+		normal = groups_info[group][wall + '_plane_normal']
+		if legacy_box_plane(box, normal, groups_info[group][wall + '_plane_constant']):
+			v = np.array(groups_info[group]['sphere_direction'])
+			n = np.array(normal)
+			groups_info[group]['sphere_direction'] = v - 2 * np.dot(v, n) * n
+			break
+	else:
+		for bar, normal in (('p1', (1, 0, 0)), ('p2', (-1, 0, 0))):
+			if legacy_box_box(box, groups_info[group][bar + '_bar_box']):
+				v = (np.array(groups_info[group]['sphere_position'])
+					- np.array(groups_info[group][bar + '_bar_position']) + normal)
+				groups_info[group]['sphere_direction'] = v / np.linalg.norm(v)
+				break
+	for axis, key in enumerate('xyz'):
+		delta = groups_info[group]['sphere_direction'][axis] * groups_info[group]['sphere_speed']
+		groups_info[group]['sphere_position'][axis] += delta
+		box[key + '_min'] += delta
+		box[key + '_max'] += delta
+
+
+def measure_legacy(matches, ticks):
+	tracemalloc.start()
+	before = tracemalloc.get_traced_memory()[0]
+	groups_info = {f"group_{i}": legacy_group_info() for i in range(matches)}
+	footprint = (tracemalloc.get_traced_memory()[0] - before) / matches
+	tracemalloc.stop()
+	start = time.perf_counter()
+	for _ in range(ticks):
+		for group in groups_info:
+			legacy_step(groups_info, group)
+	return footprint, (time.perf_counter() - start) / ticks
+
+
+def measure_state(matches, ticks):
+	engine = BatchEngine(capacity=matches)
+	tracemalloc.start()
+	before = tracemalloc.get_traced_memory()[0]
+	groups_info = {f"group_{i}": MatchState(f"group_{i}", engine) for i in range(matches)}
+	footprint = (tracemalloc.get_traced_memory()[0] - before) / matches
+	tracemalloc.stop()
+	row_bytes = sum(array.nbytes for array in (engine.sphere_position, engine.sphere_direction,
+		engine.sphere_speed, engine.sphere_box, engine.bar_position, engine.bar_box)) / engine.capacity
+	start = time.perf_counter()
+	for _ in range(ticks):
+		engine.step()
+	assert len(groups_info) == len(engine)
+	return footprint + row_bytes, (time.perf_counter() - start) / ticks
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument('--matches', type=int, default=1000)
+	parser.add_argument('--ticks', type=int, default=200)
+	args = parser.parse_args()
+
+	legacy_bytes, legacy_tick = measure_legacy(args.matches, args.ticks)
+	state_bytes, state_tick = measure_state(args.matches, args.ticks)
+	print(f"{'layout':<12}{'bytes/match':>14}{'us/tick':>14}{'us/match-tick':>16}")
+	for name, footprint, tick in (('dict', legacy_bytes, legacy_tick), ('MatchState', state_bytes, state_tick)):
+		print(f"{name:<12}{footprint:>14.0f}{tick * 1e6:>14.1f}{tick * 1e6 / args.matches:>16.3f}")
+
+
+if __name__ == '__main__':
+	main()
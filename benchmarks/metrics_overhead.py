@@ -0,0 +1,81 @@
+"""Cost of the tick-loop metrics, against the same loop without them.
+
+Usage: python -m benchmarks.metrics_overhead [--matches N] [--ticks N] [--repeat N]
+                                             [--broadcast-every N]
+
+Runs the real TickScheduler loop with a batch engine and frame encoder,
+once with ``metrics=None`` and once with LoopMetrics on a private registry,
+at a rate high enough that the loop never sleeps. Frames go out every
+--broadcast-every ticks, 4 as with the default 120 Hz tick and 30 Hz
+broadcast, and each match's step then reads its frame as the consumer
+does. Runs come in pairs, in alternating order; the overhead reported is
+the median difference within a pair, which is steadier than comparing
+best times on a busy machine.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from pong.engine import BatchEngine
+from pong.metrics import LoopMetrics, Registry
+from pong.protocol import FrameEncoder
+from pong.scheduler import TickScheduler
+
+RATE = 1e6
+
+
+def measure(matches, ticks, broadcast_every, metrics):
+	engine = BatchEngine(capacity=matches)
+	encoder = FrameEncoder()
+	scheduler = TickScheduler(rate=RATE, broadcast_rate=RATE / broadcast_every, max_catchup=ticks,
+		engine=engine, encoder=encoder, metrics=metrics)
+
+	def step_for(handle):
+		async def step():
+			encoder.frame(engine.handle_row[handle])
+		return step
+
+	async def stop():
+		if scheduler.tick_count >= ticks:
+			scheduler.matches.clear()
+
+	async def run():
+		for i in range(matches):
+			scheduler.register(f"match_{i}", step_for(engine.add()))
+		scheduler.register("stop", stop)
+		start = time.perf_counter()
+		await scheduler._task
+		return time.perf_counter() - start
+
+	return asyncio.run(run()) / ticks
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument('--matches', type=int, default=1000)
+	parser.add_argument('--ticks', type=int, default=1000)
+	parser.add_argument('--repeat', type=int, default=20)
+	parser.add_argument('--broadcast-every', type=int, default=4)
+	args = parser.parse_args()
+
+	bare = []
+	overhead = []
+	for i in range(args.repeat):
+		# Whichever runs second in a pair is a little slower.
+		runs = [None, LoopMetrics(Registry())]
+		if i % 2:
+			runs.reverse()
+		times = {metrics is None: measure(args.matches, args.ticks, args.broadcast_every, metrics) for metrics in runs}
+		bare.append(times[True])
+		overhead.append(times[False] - times[True])
+	bare = statistics.median(bare)
+	overhead = statistics.median(overhead)
+	print(f"{'loop':<16}{'us/tick':>12}")
+	print(f"{'no metrics':<16}{bare * 1e6:>12.1f}")
+	print(f"{'metrics':<16}{(bare + overhead) * 1e6:>12.1f}")
+	print(f"overhead: {overhead * 1e6:.2f} us/tick, {overhead / bare:.2%} of the tick")
+
+
+if __name__ == '__main__':
+	main()
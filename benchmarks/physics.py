@@ -0,0 +1,279 @@
+"""Micro-benchmarks for the physics hot path, with JSON baselines.
+
+Usage: python -m benchmarks.physics [--matches N] [--steps N] [--repeat N]
+                                    [--save FILE] [--compare FILE] [--threshold F]
+
+Each case runs a batch of matches over a realistic trajectory and reports
+ns per match-step (median over every step of --repeat runs) and the transient bytes allocated per
+step (tracemalloc peak, measured in a separate pass). --save writes the
+results as a baseline; --compare flags every case that got slower or
+allocates more than --threshold over the baseline and exits non-zero.
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from pong.arena import FOUR_PLAYER, Arena, ArenaEngine
+from pong.engine import (
+	BAR_LIMIT, BAR_P2, BAR_POSITION, BALL_LIMIT_Y, DEFAULT_DT, KEY_DOWN, KEY_UP, RADIUS,
+	BatchEngine, bounce_directions, impact_times,
+)
+from pong.events import EventDrivenEngine
+
+SEED = 1234
+
+
+def build(engine, matches, rng, heading):
+	handles = [engine.add() for _ in range(matches)]
+	n = engine.size
+	angle = heading(rng, n)
+	engine.sphere_direction[:n, 0] = np.cos(angle)
+	engine.sphere_direction[:n, 1] = np.sin(angle)
+	engine.sphere_position[:n, 0] = rng.uniform(-BAR_POSITION + 0.2, BAR_POSITION - 0.2, n)
+	engine.sphere_position[:n, 1] = rng.uniform(-BALL_LIMIT_Y, BALL_LIMIT_Y, n)
+	engine.sphere_box[:n, 0] = engine.sphere_position[:n] - RADIUS
+	engine.sphere_box[:n, 1] = engine.sphere_position[:n] + RADIUS
+	return handles
+
+
+def steep(rng, n):
+	# Mostly vertical: the ball spends its time bouncing between the walls.
+	return rng.choice([-1.0, 1.0], n) * rng.uniform(1.2, 1.4, n) + rng.choice([0.0, np.pi], n)
+
+
+def shallow(rng, n):
+	# Mostly horizontal: the ball crosses the arena from bar to bar.
+	return rng.uniform(-0.6, 0.6, n) + rng.choice([0.0, np.pi], n)
+
+
+def track_ball(engine):
+	# Both players hold the key that moves their bar toward the ball.
+	n = engine.size
+	offset = engine.sphere_position[:n, None, 1] - engine.bar_position[:n, :, 1]
+	engine.held[:n, :, KEY_UP] = offset > 0.1
+	engine.held[:n, :, KEY_DOWN] = offset < -0.1
+
+
+def case_walls(matches, rng):
+	engine = BatchEngine(capacity=matches)
+	build(engine, matches, rng, steep)
+	return engine.step
+
+
+def case_rally(matches, rng):
+	engine = BatchEngine(capacity=matches)
+	build(engine, matches, rng, shallow)
+
+	def step():
+		track_ball(engine)
+		engine.step()
+	return step
+
+
+def case_goal_line(matches, rng):
+	# Bars parked at the far ends, so balls slip past them to the back walls.
+	engine = BatchEngine(capacity=matches)
+	build(engine, matches, rng, shallow)
+	engine.bar_position[:, :, 1] = BAR_LIMIT
+	engine.bar_box[:, :, 0, 1] = BAR_LIMIT - 0.35
+	engine.bar_box[:, :, 1, 1] = BAR_LIMIT + 0.35
+	engine.sphere_position[:, 1] = rng.uniform(-BALL_LIMIT_Y, 0.0, matches)
+	engine.sphere_direction[:, 1] = 0.0
+	engine.sphere_direction[:, 0] = np.sign(engine.sphere_direction[:, 0])
+	return engine.step
+
+
+def case_set_held(matches, rng):
+	engine = BatchEngine(capacity=matches)
+	handles = build(engine, matches, rng, shallow)
+	pressed = [False]
+
+	def step():
+		pressed[0] = not pressed[0]
+		for handle in handles:
+			engine.set_held(handle, 1, KEY_UP, pressed[0])
+	return step
+
+
+def case_impact_times(matches, rng):
+	engine = BatchEngine(capacity=matches)
+	build(engine, matches, rng, shallow)
+	velocity = engine.sphere_direction * engine.sphere_speed[:, None]
+	bar_lo = engine.bar_box[:, :, 0] - RADIUS
+	bar_hi = engine.bar_box[:, :, 1] + RADIUS
+	out = np.empty((matches, BAR_P2 + 1))
+	return lambda: impact_times(engine.sphere_position, velocity, bar_lo, bar_hi, out)
+
+
+def case_bounce_directions(matches, rng):
+	engine = BatchEngine(capacity=matches)
+	build(engine, matches, rng, shallow)
+	player = rng.integers(0, 2, matches)
+	face = rng.integers(0, 3, matches)
+	bar_position = engine.bar_position[np.arange(matches), player]
+	direction = engine.sphere_direction
+	position = engine.sphere_position
+	return lambda: bounce_directions(direction, position, bar_position, player, face)
+
+
+def case_event_rally(matches, rng):
+	now = [0.0]
+	engine = EventDrivenEngine(capacity=matches, clock=lambda: now[0])
+	handles = build(engine, matches, rng, shallow)
+	engine.origin_position[:matches] = engine.sphere_position[:matches]
+	engine._schedule(np.arange(matches))
+	held = np.full(matches, -1)
+
+	def step():
+		now[0] += DEFAULT_DT
+		engine.step()
+		# Only input changes reach the engine, as with real clients.
+		offset = engine.sphere_position[:matches, 1] - engine.bar_position[:matches, 0, 1]
+		wanted = np.where(offset > 0.1, KEY_UP, np.where(offset < -0.1, KEY_DOWN, -1))
+		for i in np.nonzero(wanted != held)[0]:
+			if held[i] >= 0:
+				engine.set_held(handles[i], 1, held[i], False)
+			if wanted[i] >= 0:
+				engine.set_held(handles[i], 1, wanted[i], True)
+			held[i] = wanted[i]
+	return step
+
+
+def arena_case(arena, matches, rng):
+	engine = ArenaEngine(arena, capacity=matches)
+	for _ in range(matches):
+		engine.add()
+	angle = rng.uniform(0, 2 * np.pi, (matches, arena.balls))
+	engine.sphere_direction[:, :, 0] = np.cos(angle)
+	engine.sphere_direction[:, :, 1] = np.sin(angle)
+	held = engine.held[:, :, KEY_UP]
+
+	def step():
+		# Bars sweep back and forth so the ball hits some of them.
+		if rng.random() < 0.02:
+			held[:] = ~held
+		engine.step()
+	return step
+
+
+def case_four_player(matches, rng):
+	return arena_case(FOUR_PLAYER, matches, rng)
+
+
+def case_crowded(matches, rng):
+	# 16 balls that also bounce off each other; per-step cost should stay
+	# close to 16 times a one-ball match, not grow with the pairs.
+	return arena_case(Arena(balls=16), matches, rng)
+
+
+CASES = {
+	'walls': case_walls,
+	'rally': case_rally,
+	'goal_line': case_goal_line,
+	'set_held': case_set_held,
+	'impact_times': case_impact_times,
+	'bounce_directions': case_bounce_directions,
+	'event_rally': case_event_rally,
+	'four_player': case_four_player,
+	'crowded': case_crowded,
+}
+
+
+def measure(case, matches, steps, repeat):
+	# The median of individually timed steps shrugs off the odd step that
+	# lost the CPU, which a total over the run does not.
+	timings = []
+	for _ in range(repeat):
+		step = case(matches, np.random.default_rng(SEED))
+		for _ in range(steps):
+			start = time.perf_counter()
+			step()
+			timings.append(time.perf_counter() - start)
+
+	step = case(matches, np.random.default_rng(SEED))
+	step()
+	tracemalloc.start()
+	allocated = 0
+	for _ in range(min(steps, 100)):
+		tracemalloc.reset_peak()
+		current = tracemalloc.get_traced_memory()[0]
+		step()
+		allocated += tracemalloc.get_traced_memory()[1] - current
+	tracemalloc.stop()
+	return {
+		'ns_per_step': float(np.median(timings)) / matches * 1e9,
+		'alloc_bytes_per_step': allocated / min(steps, 100),
+	}
+
+
+def environment():
+	return {
+		'python': platform.python_version(),
+		'numpy': np.__version__,
+		'machine': platform.machine(),
+		'processor': platform.processor(),
+	}
+
+
+def compare(results, baseline, threshold):
+	regressions = []
+	print(f"{'case':<20}{'metric':<22}{'baseline':>12}{'current':>12}{'change':>10}")
+	for name, metrics in results.items():
+		before = baseline['results'].get(name)
+		if before is None:
+			continue
+		for metric, value in metrics.items():
+			old = before[metric]
+			change = (value - old) / old if old else (0.0 if value == old else float('inf'))
+			flag = ''
+			if change > threshold:
+				flag = '  REGRESSION'
+				regressions.append((name, metric))
+			print(f"{name:<20}{metric:<22}{old:>12.1f}{value:>12.1f}{change:>+10.1%}{flag}")
+	if baseline.get('environment') != environment():
+		print("note: baseline was recorded on a different environment:", baseline.get('environment'))
+	return regressions
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument('--matches', type=int, default=1000)
+	parser.add_argument('--steps', type=int, default=300)
+	parser.add_argument('--repeat', type=int, default=5)
+	parser.add_argument('--cases', nargs='+', choices=CASES, default=list(CASES))
+	parser.add_argument('--save', help="write the results to this baseline file")
+	parser.add_argument('--compare', help="compare against this baseline file")
+	parser.add_argument('--threshold', type=float, default=0.2, help="allowed fractional increase")
+	args = parser.parse_args()
+
+	results = {name: measure(CASES[name], args.matches, args.steps, args.repeat) for name in args.cases}
+
+	if args.compare:
+		with open(args.compare) as f:
+			baseline = json.load(f)
+		regressions = compare(results, baseline, args.threshold)
+	else:
+		regressions = []
+		print(f"{'case':<20}{'ns/match-step':>16}{'alloc B/step':>16}")
+		for name, metrics in results.items():
+			print(f"{name:<20}{metrics['ns_per_step']:>16.1f}{metrics['alloc_bytes_per_step']:>16.0f}")
+
+	if args.save:
+		with open(args.save, 'w') as f:
+			json.dump({
+				'environment': environment(),
+				'matches': args.matches,
+				'steps': args.steps,
+				'results': results,
+			}, f, indent=2)
+			f.write('\n')
+	sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+	main()
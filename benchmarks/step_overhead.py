@@ -0,0 +1,119 @@
+"""Per-step cost: the old coroutine physics helpers vs synchronous physics.
+
+Usage: python -m benchmarks.step_overhead [--matches N] [--ticks N]
+
+The consumer used to make every physics helper ``async def`` and await
+it, so each collision test built and drove a coroutine. This runs that
+step as it was, the same helpers called as plain functions, and the
+batch engine that replaced them, and reports the cost of one match-step.
+"""
+import argparse
+import asyncio
+import time
+
+import numpy as np
+
+from pong.engine import BatchEngine
+
+from .match_state import legacy_box_box, legacy_box_plane, legacy_group_info, legacy_step
+
+
+async def check_box_plane_collision(box, normal, constant):
+	return legacy_box_plane(box, normal, constant)
+
+
+async def check_box_bar_collision(a, b):
+	return legacy_box_box(a, b)
+
+
+async def reflect_vector(vector, normal):
+	vector = np.array(vector)
+	normal = np.array(normal)
+	return vector - 2 * np.dot(vector, normal) * normal
+
+
+async def reflect_vector_from_bar(sphere_position, normal, bar_position):
+	vector = np.array(sphere_position) - np.array(bar_position) + normal
+	return vector / np.linalg.norm(vector)
+
+
+async def moving_sphere_bounding_box(info):
+	box = info['sphere_bounding_box']
+	for axis, key in enumerate('xyz'):
+		delta = info['sphere_direction'][axis] * info['sphere_speed']
+		box[key + '_min'] += delta
+		box[key + '_max'] += delta
+
+
+async def coroutine_step(groups_info, group):
+	# The old check_sphere_collision and main_loop body, one await per helper.
+	info = groups_info[group]
+	box = info['sphere_bounding_box']
+	for wall in ('upper', 'lower', 'left', 'right'):
+		normal = info[wall + '_plane_normal']
+		if await check_box_plane_collision(box, normal, info[wall + '_plane_constant']):
+			info['sphere_direction'] = await reflect_vector(info['sphere_direction'], normal)
+			break
+	else:
+		for bar, normal in (('p1', np.array([1, 0, 0])), ('p2', np.array([-1, 0, 0]))):
+			if await check_box_bar_collision(box, info[bar + '_bar_box']):
+				info['sphere_direction'] = await reflect_vector_from_bar(
+					info['sphere_position'], normal, info[bar + '_bar_position'])
+				break
+	for axis in range(3):
+		info['sphere_position'][axis] += info['sphere_direction'][axis] * info['sphere_speed']
+	await moving_sphere_bounding_box(info)
+
+
+def measure_coroutines(matches, ticks):
+	groups_info = {f"group_{i}": legacy_group_info() for i in range(matches)}
+
+	async def run():
+		start = time.perf_counter()
+		for _ in range(ticks):
+			for group in groups_info:
+				await coroutine_step(groups_info, group)
+		return time.perf_counter() - start
+
+	return asyncio.run(run()) / (ticks * matches)
+
+
+def measure_plain(matches, ticks):
+	groups_info = {f"group_{i}": legacy_group_info() for i in range(matches)}
+	start = time.perf_counter()
+	for _ in range(ticks):
+		for group in groups_info:
+			legacy_step(groups_info, group)
+	return (time.perf_counter() - start) / (ticks * matches)
+
+
+def measure_engine(matches, ticks):
+	engine = BatchEngine(capacity=matches)
+	for _ in range(matches):
+		engine.add()
+	start = time.perf_counter()
+	for _ in range(ticks):
+		engine.step()
+	return (time.perf_counter() - start) / (ticks * matches)
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument('--matches', type=int, default=1000)
+	parser.add_argument('--ticks', type=int, default=200)
+	args = parser.parse_args()
+
+	rows = (
+		('coroutines', measure_coroutines(args.matches, args.ticks)),
+		('plain calls', measure_plain(args.matches, args.ticks)),
+		# A tool stepping one match on its own, e.g. replaying a single log.
+		('engine, 1 match', measure_engine(1, args.ticks)),
+		(f'engine, {args.matches}', measure_engine(args.matches, args.ticks)),
+	)
+	print(f"{'step':<20}{'us/match-step':>16}")
+	for name, seconds in rows:
+		print(f"{name:<20}{seconds * 1e6:>16.3f}")
+
+
+if __name__ == '__main__':
+	main()
@@ -38,6 +38,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'pong',
 ]
 
 ASGI_APPLICATION = "multi_pong.asgi.application"
@@ -51,6 +52,61 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Fixed rate, in Hz, at which the shared scheduler steps every active match.
+PONG_TICK_RATE = 120
+
+# Rate, in Hz, at which position frames are sent to clients. pong.js
+# interpolates between frames, so this can be well below PONG_TICK_RATE.
+PONG_BROADCAST_RATE = 30
+
+# 'fixed' integrates every match at PONG_TICK_RATE. 'events' computes each
+# ball's next collision analytically and only does work when one is due or
+# a bar's input changes; the loop then runs at PONG_BROADCAST_RATE.
+PONG_SIMULATION = 'fixed'
+
+# Layout of every match: 'classic' (two players, one ball), 'four_player'
+# (a bar on every wall) or 'multi_ball' (two players, three balls). Only
+# 'classic' runs with PONG_SIMULATION = 'events' or records input logs.
+PONG_ARENA = 'classic'
+
+# Rate, in Hz, of the keyframes sent to spectators at /pong/watch/<match>/.
+# Rounded to a whole fraction of PONG_BROADCAST_RATE.
+PONG_SPECTATOR_RATE = 10
+
+# Seconds a resume token handed out by a drain (POST /debug/drain/) stays
+# valid, and how long a resumed match waits for all of its players.
+PONG_RESUME_TIMEOUT = 30
+
+# Goals a player needs to win a match, with nobody else level. The result is
+# saved to the database behind the game: finished matches are queued and
+# written every PONG_RESULTS_INTERVAL seconds, PONG_RESULTS_BATCH matches per
+# transaction.
+PONG_WINNING_SCORE = 5
+PONG_RESULTS_INTERVAL = 1.0
+PONG_RESULTS_BATCH = 500
+
+# Number of shard processes (`manage.py runshard <index>`) that own match
+# simulations. 0 keeps matchmaking and simulation inside each web worker,
+# which only pairs players that land on the same worker.
+PONG_SHARDS = 0
+
+# With shards, 'lobby' pairs players on shard 0. 'redis' pairs them with
+# atomic scripts on the channel layer's Redis and gives each match a leased
+# owner shard, so there is no single lobby process.
+PONG_REGISTRY = 'lobby'
+
+# Shard `index` serves its own /metrics on this port plus its index, since
+# shards have no web server of their own; None serves nothing.
+PONG_SHARD_METRICS_PORT = 9100
+
+# Where profiles started from /pong/debug/profile/ or `manage.py profile`
+# are written.
+PONG_PROFILE_DIR = BASE_DIR / 'profiles'
+
+# Directory for per-match input logs (`manage.py replay` re-runs them), or
+# None to record nothing. Only used with PONG_SIMULATION = 'fixed'.
+PONG_RECORD_DIR = None
+
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -1,3 +1,15 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import Match, Result
+
+
+class ResultInline(admin.TabularInline):
+    model = Result
+    extra = 0
+
+
+@admin.register(Match)
+class MatchAdmin(admin.ModelAdmin):
+    list_display = ('match_id', 'arena', 'winner', 'started_at', 'ended_at')
+    list_filter = ('arena',)
+    inlines = [ResultInline]
@@ -0,0 +1,309 @@
+import numpy as np
+
+from .engine import (
+	BAR_HALF_EXTENTS, BAR_HEIGHT, BAR_POSITION, BAR_SPEED, BAR_WIDTH, GROUND_HEIGHT, GROUND_WIDTH,
+	HALF_WIDTH, MAX_BOUNCES, RADIUS, SPHERE_SPEED, START_DIRECTION, WALL_LEFT, WALL_LOWER,
+	WALL_RIGHT, WALL_UPPER, BatchEngine, bounce_directions, box_impact_times, wall_impact_times,
+)
+
+# Distance from a guarded wall to the centre of its bar.
+BAR_INSET = HALF_WIDTH - BAR_POSITION
+
+# Gap, in arena units, kept between matches laid side by side along x for
+# the broad phase, so boxes of different matches never overlap.
+MATCH_GAP = 2.0
+
+# Column of the time-of-impact table holding a ball's earliest bar hit.
+BAR = WALL_LEFT + 1
+
+
+class Arena:
+	"""Layout of a match: its size, its number of balls and its guarded walls.
+
+	Each wall in ``goals`` gets one bar, which slides along it; players are
+	numbered in the order of ``goals``. Walls are WALL_UPPER .. WALL_LEFT
+	from the engine.
+	"""
+
+	def __init__(self, width=GROUND_WIDTH, height=GROUND_HEIGHT, goals=(WALL_LEFT, WALL_RIGHT), balls=1):
+		self.width = width
+		self.height = height
+		self.goals = tuple(goals)
+		self.balls = balls
+		self.players = len(self.goals)
+		half = np.array([width / 2, height / 2])
+		self.ball_limit = tuple(half - RADIUS)
+
+		self.bar_start = np.zeros((self.players, 3))
+		self.bar_normal = np.zeros((self.players, 3))
+		self.bar_extents = np.zeros((self.players, 3))
+		self.slide = np.zeros(self.players, np.intp)
+		self.limit = np.zeros(self.players)
+		# Player guarding each column of the time-of-impact table, or -1.
+		self.guard = np.full(BAR + 1, -1, np.intp)
+		for player, wall in enumerate(self.goals):
+			axis = 0 if wall in (WALL_LEFT, WALL_RIGHT) else 1
+			sign = 1.0 if wall in (WALL_RIGHT, WALL_UPPER) else -1.0
+			slide = 1 - axis
+			self.bar_start[player, axis] = sign * (half[axis] - BAR_INSET)
+			self.bar_normal[player, axis] = -sign
+			self.bar_extents[player] = BAR_HALF_EXTENTS
+			self.bar_extents[player, [axis, slide]] = BAR_HALF_EXTENTS[[0, 1]]
+			self.slide[player] = slide
+			self.guard[wall] = player
+			# Bars on neighbouring walls must not run into each other.
+			crossing = any((other in (WALL_LEFT, WALL_RIGHT)) == (slide == 0) for other in self.goals)
+			self.limit[player] = half[slide] - BAR_HEIGHT / 2 - (BAR_INSET + BAR_WIDTH if crossing else 0.0)
+
+		# Balls start on a ring around the centre, heading outwards, far
+		# enough apart not to touch.
+		angle = 2 * np.pi * np.arange(balls) / balls
+		cos, sin = np.cos(angle), np.sin(angle)
+		x, y = START_DIRECTION[:2]
+		ring = 0.0 if balls == 1 else max(0.2, 3 * RADIUS * balls / (2 * np.pi))
+		self.ball_direction = np.stack([cos * x - sin * y, sin * x + cos * y, np.zeros(balls)], axis=1)
+		self.ball_start = self.ball_direction * ring
+
+	@property
+	def coords(self):
+		"""Coordinates in one frame: every ball, then every bar."""
+		return 3 * (self.balls + self.players)
+
+	@property
+	def extent(self):
+		"""Farthest anything in the arena gets from its centre along an axis."""
+		return max(self.width, self.height) / 2
+
+	def layout(self):
+		"""What a client needs to draw the arena."""
+		return {
+			'width': self.width,
+			'height': self.height,
+			'balls': self.balls,
+			'bars': [{'position': start.tolist(), 'size': (2 * extents).tolist()}
+				for start, extents in zip(self.bar_start, self.bar_extents)],
+		}
+
+
+CLASSIC = Arena()
+FOUR_PLAYER = Arena(width=GROUND_HEIGHT + 1.0, height=GROUND_HEIGHT + 1.0,
+	goals=(WALL_LEFT, WALL_RIGHT, WALL_LOWER, WALL_UPPER))
+MULTI_BALL = Arena(balls=3)
+
+ARENAS = {
+	'classic': CLASSIC,
+	'four_player': FOUR_PLAYER,
+	'multi_ball': MULTI_BALL,
+}
+
+
+def sweep_and_prune(lo, hi):
+	"""Index pairs of the boxes ``lo``..``hi`` that overlap.
+
+	Boxes are sorted by their lower x bound and each is only paired with
+	those that start before it ends along x, which are then checked on y
+	and z. The cost grows with the number of boxes plus the number of
+	overlaps, not with every possible pair.
+	"""
+	order = np.argsort(lo[:, 0], kind='stable')
+	start = lo[order, 0]
+	count = np.searchsorted(start, hi[order, 0], side='right') - np.arange(order.size) - 1
+	np.maximum(count, 0, out=count)
+	first = np.repeat(np.arange(order.size), count)
+	second = first + 1 + np.arange(first.size) - np.repeat(np.cumsum(count) - count, count)
+	a = order[first]
+	b = order[second]
+	overlap = np.all((lo[a, 1:] <= hi[b, 1:]) & (lo[b, 1:] <= hi[a, 1:]), axis=1)
+	return a[overlap], b[overlap]
+
+
+class ArenaEngine(BatchEngine):
+	"""BatchEngine for any Arena: several balls and a bar per guarded wall.
+
+	Every array gains a ball or bar axis, so ``sphere_position`` is
+	``(capacity, balls, 3)`` and ``bar_position`` is ``(capacity, players,
+	3)``. Each step runs a sweep-and-prune broad phase over the boxes each
+	ball can reach and the bars of every match, and only the pairs it
+	returns get narrow-phase tests: swept against bars, like BatchEngine,
+	and an overlap test between balls. Walls are a bound per axis and are
+	checked directly.
+	"""
+
+	def __init__(self, arena, capacity=64):
+		self.arena = arena
+		super().__init__(capacity)
+
+	def _allocate(self, capacity):
+		balls = self.arena.balls
+		players = self.arena.players
+		self.capacity = capacity
+		self.sphere_position = np.zeros((capacity, balls, 3))
+		self.sphere_direction = np.zeros((capacity, balls, 3))
+		self.sphere_speed = np.zeros((capacity, balls))
+		self.sphere_box = np.zeros((capacity, balls, 2, 3))
+		self.bar_position = np.zeros((capacity, players, 3))
+		self.bar_box = np.zeros((capacity, players, 2, 3))
+		self.held = np.zeros((capacity, players, 2), bool)
+		self.scores = np.zeros((capacity, players), np.int32)
+		self.columns = (self.sphere_position, self.sphere_direction, self.sphere_speed,
+			self.sphere_box, self.bar_position, self.bar_box, self.held, self.scores)
+
+	def reset(self, row):
+		arena = self.arena
+		self.sphere_position[row] = arena.ball_start
+		self.sphere_direction[row] = arena.ball_direction
+		self.sphere_speed[row] = SPHERE_SPEED
+		self.sphere_box[row, :, 0] = arena.ball_start - RADIUS
+		self.sphere_box[row, :, 1] = arena.ball_start + RADIUS
+		self.bar_position[row] = arena.bar_start
+		self.bar_box[row, :, 0] = arena.bar_start - arena.bar_extents
+		self.bar_box[row, :, 1] = arena.bar_start + arena.bar_extents
+		self.held[row] = False
+		self.scores[row] = 0
+
+	def load(self, handle, sphere_position, sphere_direction, sphere_speed, bar_position, held=False):
+		super().load(handle, sphere_position, sphere_direction, sphere_speed, bar_position, held)
+		row = self.handle_row[handle]
+		self.bar_box[row, :, 0] = self.bar_position[row] - self.arena.bar_extents
+		self.bar_box[row, :, 1] = self.bar_position[row] + self.arena.bar_extents
+
+	def positions(self, handle):
+		row = self.handle_row[handle]
+		return self.sphere_position[row].tolist(), self.bar_position[row].tolist()
+
+	def move_bars(self, n, dt):
+		held = self.held[:n]
+		if not held.any():
+			return
+		arena = self.arena
+		players = np.arange(arena.players)
+		slide = self.bar_position[:n, players, arena.slide]
+		delta = (held[:, :, 0].astype(np.float64) - held[:, :, 1]) * (BAR_SPEED * dt)
+		np.clip(slide + delta, -arena.limit, arena.limit, out=slide)
+		self.bar_position[:n, players, arena.slide] = slide
+		self.bar_box[:n, :, 0] = self.bar_position[:n] - arena.bar_extents
+		self.bar_box[:n, :, 1] = self.bar_position[:n] + arena.bar_extents
+
+	def broad_phase(self, n, dt):
+		"""Candidate ``(ball, bar)`` and ``(ball, ball)`` pairs for this step.
+
+		Indices are into the flattened ball and bar arrays. A ball's box
+		covers everywhere it can reach within ``dt``, whatever it bounces
+		off, so no pair that can touch during the step is missed. Matches
+		are laid side by side along x so they never pair with each other.
+		"""
+		arena = self.arena
+		balls = n * arena.balls
+		position = self.sphere_position[:n].reshape(balls, 3)
+		reach = (RADIUS + self.sphere_speed[:n].reshape(balls, 1) * dt) * np.ones(3)
+		stride = arena.width + 2 * MATCH_GAP
+		ball_shift = np.repeat(np.arange(n) * stride, arena.balls)
+		bar_shift = np.repeat(np.arange(n) * stride, arena.players)
+		lo = np.concatenate([position - reach, self.bar_box[:n, :, 0].reshape(-1, 3) - RADIUS])
+		hi = np.concatenate([position + reach, self.bar_box[:n, :, 1].reshape(-1, 3) + RADIUS])
+		shift = np.concatenate([ball_shift, bar_shift])
+		lo[:, 0] += shift
+		hi[:, 0] += shift
+
+		a, b = sweep_and_prune(lo, hi)
+		first = np.minimum(a, b)
+		second = np.maximum(a, b)
+		ball_bar = (first < balls) & (second >= balls)
+		ball_ball = second < balls
+		return (first[ball_bar], second[ball_bar] - balls), (first[ball_ball], second[ball_ball])
+
+	def advance_balls(self, n, dt):
+		arena = self.arena
+		balls = n * arena.balls
+		position = self.sphere_position[:n].reshape(balls, 3)
+		direction = self.sphere_direction[:n].reshape(balls, 3)
+		speed = self.sphere_speed[:n].reshape(balls, 1)
+		bar_position = self.bar_position[:n].reshape(-1, 3)
+		bar_lo = self.bar_box[:n, :, 0].reshape(-1, 3) - RADIUS
+		bar_hi = self.bar_box[:n, :, 1].reshape(-1, 3) + RADIUS
+		(ball, bar), (first, second) = self.broad_phase(n, dt)
+		player = bar % arena.players
+
+		# A bar that moved onto a ball pushes it out the way a hit would.
+		inside = np.all((position[ball] > bar_lo[bar]) & (position[ball] < bar_hi[bar]), axis=1)
+		if inside.any():
+			hit = ball[inside]
+			direction[hit] = bounce_directions(direction[hit], position[hit], bar_position[bar[inside]],
+				player[inside], normals=arena.bar_normal)
+
+		rows = np.arange(balls)
+		remaining = np.full(balls, dt)
+		active = np.ones(balls, bool)
+		toi = np.empty((balls, BAR + 1))
+		nearest = np.zeros(balls, np.intp)
+		for _ in range(MAX_BOUNCES):
+			velocity = direction * speed
+			wall_impact_times(position, velocity, toi, arena.ball_limit)
+			toi[:, BAR] = np.inf
+			if ball.size:
+				enter, near = box_impact_times(position[ball], velocity[ball], bar_lo[bar], bar_hi[bar])
+				# Earliest bar per ball: sort pairs by ball, then by time.
+				order = np.lexsort((enter, ball))
+				first_pair = order[np.r_[True, ball[order[1:]] != ball[order[:-1]]]]
+				toi[ball[first_pair], BAR] = enter[first_pair]
+				nearest[ball[first_pair]] = first_pair
+
+			event = toi.argmin(axis=1)
+			impact = toi[rows, event]
+			hit = active & (impact <= remaining)
+			advance = np.where(hit, impact, remaining) * active
+			position += velocity * advance[:, None]
+			remaining -= advance
+
+			direction[hit & ((event == WALL_UPPER) | (event == WALL_LOWER)), 1] *= -1.0
+			direction[hit & ((event == WALL_RIGHT) | (event == WALL_LEFT)), 0] *= -1.0
+			goal = hit & (arena.guard[event] >= 0)
+			if goal.any():
+				goal_balls = np.nonzero(goal)[0]
+				self.concede(goal_balls // arena.balls, goal_balls, arena.guard[event[goal_balls]])
+			bar_hit = hit & (event == BAR)
+			if bar_hit.any():
+				hit_rows = np.nonzero(bar_hit)[0]
+				pair = nearest[hit_rows]
+				face = near[pair].argmax(axis=1)
+				direction[hit_rows] = bounce_directions(direction[hit_rows], position[hit_rows],
+					bar_position[bar[pair]], player[pair], face, arena.bar_normal)
+
+			active = hit & (remaining > 0.0)
+			if not active.any():
+				break
+
+		if first.size:
+			self._bounce_off_balls(position, direction, speed, first, second)
+		self.sphere_box[:n, :, 0] = self.sphere_position[:n] - RADIUS
+		self.sphere_box[:n, :, 1] = self.sphere_position[:n] + RADIUS
+
+	def serve(self, balls, player):
+		# Back to its starting point, mirrored if need be so it heads for
+		# the wall of the player who missed it.
+		arena = self.arena
+		ball = balls % arena.balls
+		direction = arena.ball_direction[ball]
+		towards = -arena.bar_normal[player]
+		along = (direction * towards).sum(axis=1, keepdims=True)
+		self.sphere_position.reshape(-1, 3)[balls] = arena.ball_start[ball]
+		self.sphere_direction.reshape(-1, 3)[balls] = direction - 2.0 * np.minimum(along, 0.0) * towards
+
+	def _bounce_off_balls(self, position, direction, speed, first, second):
+		# Balls move a fraction of their diameter per step, so touching
+		# pairs are caught by an overlap test at the end of the step. Each
+		# ball heading into the other is mirrored off the contact normal.
+		offset = position[second] - position[first]
+		distance = np.sqrt((offset * offset).sum(axis=1))
+		velocity = direction * speed
+		closing = ((velocity[first] - velocity[second]) * offset).sum(axis=1) > 0.0
+		touching = (distance < 2 * RADIUS) & (distance > 0.0) & closing
+		if not touching.any():
+			return
+		first = first[touching]
+		second = second[touching]
+		normal = offset[touching] / distance[touching, None]
+		along = (direction[first] * normal).sum(axis=1, keepdims=True)
+		direction[first] -= 2.0 * np.maximum(along, 0.0) * normal
+		along = (direction[second] * normal).sum(axis=1, keepdims=True)
+		direction[second] -= 2.0 * np.minimum(along, 0.0) * normal
@@ -0,0 +1,173 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+from channels.exceptions import ChannelFull
+
+from .protocol import FRAME_POSITIONS
+
+logger = logging.getLogger(__name__)
+
+# Control messages a socket may leave unsent before it is closed. Far more
+# than a live client ever has waiting.
+MAX_CONTROL = 256
+
+# Close code for a client too far behind: try again later.
+CLOSE_OVERLOADED = 1013
+
+
+class Outbox:
+	"""One socket's outbound messages, written out by a task of its own.
+
+	It stands in for the consumer's ASGI ``send``, so accept, close and
+	control messages such as ``player_num`` and ``disconnect_message`` queue
+	in order and are never dropped. Position frames go through ``frame``
+	instead and are replaceable: at most one unsent keyframe and one unsent
+	frame after it are held, and a newer frame overwrites an older unsent
+	one. Deltas are taken against the keyframe, so only a newer keyframe
+	replaces it. A stalled socket holds up nothing but itself.
+
+	Since control messages are kept, a socket that lets more than
+	``max_control`` of them pile up is closed instead.
+	"""
+
+	def __init__(self, send, metrics=None, live=None, max_control=MAX_CONTROL):
+		self._send = send
+		self.metrics = metrics
+		self.live = live
+		self.max_control = max_control
+		self.control = deque()
+		self.closing = False
+		self.keyframe = None
+		self.latest = None
+		# When the frames now waiting started waiting, and how long the last
+		# frame written had waited.
+		self.pending_since = None
+		self.lag = 0.0
+		self.dropped = 0
+		self._wake = asyncio.Event()
+		self._task = asyncio.get_running_loop().create_task(self._run())
+		if live is not None:
+			live.add(self)
+
+	def __len__(self):
+		return len(self.control) + (self.keyframe is not None) + (self.latest is not None)
+
+	async def send(self, message):
+		if self.closing:
+			return
+		if len(self.control) >= self.max_control:
+			logger.warning("closing a socket with %d messages unsent", len(self.control))
+			self.control.clear()
+			self.keyframe = self.latest = self.pending_since = None
+			message = {'type': 'websocket.close', 'code': CLOSE_OVERLOADED}
+		if message['type'] == 'websocket.close':
+			self.closing = True
+		self.control.append(message)
+		self._wake.set()
+
+	def frame(self, bytes_data=None, text_data=None):
+		if bytes_data is not None:
+			message = {'type': 'websocket.send', 'bytes': bytes_data}
+			key = bytes_data[0] == FRAME_POSITIONS
+		else:
+			# JSON frames always carry every position.
+			message = {'type': 'websocket.send', 'text': text_data}
+			key = True
+		if key:
+			replaced = (self.keyframe is not None) + (self.latest is not None)
+			self.keyframe = message
+			self.latest = None
+		else:
+			replaced = self.latest is not None
+			self.latest = message
+		if replaced:
+			self.dropped += replaced
+			if self.metrics is not None:
+				self.metrics.outbound_dropped.inc(replaced)
+		if self.pending_since is None:
+			self.pending_since = time.monotonic()
+		self._wake.set()
+
+	def current_lag(self):
+		if self.pending_since is None:
+			return 0.0
+		return time.monotonic() - self.pending_since
+
+	async def _run(self):
+		while True:
+			await self._wake.wait()
+			self._wake.clear()
+			while len(self):
+				if self.control:
+					message = self.control.popleft()
+				else:
+					if self.keyframe is not None:
+						message, self.keyframe = self.keyframe, None
+					else:
+						message, self.latest = self.latest, None
+					self.lag = time.monotonic() - self.pending_since
+					if self.latest is None:
+						self.pending_since = None
+					if self.metrics is not None:
+						self.metrics.outbound_lag.observe(self.lag)
+				try:
+					await self._send(message)
+				except Exception:
+					logger.exception("socket send failed")
+					return
+				if message['type'] == 'websocket.close':
+					return
+
+	def close(self):
+		self._task.cancel()
+		if self.live is not None:
+			self.live.discard(self)
+
+
+class LocalFanout:
+	"""Queues a match's frame on the outbox of consumers in this process.
+
+	Consumers register under their channel name. Members that are not
+	registered here belong to another process and get the frame through the
+	channel layer instead.
+	"""
+
+	def __init__(self, metrics=None):
+		self.consumers = {}
+		self.metrics = metrics
+
+	def attach(self, channel_name, consumer):
+		self.consumers[channel_name] = consumer
+
+	def detach(self, channel_name):
+		self.consumers.pop(channel_name, None)
+
+	async def publish(self, channel_layer, members, frame, encode_text):
+		text = None
+		for channel_name in members:
+			consumer = self.consumers.get(channel_name)
+			if consumer is not None and consumer.binary:
+				consumer.outbox.frame(bytes_data=frame)
+				continue
+			if text is None:
+				text = encode_text()
+			if consumer is not None:
+				consumer.outbox.frame(text_data=text)
+				continue
+			sent = time.perf_counter()
+			try:
+				await channel_layer.send(channel_name, {
+					'type': 'send_frame',
+					'frame': frame,
+					'text': text,
+				})
+			except ChannelFull:
+				# The member's worker is not keeping up; a later frame
+				# replaces this one.
+				if self.metrics is not None:
+					self.metrics.outbound_dropped.inc()
+				continue
+			if self.metrics is not None:
+				self.metrics.channel_send_duration.observe(time.perf_counter() - sent)
@@ -1,355 +1,535 @@
-from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.layers import get_channel_layer
-import json
-import numpy as np
-import asyncio
-import cProfile
-
-class PongConsumer(AsyncWebsocketConsumer):
-	channel_layer = get_channel_layer()
-	groups = {}
-	groups_info = {}
-	max_group_size = 2
-	radius = 0.04
-	bar_position = 2.5
-	bar_width = 0.08
-	bar_height = 0.7
-	bar_depth = 0.1
-	ground_height = 3.0
-	ground_width = 6.0
-
-
-	async def get_group_member_count(self, channel_name):
-		for group_name, members in PongConsumer.groups.items():
-			if channel_name in members:
-				return len(members)
-		return 0
-
-	async def add_to_group(self, channel_name):
-		for group_name, members in PongConsumer.groups.items():
-			if len(members) < PongConsumer.max_group_size:
-				await PongConsumer.channel_layer.group_add(group_name, channel_name)
-				members.append(channel_name)
-				return group_name
-		new_group_name = f"group_{len(PongConsumer.groups) + 1}"
-		await PongConsumer.channel_layer.group_add(new_group_name, channel_name)
-		PongConsumer.groups[new_group_name] = [channel_name]
-		return new_group_name
-
-	async def send_disconnect_message(self, event):
-		message = event['message']
-		await self.send(text_data=json.dumps({
-			'type': 'disconnect_message',
-			'message': message
-		}))
-
-	async def initialize_group(self):
-		tmp_vector = np.array([1.0, 1.0, 0.0])
-		sphere_direction = tmp_vector / np.linalg.norm(tmp_vector)
-		PongConsumer.groups_info[self.my_group] = {
-			'sphere_direction': [sphere_direction[0], sphere_direction[1], sphere_direction[2]],
-
-			'sphere_position': [0.0, 0.0, 0.0],
-
-			'sphere_speed': 0.03,
-
-			'player_1_score': 0,
-			'player_2_score': 0,
-
-			'p1_bar_position': [-PongConsumer.bar_position, 0.0, 0.0],
-
-			'p2_bar_position': [PongConsumer.bar_position, 0.0, 0.0],
-
-			'p1_moving_up': False,
-
-			'p1_moving_down': False,
-
-			'p2_moving_up': False,
-
-			'p2_moving_down': False,
-
-			'sphere_bounding_box': {
-				'x_min': -PongConsumer.radius,
-				'x_max': PongConsumer.radius,
-				'y_min': -PongConsumer.radius,
-				'y_max': PongConsumer.radius,
-				'z_min': -PongConsumer.radius,
-				'z_max': PongConsumer.radius
-			},
-
-			'p2_bar_box' : {
-				'x_min': PongConsumer.bar_position - PongConsumer.bar_width / 2,
-				'x_max': PongConsumer.bar_position + PongConsumer.bar_width / 2,
-				'y_min': -PongConsumer.bar_height / 2,
-				'y_max': PongConsumer.bar_height / 2,
-				'z_min': -PongConsumer.bar_depth / 2,
-				'z_max': PongConsumer.bar_depth / 2
-			},
-
-			'p1_bar_box' : {
-				'x_min': -PongConsumer.bar_position - PongConsumer.bar_width / 2,
-				'x_max': -PongConsumer.bar_position + PongConsumer.bar_width / 2,
-				'y_min': -PongConsumer.bar_height / 2,
-				'y_max': PongConsumer.bar_height / 2,
-				'z_min': -PongConsumer.bar_depth / 2,
-				'z_max': PongConsumer.bar_depth / 2
-			},
-
-			'upper_plane_normal': [0.0, -1.0, 0.0],
-
-			'upper_plane_constant': PongConsumer.ground_height / 2.0,
-
-			'lower_plane_normal': [0.0, 1.0, 0.0],
-
-			'lower_plane_constant': PongConsumer.ground_height / 2.0,
-
-			'left_plane_normal': [1.0, 0.0, 0.0],
-
-			'left_plane_constant': PongConsumer.ground_width / 2.0,
-
-			'right_plane_normal': [-1.0, 0.0, 0.0],
-
-			'right_plane_constant': PongConsumer.ground_width / 2.0,
-		}
-
-	async def check_box_plane_collision(self, box_coordinates, plane_normal, plane_constant):
-		min, max = 0, 0
-
-		if plane_normal[0] > 0:
-			min = plane_normal[0] * box_coordinates['x_min']
-			max = plane_normal[0] * box_coordinates['x_max']
-		
-		else:
-			min = plane_normal[0] * box_coordinates['x_max']
-			max = plane_normal[0] * box_coordinates['x_min']
-		
-		if plane_normal[1] > 0:
-			min += plane_normal[1] * box_coordinates['y_min']
-			max += plane_normal[1] * box_coordinates['y_max']
-		
-		else:
-			min += plane_normal[1] * box_coordinates['y_max']
-			max += plane_normal[1] * box_coordinates['y_min']
-
-		if plane_normal[2] > 0:
-			min += plane_normal[2] * box_coordinates['z_min']
-			max += plane_normal[2] * box_coordinates['z_max']
-
-		else:
-			min += plane_normal[2] * box_coordinates['z_max']
-			max += plane_normal[2] * box_coordinates['z_min']
-
-		return min <= -plane_constant and max >= -plane_constant
-
-	async def check_box_bar_collision(self, box1_coordinates, box2_coordinates):
-		return not (box1_coordinates['x_max'] < box2_coordinates['x_min'] or
-				box1_coordinates['x_min'] > box2_coordinates['x_max'] or
-				box1_coordinates['y_max'] < box2_coordinates['y_min'] or
-				box1_coordinates['y_min'] > box2_coordinates['y_max'] or
-				box1_coordinates['z_max'] < box2_coordinates['z_min'] or
-				box1_coordinates['z_min'] > box2_coordinates['z_max'])
-
-	async def reflect_vector(self, vector, normal):
-		vector = np.array(vector)
-		normal = np.array(normal)
-		return vector - 2 * np.dot(vector, normal) * normal
-
-	async def reflect_vector_from_bar(self, sphere_position, normal, bar_position):
-		tmp_vector = np.array([0, 0, 0])
-		position = np.array([sphere_position[0], sphere_position[1], sphere_position[2]])
-		b_position = np.array([bar_position[0], bar_position[1], bar_position[2]])
-		tmp_vector = (position - b_position) + normal
-		return tmp_vector / np.linalg.norm(tmp_vector)
-
-	async def check_sphere_collision(self):
-		if await self.check_box_plane_collision(PongConsumer.groups_info[self.my_group]['sphere_bounding_box'], PongConsumer.groups_info[self.my_group]['upper_plane_normal'], PongConsumer.groups_info[self.my_group]['upper_plane_constant']):
-			PongConsumer.groups_info[self.my_group]['sphere_direction'] = await self.reflect_vector(PongConsumer.groups_info[self.my_group]['sphere_direction'], PongConsumer.groups_info[self.my_group]['upper_plane_normal'])
-
-		elif await self.check_box_plane_collision(PongConsumer.groups_info[self.my_group]['sphere_bounding_box'], PongConsumer.groups_info[self.my_group]['lower_plane_normal'], PongConsumer.groups_info[self.my_group]['lower_plane_constant']):
-			PongConsumer.groups_info[self.my_group]['sphere_direction'] = await self.reflect_vector(PongConsumer.groups_info[self.my_group]['sphere_direction'], PongConsumer.groups_info[self.my_group]['lower_plane_normal'])
-
-		elif await self.check_box_plane_collision(PongConsumer.groups_info[self.my_group]['sphere_bounding_box'], PongConsumer.groups_info[self.my_group]['left_plane_normal'], PongConsumer.groups_info[self.my_group]['left_plane_constant']):
-			PongConsumer.groups_info[self.my_group]['sphere_direction'] = await self.reflect_vector(PongConsumer.groups_info[self.my_group]['sphere_direction'], PongConsumer.groups_info[self.my_group]['left_plane_normal'])
-
-		elif await self.check_box_plane_collision(PongConsumer.groups_info[self.my_group]['sphere_bounding_box'], PongConsumer.groups_info[self.my_group]['right_plane_normal'], PongConsumer.groups_info[self.my_group]['right_plane_constant']):
-			PongConsumer.groups_info[self.my_group]['sphere_direction'] = await self.reflect_vector(PongConsumer.groups_info[self.my_group]['sphere_direction'], PongConsumer.groups_info[self.my_group]['right_plane_normal'])
-
-		elif await self.check_box_bar_collision(PongConsumer.groups_info[self.my_group]['sphere_bounding_box'], PongConsumer.groups_info[self.my_group]['p1_bar_box']):
-			PongConsumer.groups_info[self.my_group]['sphere_direction'] = await self.reflect_vector_from_bar(PongConsumer.groups_info[self.my_group]['sphere_position'], np.array([1, 0, 0]), PongConsumer.groups_info[self.my_group]['p1_bar_position'])
-
-		elif await self.check_box_bar_collision(PongConsumer.groups_info[self.my_group]['sphere_bounding_box'], PongConsumer.groups_info[self.my_group]['p2_bar_box']):
-			PongConsumer.groups_info[self.my_group]['sphere_direction'] = await self.reflect_vector_from_bar(PongConsumer.groups_info[self.my_group]['sphere_position'], np.array([-1, 0, 0]), PongConsumer.groups_info[self.my_group]['p2_bar_position'])
-
-	async def moving_bar_bounding_box(self, box_coordinates, speed):
-		box_coordinates['y_min'] += speed
-		box_coordinates['y_max'] += speed
-
-	async def moving_sphere_bounding_box(self, box_coordinates):
-		box_coordinates['x_min'] += PongConsumer.groups_info[self.my_group]['sphere_direction'][0] * PongConsumer.groups_info[self.my_group]['sphere_speed']
-		box_coordinates['x_max'] += PongConsumer.groups_info[self.my_group]['sphere_direction'][0] * PongConsumer.groups_info[self.my_group]['sphere_speed']
-		box_coordinates['y_min'] += PongConsumer.groups_info[self.my_group]['sphere_direction'][1] * PongConsumer.groups_info[self.my_group]['sphere_speed']
-		box_coordinates['y_max'] += PongConsumer.groups_info[self.my_group]['sphere_direction'][1] * PongConsumer.groups_info[self.my_group]['sphere_speed']
-		box_coordinates['z_min'] += PongConsumer.groups_info[self.my_group]['sphere_direction'][2] * PongConsumer.groups_info[self.my_group]['sphere_speed']
-		box_coordinates['z_max'] += PongConsumer.groups_info[self.my_group]['sphere_direction'][2] * PongConsumer.groups_info[self.my_group]['sphere_speed']
-
-	async def main_loop(self):
-		while True:
-			await self.check_sphere_collision()
-
-			# if PongConsumer.groups_info[self.my_group]['p1_moving_up'] and not await self.check_box_plane_collision(PongConsumer.groups_info[self.my_group]['p1_bar_box'], PongConsumer.groups_info[self.my_group]['upper_plane_normal'], PongConsumer.groups_info[self.my_group]['upper_plane_constant']):
-			# 	PongConsumer.groups_info[self.my_group]['p1_bar_position'][1] += 0.03
-			# 	await self.moving_bar_bounding_box(PongConsumer.groups_info[self.my_group]['p1_bar_box'], 0.03)
-			# if PongConsumer.groups_info[self.my_group]['p1_moving_down'] and not await self.check_box_plane_collision(PongConsumer.groups_info[self.my_group]['p1_bar_box'], PongConsumer.groups_info[self.my_group]['lower_plane_normal'], PongConsumer.groups_info[self.my_group]['lower_plane_constant']):
-			# 	PongConsumer.groups_info[self.my_group]['p1_bar_position'][1] -= 0.03
-			# 	await self.moving_bar_bounding_box(PongConsumer.groups_info[self.my_group]['p1_bar_box'], -0.03)
-			
-			# if PongConsumer.groups_info[self.my_group]['p2_moving_up'] and not await self.check_box_plane_collision(PongConsumer.groups_info[self.my_group]['p2_bar_box'], PongConsumer.groups_info[self.my_group]['upper_plane_normal'], PongConsumer.groups_info[self.my_group]['upper_plane_constant']):
-			# 	PongConsumer.groups_info[self.my_group]['p2_bar_position'][1] += 0.03
-			# 	await self.moving_bar_bounding_box(PongConsumer.groups_info[self.my_group]['p2_bar_box'], 0.03)
-			# if PongConsumer.groups_info[self.my_group]['p2_moving_down'] and not await self.check_box_plane_collision(PongConsumer.groups_info[self.my_group]['p2_bar_box'], PongConsumer.groups_info[self.my_group]['lower_plane_normal'], PongConsumer.groups_info[self.my_group]['lower_plane_constant']):
-			# 	PongConsumer.groups_info[self.my_group]['p2_bar_position'][1] -= 0.03
-			# 	await self.moving_bar_bounding_box(PongConsumer.groups_info[self.my_group]['p2_bar_box'], -0.03)
-
-			PongConsumer.groups_info[self.my_group]['sphere_position'][0] += PongConsumer.groups_info[self.my_group]['sphere_direction'][0] * PongConsumer.groups_info[self.my_group]['sphere_speed']
-			PongConsumer.groups_info[self.my_group]['sphere_position'][1] += PongConsumer.groups_info[self.my_group]['sphere_direction'][1] * PongConsumer.groups_info[self.my_group]['sphere_speed']
-			PongConsumer.groups_info[self.my_group]['sphere_position'][2] += PongConsumer.groups_info[self.my_group]['sphere_direction'][2] * PongConsumer.groups_info[self.my_group]['sphere_speed']
-
-			await self.moving_sphere_bounding_box(PongConsumer.groups_info[self.my_group]['sphere_bounding_box'])
-
-			await PongConsumer.channel_layer.group_send(
-			    self.my_group,
-			    {
-			        'type': 'send_positions',
-			        'sphere_position': PongConsumer.groups_info[self.my_group]['sphere_position'],
-			        'p1_bar_position': PongConsumer.groups_info[self.my_group]['p1_bar_position'],
-			        'p2_bar_position': PongConsumer.groups_info[self.my_group]['p2_bar_position']
-			    }
-			)
-			asyncio.sleep(1000 / 60)
-
-
-	async def send_positions(self, event):
-		sphere_position = event['sphere_position']
-		p1_bar_position = event['p1_bar_position']
-		p2_bar_position = event['p2_bar_position']
-		await self.send(text_data=json.dumps({
-			'type': 'positions',
-			'sphere_position': sphere_position,
-			'p1_bar_position': p1_bar_position,
-			'p2_bar_position': p2_bar_position
-		}))
-
-	# async def send_sphere_position(self, event):
-	# 	sphere_position = event['sphere_position']
-	# 	await self.send(text_data=json.dumps({
-	# 		'type': 'sphere_position',
-	# 		'sphere_position': sphere_position
-	# 	}))
-
-	# async def send_p1_bar_position(self, event):
-	# 	p1_bar_position = event['p1_bar_position']
-	# 	await self.send(text_data=json.dumps({
-	# 		'type': 'p1_bar_position',
-	# 		'p1_bar_position': p1_bar_position
-	# 	}))
-
-	# async def send_p2_bar_position(self, event):
-	# 	p2_bar_position = event['p2_bar_position']
-	# 	await self.send(text_data=json.dumps({
-	# 		'type': 'p2_bar_position',
-	# 		'p2_bar_position': p2_bar_position
-	# 	}))
-
-	async def connect(self):
-		self.my_group = await self.add_to_group(self.channel_name)
-		await self.accept()
-		my_group_member_count = await self.get_group_member_count(self.channel_name)
-		if my_group_member_count == 1:
-			await self.send(text_data=json.dumps({
-				'type': 'player_num',
-				'player_num': 1
-			}))
-		if my_group_member_count == 2:
-			await self.send(text_data=json.dumps({
-				'type': 'player_num',
-				'player_num': 2
-			}))
-			await self.initialize_group()
-			asyncio.create_task(self.main_loop())
-
-	async def disconnect(self, close_code):
-		await self.channel_layer.group_send(
-			self.my_group,
-			{
-				'type': 'send_disconnect_message',
-				'message': 'disconnect_all'
-			}
-		)
-
-		# await self.channel_layer.group_discard(
-        #     self.my_group,
-        #     self.channel_name
-        # )
-
-	async def handle_keydown(self, data):
-		player_key = f"p{data['player_num']}_bar"
-		position_key = f"{player_key}_position"
-		box_key = f"{player_key}_box"
-		direction = 0.05 if data['keycode'] == 'ArrowUp' else -0.05 if data['keycode'] == 'ArrowDown' else 0
-
-		if direction != 0 and not await self.check_box_plane_collision(
-			PongConsumer.groups_info[self.my_group][box_key],
-			PongConsumer.groups_info[self.my_group][f"{'upper' if direction > 0 else 'lower'}_plane_normal"],
-			PongConsumer.groups_info[self.my_group][f"{'upper' if direction > 0 else 'lower'}_plane_constant"]
-		):
-			PongConsumer.groups_info[self.my_group][position_key][1] += direction
-			await self.moving_bar_bounding_box(PongConsumer.groups_info[self.my_group][box_key], direction)
-
-	async def receive(self, text_data):
-		data = json.loads(text_data)
-
-		if data['type'] == 'disconnect':
-			self.close()
-
-		elif data['type'] == 'keydown':
-			await self.handle_keydown(data)
-		# elif data['type'] == 'keydown':
-		# 	if data['keycode'] == 'ArrowUp':
-		# 		if data['player_num'] == 1:
-		# 			PongConsumer.groups_info[self.my_group]['p1_moving_up'] = True
-		# 		else:
-		# 			PongConsumer.groups_info[self.my_group]['p2_moving_up'] = True
-		# 	elif data['keycode'] == 'ArrowDown':
-		# 		if data['player_num'] == 1:
-		# 			PongConsumer.groups_info[self.my_group]['p1_moving_down'] = True
-		# 		else:
-		# 			PongConsumer.groups_info[self.my_group]['p2_moving_down'] = True
-
-		# 	elif data['type'] == 'keyup':
-		# 		if data['keycode'] == 'ArrowUp':
-		# 			if data['player_num'] == 1:
-		# 				PongConsumer.groups_info[self.my_group]['p1_moving_up'] = False
-		# 			else:
-		# 				PongConsumer.groups_info[self.my_group]['p2_moving_up'] = False
-		# 		elif data['keycode'] == 'ArrowDown':
-		# 			if data['player_num'] == 1:
-		# 				PongConsumer.groups_info[self.my_group]['p1_moving_down'] = False
-		# 			else:
-		# 				PongConsumer.groups_info[self.my_group]['p2_moving_down'] = False
-		# if data['type'] == 'keydown':
-		# 	if data['keycode'] == 'ArrowUp':
-		# 		if data['player_num'] == 1 and not await self.check_box_plane_collision(PongConsumer.groups_info[self.my_group]['p1_bar_box'], PongConsumer.groups_info[self.my_group]['upper_plane_normal'], PongConsumer.groups_info[self.my_group]['upper_plane_constant']):
-		# 			PongConsumer.groups_info[self.my_group]['p1_bar_position'][1] += 0.03
-		# 			await self.moving_bar_bounding_box(PongConsumer.groups_info[self.my_group]['p1_bar_box'], 0.03)
-		# 		elif data['player_num'] == 2 and not await self.check_box_plane_collision(PongConsumer.groups_info[self.my_group]['p2_bar_box'], PongConsumer.groups_info[self.my_group]['upper_plane_normal'], PongConsumer.groups_info[self.my_group]['upper_plane_constant']):
-		# 			PongConsumer.groups_info[self.my_group]['p2_bar_position'][1] += 0.03
-		# 			await self.moving_bar_bounding_box(PongConsumer.groups_info[self.my_group]['p2_bar_box'], 0.03)
-		# 	elif data['keycode'] == 'ArrowDown':
-		# 		if data['player_num'] == 1 and not await self.check_box_plane_collision(PongConsumer.groups_info[self.my_group]['p1_bar_box'], PongConsumer.groups_info[self.my_group]['lower_plane_normal'], PongConsumer.groups_info[self.my_group]['lower_plane_constant']):
-		# 			PongConsumer.groups_info[self.my_group]['p1_bar_position'][1] -= 0.03
-		# 			await self.moving_bar_bounding_box(PongConsumer.groups_info[self.my_group]['p1_bar_box'], -0.03)
-		# 		elif data['player_num'] == 2 and not await self.check_box_plane_collision(PongConsumer.groups_info[self.my_group]['p2_bar_box'], PongConsumer.groups_info[self.my_group]['lower_plane_normal'], PongConsumer.groups_info[self.my_group]['lower_plane_constant']):
-		# 			PongConsumer.groups_info[self.my_group]['p2_bar_position'][1] -= 0.03
-		# 			await self.moving_bar_bounding_box(PongConsumer.groups_info[self.my_group]['p2_bar_box'], -0.03)
-
-
+from channels.generic.websocket import AsyncWebsocketConsumer
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import ImproperlyConfigured
+from urllib.parse import parse_qs
+import json
+import asyncio
+import uuid
+
+from .arena import ARENAS, CLASSIC, ArenaEngine
+from .broadcast import LocalFanout, Outbox
+from .engine import BatchEngine, KEY_DOWN, KEY_UP
+from .events import EventDrivenEngine
+from .matchmaking import Matchmaker
+from .metrics import LoopMetrics
+from .persistence import ResultWriter
+from .profiling import Profiler
+from .protocol import FrameEncoder, SUBPROTOCOL_BINARY, positions_text
+from .ratelimit import TokenBucket
+from .registry import RedisRegistry, redis_from_settings
+from .replay import Recorder
+from .resume import read_resume_token, resume_token
+from .scheduler import TickScheduler
+from .sharding import LOBBY_SHARD, shard_channel, shard_for
+from .snapshot import check_snapshot, restore, snapshot
+from .spectators import Spectators
+from .state import MatchState
+
+# Up moves a bar towards +y, or towards +x for bars on the upper and lower
+# walls of an arena, where the left and right arrows feel more natural.
+KEYS = {'ArrowUp': KEY_UP, 'ArrowDown': KEY_DOWN, 'ArrowRight': KEY_UP, 'ArrowLeft': KEY_DOWN}
+TICK_RATE = getattr(settings, 'PONG_TICK_RATE', 60)
+BROADCAST_RATE = getattr(settings, 'PONG_BROADCAST_RATE', TICK_RATE)
+SIMULATION = getattr(settings, 'PONG_SIMULATION', 'fixed')
+SHARDS = getattr(settings, 'PONG_SHARDS', 0)
+REGISTRY = getattr(settings, 'PONG_REGISTRY', 'lobby')
+PROFILE_DIR = getattr(settings, 'PONG_PROFILE_DIR', settings.BASE_DIR / 'profiles')
+RECORD_DIR = getattr(settings, 'PONG_RECORD_DIR', None)
+SPECTATOR_RATE = getattr(settings, 'PONG_SPECTATOR_RATE', 10)
+RESUME_TIMEOUT = getattr(settings, 'PONG_RESUME_TIMEOUT', 30)
+WINNING_SCORE = getattr(settings, 'PONG_WINNING_SCORE', 5)
+RESULTS_INTERVAL = getattr(settings, 'PONG_RESULTS_INTERVAL', 1.0)
+RESULTS_BATCH = getattr(settings, 'PONG_RESULTS_BATCH', 500)
+ARENA_NAME = getattr(settings, 'PONG_ARENA', 'classic')
+ARENA = ARENAS[ARENA_NAME]
+
+if ARENA is not CLASSIC:
+	if SIMULATION == 'events':
+		raise ImproperlyConfigured("PONG_SIMULATION = 'events' only supports the classic arena")
+	ENGINE, LOOP_RATE = ArenaEngine(ARENA), TICK_RATE
+elif SIMULATION == 'events':
+	# Positions are evaluated in closed form, so the loop only has to run
+	# as often as frames go out.
+	ENGINE, LOOP_RATE = EventDrivenEngine(), BROADCAST_RATE
+else:
+	ENGINE, LOOP_RATE = BatchEngine(), TICK_RATE
+
+class QueuedConsumer(AsyncWebsocketConsumer):
+	"""Sends everything through an Outbox, so a slow client never blocks the sender."""
+
+	outboxes = set()
+
+	async def __call__(self, scope, receive, send):
+		self.outbox = Outbox(send, PongConsumer.metrics, QueuedConsumer.outboxes)
+		try:
+			await super().__call__(scope, receive, self.outbox.send)
+		finally:
+			self.outbox.close()
+
+
+class PongConsumer(QueuedConsumer):
+	engine = ENGINE
+	encoder = FrameEncoder(keyframe_interval=LOOP_RATE, coords=ARENA.coords, extent=ARENA.extent)
+	metrics = LoopMetrics()
+	scheduler = TickScheduler(rate=LOOP_RATE, broadcast_rate=BROADCAST_RATE, engine=engine, encoder=encoder, metrics=metrics)
+	matchmaker = Matchmaker(max_size=ARENA.players)
+	fanout = LocalFanout(metrics=metrics)
+	spectators = Spectators(scheduler, SPECTATOR_RATE)
+	profiler = Profiler(scheduler, PROFILE_DIR)
+	# Input logs replay through the fixed-step classic engine only.
+	recorder = Recorder(RECORD_DIR, scheduler) if RECORD_DIR and SIMULATION == 'fixed' and ARENA is CLASSIC else None
+	results = ResultWriter(RESULTS_INTERVAL, RESULTS_BATCH, metrics)
+	groups_info = {}
+	# Set by drain(): this worker takes no more players.
+	draining = False
+	# Resume key -> (match_id, expiry task, snapshot) of restored matches
+	# still waiting for some of their players.
+	resuming = {}
+	# With shards, matches are simulated by `runshard` processes and this
+	# consumer only relays the socket.
+	shards = SHARDS
+	registry = RedisRegistry(redis_from_settings(), max_size=ARENA.players) if REGISTRY == 'redis' else None
+	# Clients only report key state changes, so a few messages per second
+	# is plenty; anything above this is dropped.
+	input_rate = 20
+	input_burst = 40
+	# Keyframe requests have their own, smaller allowance: clients repeat
+	# them until a keyframe arrives, and only the first one matters.
+	keyframe_rate = 2
+	keyframe_burst = 2
+	# Set once the consumer has let go of its match.
+	left = False
+
+	async def __call__(self, scope, receive, send):
+		try:
+			await super().__call__(scope, receive, send)
+		finally:
+			# A consumer that crashed never gets websocket.disconnect; its
+			# match must not outlive it.
+			await self.leave()
+
+	async def add_to_group(self, channel_name):
+		match_id, player_num = PongConsumer.matchmaker.join(channel_name)
+		await self.channel_layer.group_add(match_id, channel_name)
+		return match_id, player_num
+
+	async def send_disconnect_message(self, event):
+		message = event['message']
+		await self.send(text_data=json.dumps({
+			'type': 'disconnect_message',
+			'message': message
+		}))
+
+	async def initialize_group(self):
+		self.match = MatchState(self.my_group, PongConsumer.engine)
+		if PongConsumer.recorder is not None:
+			PongConsumer.recorder.open(self.match)
+		PongConsumer.groups_info[self.my_group] = self.match
+
+	async def step(self):
+		match = self.match
+		if match.handle is None:
+			return
+		await PongConsumer.fanout.publish(
+			self.channel_layer,
+			PongConsumer.matchmaker.members(self.my_group),
+			PongConsumer.encoder.frame(match.row),
+			self.encode_positions
+		)
+		spectators = PongConsumer.spectators
+		if self.my_group in spectators.audiences and spectators.due():
+			spectators.publish(self.my_group, PongConsumer.encoder.keyframe(match.row), self.encode_positions)
+		if match.handle in PongConsumer.engine.scored:
+			await self.channel_layer.group_send(self.my_group, {
+				'type': 'send_score',
+				'scores': match.scores
+			})
+			winner = match.winner(WINNING_SCORE)
+			if winner is not None:
+				await self.finish(match, winner)
+
+	async def finish(self, match, winner):
+		# Saving happens later, off the tick; see ResultWriter.
+		PongConsumer.results.record(self.my_group, ARENA_NAME, match.started_at, match.scores, winner)
+		await self.channel_layer.group_send(self.my_group, {
+			'type': 'send_disconnect_message',
+			'message': 'match_over'
+		})
+		await self.end_match()
+
+	async def abort(self):
+		# The match's tick failed; end it as if a player had left.
+		await self.channel_layer.group_send(self.my_group, {
+			'type': 'send_disconnect_message',
+			'message': 'disconnect_all'
+		})
+		await self.end_match()
+
+	def encode_positions(self):
+		return positions_text(self.match, PongConsumer.scheduler.tick_count, PongConsumer.scheduler.frame_time)
+
+	async def send_frame(self, event):
+		if self.binary:
+			self.outbox.frame(bytes_data=event['frame'])
+		else:
+			self.outbox.frame(text_data=event['text'])
+
+	# async def send_sphere_position(self, event):
+	# 	sphere_position = event['sphere_position']
+	# 	await self.send(text_data=json.dumps({
+	# 		'type': 'sphere_position',
+	# 		'sphere_position': sphere_position
+	# 	}))
+
+	# async def send_p1_bar_position(self, event):
+	# 	p1_bar_position = event['p1_bar_position']
+	# 	await self.send(text_data=json.dumps({
+	# 		'type': 'p1_bar_position',
+	# 		'p1_bar_position': p1_bar_position
+	# 	}))
+
+	# async def send_p2_bar_position(self, event):
+	# 	p2_bar_position = event['p2_bar_position']
+	# 	await self.send(text_data=json.dumps({
+	# 		'type': 'p2_bar_position',
+	# 		'p2_bar_position': p2_bar_position
+	# 	}))
+
+	async def send_score(self, event):
+		await self.send(text_data=json.dumps({
+			'type': 'score',
+			'scores': event['scores']
+		}))
+
+	async def send_resume(self, event):
+		await self.send(text_data=json.dumps({
+			'type': 'resume',
+			'token': event['token']
+		}))
+		await self.close()
+
+	async def send_player_num(self):
+		await self.send(text_data=json.dumps({
+			'type': 'player_num',
+			'player_num': self.player_num,
+			'broadcast_rate': PongConsumer.scheduler.broadcast_rate,
+			'arena': ARENA.layout()
+		}))
+
+	async def connect(self):
+		self.input_seq = [0, 0]
+		self.input_bucket = TokenBucket(PongConsumer.input_rate, PongConsumer.input_burst)
+		self.keyframe_bucket = TokenBucket(PongConsumer.keyframe_rate, PongConsumer.keyframe_burst)
+		self.binary = SUBPROTOCOL_BINARY in self.scope.get('subprotocols', ())
+		if PongConsumer.draining:
+			await self.close()
+			return
+		token = parse_qs(self.scope.get('query_string', b'').decode()).get('resume')
+		if token and not PongConsumer.shards:
+			await self.resume(token[0])
+			return
+		if PongConsumer.shards:
+			self.my_group = self.player_num = self.owner = None
+			await self.accept(SUBPROTOCOL_BINARY if self.binary else None)
+			if PongConsumer.registry is not None:
+				PongConsumer.fanout.attach(self.channel_name, self)
+				await self.join_registry()
+				return
+			await self.channel_layer.send(shard_channel(LOBBY_SHARD), {
+				'type': 'lobby.join',
+				'channel': self.channel_name
+			})
+			return
+		self.my_group, self.player_num = await self.add_to_group(self.channel_name)
+		await self.accept(SUBPROTOCOL_BINARY if self.binary else None)
+		PongConsumer.fanout.attach(self.channel_name, self)
+		await self.send_player_num()
+		if self.player_num == PongConsumer.matchmaker.max_size:
+			await self.initialize_group()
+			PongConsumer.scheduler.register(self.my_group, self.step, self.abort)
+
+	async def resume(self, token):
+		try:
+			key, player_num, data = read_resume_token(token, RESUME_TIMEOUT)
+			# A snapshot this worker cannot continue, e.g. from another
+			# arena or release, is refused before the player takes a seat.
+			check_snapshot(data, PongConsumer.engine)
+		except (signing.BadSignature, ValueError):
+			await self.close()
+			return
+		matchmaker = PongConsumer.matchmaker
+		waiting = PongConsumer.resuming.get(key)
+		if waiting is None:
+			match_id = matchmaker.new_id()
+			expiry = asyncio.get_running_loop().create_task(self.expire_resume(key))
+			PongConsumer.resuming[key] = (match_id, expiry, data)
+		else:
+			match_id = waiting[0]
+			seats = matchmaker.matches.get(match_id)
+			if seats is None or seats[player_num - 1] is not None:
+				await self.close()
+				return
+		self.my_group, self.player_num = match_id, player_num
+		full = matchmaker.seat(match_id, player_num, self.channel_name)
+		await self.channel_layer.group_add(match_id, self.channel_name)
+		await self.accept(SUBPROTOCOL_BINARY if self.binary else None)
+		PongConsumer.fanout.attach(self.channel_name, self)
+		await self.send_player_num()
+		if full:
+			# The entry stays until the match ends, so a seat is only taken
+			# back once.
+			self.match, _ = restore(data, match_id, PongConsumer.engine)
+			if PongConsumer.recorder is not None:
+				PongConsumer.recorder.open(self.match)
+			PongConsumer.groups_info[match_id] = self.match
+			PongConsumer.scheduler.register(match_id, self.step, self.abort)
+
+	async def expire_resume(self, key):
+		# Not every player came back; let the ones who did go.
+		await asyncio.sleep(RESUME_TIMEOUT)
+		match_id, _, _ = PongConsumer.resuming.pop(key)
+		if match_id in PongConsumer.groups_info:
+			return
+		for channel_name in PongConsumer.matchmaker.end(match_id):
+			await self.channel_layer.group_discard(match_id, channel_name)
+			await self.channel_layer.send(channel_name, {
+				'type': 'send_disconnect_message',
+				'message': 'disconnect_all'
+			})
+
+	@classmethod
+	async def drain(cls):
+		"""Stop taking players and hand every match back to its clients.
+
+		Each player of a live match is sent a resume token carrying the
+		match's snapshot, then disconnected. Reconnecting with
+		``?resume=<token>`` continues the match on whichever worker takes the
+		connection, once all of its players are back; they must reach the
+		same worker. Players still waiting for an opponent are told to
+		reconnect. Finished matches still waiting to be saved are written
+		first. Returns the number of matches handed off.
+		"""
+		cls.draining = True
+		channel_layer = get_channel_layer()
+		drain_id = uuid.uuid4().hex
+		tick = cls.scheduler.tick_count
+		handed_off = 0
+		for match_id in list(cls.matchmaker.matches):
+			members = list(cls.matchmaker.members(match_id))
+			match = cls.groups_info.pop(match_id, None)
+			if match is not None and match.handle is not None:
+				key, data = f'{drain_id}/{match_id}', snapshot(match, tick)
+				handed_off += 1
+			else:
+				key, data = next(((key, data) for key, (waiting, _, data) in cls.resuming.items()
+					if waiting == match_id), (None, None))
+			cls.scheduler.unregister(match_id)
+			if match is not None:
+				match.release()
+			cls.matchmaker.end(match_id)
+			await cls.spectators.end(match_id)
+			for player_num, channel_name in enumerate(members, 1):
+				if channel_name is None:
+					continue
+				await channel_layer.group_discard(match_id, channel_name)
+				await channel_layer.send(channel_name, {
+					'type': 'send_resume',
+					'token': resume_token(key, player_num, data) if key is not None else None
+				})
+		for _, expiry, _ in cls.resuming.values():
+			expiry.cancel()
+		cls.resuming.clear()
+		await cls.results.flush()
+		return handed_off
+
+	async def match_assigned(self, event):
+		self.my_group = event['match_id']
+		self.player_num = event['player_num']
+		self.owner = shard_channel(shard_for(self.my_group, PongConsumer.shards))
+		await self.send_player_num()
+		# Until now frames came through the channel layer, behind this
+		# message; delivering them directly earlier could overtake it.
+		PongConsumer.fanout.attach(self.channel_name, self)
+
+	async def join_registry(self):
+		registry = PongConsumer.registry
+		self.my_group, self.player_num = await registry.join(self.channel_name)
+		await self.send_player_num()
+		if self.player_num == registry.max_size:
+			# The hashed shard is only a suggestion; it simulates the match if
+			# it wins the lease and then sends us `match_owner`.
+			await self.channel_layer.send(shard_channel(shard_for(self.my_group, PongConsumer.shards)), {
+				'type': 'match.start',
+				'match_id': self.my_group,
+				'members': await registry.members(self.my_group)
+			})
+
+	async def match_owner(self, event):
+		self.owner = event['owner']
+
+	async def leave_registry(self):
+		ended = await PongConsumer.registry.leave(self.channel_name)
+		if ended is None:
+			return
+		match_id, members = ended
+		for channel_name in members:
+			if channel_name != self.channel_name:
+				await self.channel_layer.send(channel_name, {
+					'type': 'send_disconnect_message',
+					'message': 'disconnect_all'
+				})
+		owner = await PongConsumer.registry.owner(match_id)
+		if owner is not None:
+			await self.channel_layer.send(owner, {'type': 'match.end', 'match_id': match_id})
+
+	async def send_to_owner(self, message):
+		if self.owner is None:
+			return
+		message['match_id'] = self.my_group
+		await self.channel_layer.send(self.owner, message)
+
+	async def disconnect(self, close_code):
+		await self.leave()
+
+	async def leave(self):
+		if self.left or not hasattr(self, 'input_seq'):
+			return
+		self.left = True
+		PongConsumer.fanout.detach(self.channel_name)
+		if PongConsumer.shards and PongConsumer.registry is not None:
+			await self.leave_registry()
+			return
+		if PongConsumer.shards:
+			await self.channel_layer.send(shard_channel(LOBBY_SHARD), {
+				'type': 'lobby.leave',
+				'channel': self.channel_name
+			})
+			return
+		if PongConsumer.matchmaker.lookup(self.channel_name) is None:
+			return
+		await self.channel_layer.group_discard(self.my_group, self.channel_name)
+		await self.channel_layer.group_send(
+			self.my_group,
+			{
+				'type': 'send_disconnect_message',
+				'message': 'disconnect_all'
+			}
+		)
+
+		await self.end_match()
+
+	async def end_match(self):
+		members = PongConsumer.matchmaker.end(self.my_group)
+		PongConsumer.scheduler.unregister(self.my_group)
+		match = PongConsumer.groups_info.pop(self.my_group, None)
+		if match is not None:
+			match.release()
+		for channel_name in members:
+			await self.channel_layer.group_discard(self.my_group, channel_name)
+		await PongConsumer.spectators.end(self.my_group)
+		for key, (match_id, expiry, _) in list(PongConsumer.resuming.items()):
+			if match_id == self.my_group:
+				expiry.cancel()
+				del PongConsumer.resuming[key]
+
+	async def handle_key(self, data, pressed):
+		keycode = data.get('keycode')
+		key = KEYS.get(keycode) if isinstance(keycode, str) else None
+		seq = data.get('seq', 0)
+		# Anything but a newer integer seq is stale, repeated or malformed.
+		if key is None or not isinstance(seq, int) or seq <= self.input_seq[key]:
+			return
+		self.input_seq[key] = seq
+		if PongConsumer.shards:
+			await self.send_to_owner({
+				'type': 'match.input',
+				'player': self.player_num,
+				'key': key,
+				'pressed': pressed
+			})
+			return
+		match = PongConsumer.groups_info.get(self.my_group)
+		if match is not None and match.handle is not None:
+			match.set_held(self.player_num, key, pressed)
+
+	async def receive(self, text_data=None, bytes_data=None):
+		PongConsumer.metrics.inputs.inc()
+		if text_data is None:
+			return
+		try:
+			data = json.loads(text_data)
+		except ValueError:
+			return
+		if not isinstance(data, dict):
+			return
+		kind = data.get('type')
+
+		if kind == 'disconnect':
+			await self.close()
+
+		elif kind == 'keydown' or kind == 'keyup':
+			if not self.input_bucket.allow():
+				PongConsumer.metrics.inputs_dropped.inc()
+				return
+			await self.handle_key(data, kind == 'keydown')
+
+		elif kind == 'keyframe_request':
+			if not self.keyframe_bucket.allow():
+				PongConsumer.metrics.inputs_dropped.inc()
+				return
+			if PongConsumer.shards:
+				await self.send_to_owner({'type': 'match.keyframe'})
+				return
+			match = PongConsumer.groups_info.get(self.my_group)
+			if match is not None and match.handle is not None:
+				PongConsumer.encoder.request_keyframe(match.handle)
+
+
+class SpectatorConsumer(QueuedConsumer):
+	"""Watches one live match at PONG_SPECTATOR_RATE; input is ignored.
+
+	Every spectator of a match gets the same keyframe bytes (or JSON text)
+	from PongConsumer.spectators, which never touches the channel layer
+	per spectator.
+	"""
+
+	async def connect(self):
+		self.match_id = self.scope['url_route']['kwargs']['match_id']
+		self.binary = SUBPROTOCOL_BINARY in self.scope.get('subprotocols', ())
+		self.owner = None
+		if PongConsumer.shards:
+			if PongConsumer.registry is not None:
+				self.owner = await PongConsumer.registry.owner(self.match_id)
+			else:
+				self.owner = shard_channel(shard_for(self.match_id, PongConsumer.shards))
+			live = self.owner is not None
+		else:
+			match = PongConsumer.groups_info.get(self.match_id)
+			live = match is not None and match.handle is not None
+		if not live:
+			await self.close()
+			return
+		await self.accept(SUBPROTOCOL_BINARY if self.binary else None)
+		spectators = PongConsumer.spectators
+		await self.send(text_data=json.dumps({
+			'type': 'spectate',
+			'match_id': self.match_id,
+			'broadcast_rate': spectators.rate,
+			'arena': ARENA.layout()
+		}))
+		if spectators.watch(self.match_id, self) and self.owner is not None:
+			await spectators.subscribe(self.channel_layer, self.match_id, self.owner)
+
+	async def disconnect(self, close_code):
+		spectators = PongConsumer.spectators
+		if spectators.leave(getattr(self, 'match_id', None), self) and self.owner is not None:
+			await spectators.unsubscribe(self.channel_layer, self.match_id, self.owner)
+
+	async def receive(self, text_data=None, bytes_data=None):
+		pass
+
+
+PongConsumer.metrics.watch(PongConsumer.scheduler, PongConsumer.fanout, get_channel_layer, PongConsumer.spectators,
+	QueuedConsumer.outboxes, PongConsumer.results)
@@ -0,0 +1,307 @@
+import numpy as np
+
+RADIUS = 0.04
+BAR_POSITION = 2.5
+BAR_WIDTH = 0.08
+BAR_HEIGHT = 0.7
+BAR_DEPTH = 0.1
+GROUND_HEIGHT = 3.0
+GROUND_WIDTH = 6.0
+# Speeds are in arena units per second; step() scales them by dt.
+SPHERE_SPEED = 1.8
+BAR_SPEED = 3.0
+DEFAULT_DT = 1.0 / 60
+KEY_UP = 0
+KEY_DOWN = 1
+
+HALF_HEIGHT = GROUND_HEIGHT / 2.0
+HALF_WIDTH = GROUND_WIDTH / 2.0
+# Furthest a bar centre may travel before its edge meets a wall.
+BAR_LIMIT = HALF_HEIGHT - BAR_HEIGHT / 2
+BAR_HALF_EXTENTS = np.array([BAR_WIDTH / 2, BAR_HEIGHT / 2, BAR_DEPTH / 2])
+BAR_NORMALS = np.array([[1.0, 0.0, 0.0], [-1.0, 0.0, 0.0]])
+START_DIRECTION = np.array([1.0, 1.0, 0.0]) / np.sqrt(2.0)
+
+# Furthest the ball centre may travel before it touches a wall.
+BALL_LIMIT_X = HALF_WIDTH - RADIUS
+BALL_LIMIT_Y = HALF_HEIGHT - RADIUS
+MAX_BOUNCES = 4
+
+# Columns of the per-step time-of-impact table.
+WALL_UPPER = 0
+WALL_LOWER = 1
+WALL_RIGHT = 2
+WALL_LEFT = 3
+BAR_P1 = 4
+BAR_P2 = 5
+
+
+class BatchEngine:
+	"""Struct-of-arrays physics for every match in the process.
+
+	Live matches occupy rows ``[0, size)`` of each array so a tick works on
+	plain slices. Removed rows are filled from the end at the start of the
+	next step; callers hold a stable handle and the engine keeps the
+	handle/row mapping.
+	"""
+
+	def __init__(self, capacity=64):
+		self.size = 0
+		self.handle_row = {}
+		self.row_handle = []
+		self._released = []
+		# Rows whose occupant changed since the frame encoder last looked.
+		self.dirty_rows = set()
+		# Handles of matches with a goal since the scheduler last broadcast.
+		self.scored = set()
+		self._next_handle = 0
+		self._allocate(capacity)
+
+	def _allocate(self, capacity):
+		self.capacity = capacity
+		self.sphere_position = np.zeros((capacity, 3))
+		self.sphere_direction = np.zeros((capacity, 3))
+		self.sphere_speed = np.zeros(capacity)
+		# [:, 0] is the min corner, [:, 1] the max corner
+		self.sphere_box = np.zeros((capacity, 2, 3))
+		self.bar_position = np.zeros((capacity, 2, 3))
+		self.bar_box = np.zeros((capacity, 2, 2, 3))
+		# Held keys per bar: [:, :, 0] is up, [:, :, 1] is down.
+		self.held = np.zeros((capacity, 2, 2), bool)
+		self.scores = np.zeros((capacity, 2), np.int32)
+		self.columns = (self.sphere_position, self.sphere_direction, self.sphere_speed,
+			self.sphere_box, self.bar_position, self.bar_box, self.held, self.scores)
+
+	def _grow(self):
+		old = self.columns
+		self._allocate(self.capacity * 2)
+		for src, dst in zip(old, self.columns):
+			dst[:self.size] = src[:self.size]
+
+	def __len__(self):
+		return len(self.handle_row)
+
+	def add(self):
+		if self.size == self.capacity:
+			self._grow()
+		row = self.size
+		self.size += 1
+		handle = self._next_handle
+		self._next_handle += 1
+		self.handle_row[handle] = row
+		self.row_handle.append(handle)
+		self.dirty_rows.add(row)
+		self.reset(row)
+		return handle
+
+	def reset(self, row):
+		self.sphere_position[row] = 0.0
+		self.sphere_direction[row] = START_DIRECTION
+		self.sphere_speed[row] = SPHERE_SPEED
+		self.sphere_box[row, 0] = -RADIUS
+		self.sphere_box[row, 1] = RADIUS
+		self.bar_position[row, 0] = (-BAR_POSITION, 0.0, 0.0)
+		self.bar_position[row, 1] = (BAR_POSITION, 0.0, 0.0)
+		self.bar_box[row, :, 0] = self.bar_position[row] - BAR_HALF_EXTENTS
+		self.bar_box[row, :, 1] = self.bar_position[row] + BAR_HALF_EXTENTS
+		self.held[row] = False
+		self.scores[row] = 0
+
+	def load(self, handle, sphere_position, sphere_direction, sphere_speed, bar_position, held=False):
+		"""Put a row into a saved state, such as a snapshot or a log's start."""
+		row = self.handle_row[handle]
+		self.sphere_position[row] = sphere_position
+		self.sphere_direction[row] = sphere_direction
+		self.sphere_speed[row] = sphere_speed
+		self.sphere_box[row, ..., 0, :] = self.sphere_position[row] - RADIUS
+		self.sphere_box[row, ..., 1, :] = self.sphere_position[row] + RADIUS
+		self.bar_position[row] = bar_position
+		self.bar_box[row, :, 0] = self.bar_position[row] - BAR_HALF_EXTENTS
+		self.bar_box[row, :, 1] = self.bar_position[row] + BAR_HALF_EXTENTS
+		self.held[row] = held
+		self.dirty_rows.add(row)
+
+	def remove(self, handle):
+		row = self.handle_row.pop(handle)
+		self.row_handle[row] = None
+		self._released.append(row)
+
+	def compact(self):
+		# Rows are only reused between ticks, so a row index handed out for
+		# the current tick stays valid until the next step().
+		for row in sorted(self._released, reverse=True):
+			last = self.size - 1
+			moved = self.row_handle.pop()
+			if row != last:
+				for array in self.columns:
+					array[row] = array[last]
+				self.row_handle[row] = moved
+				self.handle_row[moved] = row
+				self.dirty_rows.add(row)
+			self.dirty_rows.discard(last)
+			self.size = last
+		self._released.clear()
+
+	def row(self, handle):
+		return self.handle_row[handle]
+
+	def positions(self, handle):
+		row = self.handle_row[handle]
+		bars = self.bar_position[row]
+		return self.sphere_position[row].tolist(), bars[0].tolist(), bars[1].tolist()
+
+	def set_held(self, handle, player, key, pressed):
+		self.held[self.handle_row[handle], player - 1, key] = pressed
+
+	def move_bars(self, n, dt):
+		held = self.held[:n]
+		if not held.any():
+			return
+		bar_y = self.bar_position[:n, :, 1]
+		delta = (held[:, :, 0].astype(np.float64) - held[:, :, 1]) * (BAR_SPEED * dt)
+		np.clip(bar_y + delta, -BAR_LIMIT, BAR_LIMIT, out=bar_y)
+		self.bar_box[:n, :, 0, 1] = bar_y - BAR_HALF_EXTENTS[1]
+		self.bar_box[:n, :, 1, 1] = bar_y + BAR_HALF_EXTENTS[1]
+
+	def step(self, dt=DEFAULT_DT):
+		self.compact()
+		n = self.size
+		if n == 0:
+			return
+		self.move_bars(n, dt)
+		self.advance_balls(n, dt)
+
+	def advance_balls(self, n, dt):
+		"""Move every ball through ``dt`` seconds with swept collisions.
+
+		Each pass finds, per match, the earliest time of impact against the
+		four walls and the two bars (slab test against each bar's box grown by
+		the ball radius), advances to it and resolves it. Up to MAX_BOUNCES
+		impacts are resolved per step, so the result does not depend on the
+		tick rate.
+		"""
+		position = self.sphere_position[:n]
+		direction = self.sphere_direction[:n]
+		speed = self.sphere_speed[:n, None]
+		bar_lo = self.bar_box[:n, :, 0] - RADIUS
+		bar_hi = self.bar_box[:n, :, 1] + RADIUS
+		rows = np.arange(n)
+
+		# A bar that moved onto the ball pushes it out the way a hit would.
+		inside = np.all((position[:, None, :] > bar_lo) & (position[:, None, :] < bar_hi), axis=2)
+		if inside.any():
+			hit_rows, player = np.nonzero(inside)
+			self._bounce_off_bars(hit_rows, player)
+
+		remaining = np.full(n, dt)
+		active = np.ones(n, bool)
+		toi = np.empty((n, 6))
+		for _ in range(MAX_BOUNCES):
+			velocity = direction * speed
+			near = impact_times(position, velocity, bar_lo, bar_hi, toi)
+
+			event = toi.argmin(axis=1)
+			impact = toi[rows, event]
+			hit = active & (impact <= remaining)
+			advance = np.where(hit, impact, remaining) * active
+			position += velocity * advance[:, None]
+			remaining -= advance
+
+			direction[hit & (event <= WALL_LOWER), 1] *= -1.0
+			goal = hit & ((event == WALL_RIGHT) | (event == WALL_LEFT))
+			if goal.any():
+				goal_rows = np.nonzero(goal)[0]
+				self.concede(goal_rows, goal_rows, (event[goal_rows] == WALL_RIGHT).astype(np.intp))
+			bar_hit = hit & (event >= BAR_P1)
+			if bar_hit.any():
+				hit_rows = np.nonzero(bar_hit)[0]
+				player = event[hit_rows] - BAR_P1
+				face = near[hit_rows, player].argmax(axis=1)
+				self._bounce_off_bars(hit_rows, player, face)
+
+			active = hit & (remaining > 0.0)
+			if not active.any():
+				break
+
+		self.sphere_box[:n, 0] = position - RADIUS
+		self.sphere_box[:n, 1] = position + RADIUS
+
+	def concede(self, rows, balls, player):
+		"""The ball ``balls`` of ``rows`` went past ``player``'s bar.
+
+		Every other player of the match scores and the ball is served again,
+		towards the player who missed it.
+		"""
+		np.add.at(self.scores, rows, 1)
+		np.add.at(self.scores, (rows, player), -1)
+		self.scored.update(self.row_handle[row] for row in rows.tolist())
+		self.serve(balls, player)
+
+	def serve(self, rows, player):
+		self.sphere_position[rows] = 0.0
+		direction = np.tile(START_DIRECTION, (rows.size, 1))
+		direction[:, 0] = np.copysign(direction[:, 0], -BAR_NORMALS[player, 0])
+		self.sphere_direction[rows] = direction
+
+	def _bounce_off_bars(self, rows, player, face=None):
+		self.sphere_direction[rows] = bounce_directions(
+			self.sphere_direction[rows], self.sphere_position[rows],
+			self.bar_position[rows, player], player, face)
+
+
+def impact_times(position, velocity, bar_lo, bar_hi, out, bar_velocity=None):
+	"""Fill ``out`` with each ball's time of impact against every wall and bar.
+
+	Columns follow WALL_UPPER .. BAR_P2; ``inf`` means no impact. Bars are
+	boxes already grown by the ball radius and may move with
+	``bar_velocity``. Returns the per-axis slab entry times, whose argmax is
+	the face of a bar that was hit.
+	"""
+	wall_impact_times(position, velocity, out)
+	relative = velocity[:, None, :] if bar_velocity is None else velocity[:, None, :] - bar_velocity
+	out[:, BAR_P1:BAR_P2 + 1], near = box_impact_times(position[:, None, :], relative, bar_lo, bar_hi)
+	return near
+
+
+def wall_impact_times(position, velocity, out, limit=(BALL_LIMIT_X, BALL_LIMIT_Y)):
+	# Columns WALL_UPPER .. WALL_LEFT of the table; ``limit`` is how far the
+	# ball centre may travel along x and y.
+	limit_x, limit_y = limit
+	vx = velocity[:, 0]
+	vy = velocity[:, 1]
+	with np.errstate(divide='ignore', invalid='ignore'):
+		out[:, WALL_UPPER] = np.where(vy > 0, (limit_y - position[:, 1]) / vy, np.inf)
+		out[:, WALL_LOWER] = np.where(vy < 0, (-limit_y - position[:, 1]) / vy, np.inf)
+		out[:, WALL_RIGHT] = np.where(vx > 0, (limit_x - position[:, 0]) / vx, np.inf)
+		out[:, WALL_LEFT] = np.where(vx < 0, (-limit_x - position[:, 0]) / vx, np.inf)
+
+
+def box_impact_times(position, velocity, lo, hi):
+	"""Slab test of points moving at ``velocity`` against boxes ``lo``..``hi``.
+
+	Returns the time each point enters its box (``inf`` if it never does)
+	and the per-axis entry times.
+	"""
+	with np.errstate(divide='ignore', invalid='ignore'):
+		inverse = 1.0 / velocity
+		t0 = (lo - position) * inverse
+		t1 = (hi - position) * inverse
+	near = np.minimum(t0, t1)
+	enter = near.max(axis=-1)
+	leave = np.maximum(t0, t1).min(axis=-1)
+	return np.where((enter <= leave) & (enter >= 0.0), enter, np.inf), near
+
+
+def bounce_directions(direction, position, bar_position, player, face=None, normals=BAR_NORMALS):
+	# Aim the ball away from the bar centre, biased along the bar's normal.
+	bounce = position - bar_position + normals[player]
+	new = bounce / np.linalg.norm(bounce, axis=1, keepdims=True)
+	if face is not None:
+		# Off the back or an end of the bar that aim would send the ball
+		# straight through it; mirror it off the face it hit instead.
+		k = np.arange(player.size)
+		through = new[k, face] * direction[k, face] > 0.0
+		mirrored = direction[through]
+		mirrored[np.arange(mirrored.shape[0]), face[through]] *= -1.0
+		new[through] = mirrored
+	return new
@@ -0,0 +1,198 @@
+import time
+
+import numpy as np
+
+from .engine import (
+	BALL_LIMIT_X, BALL_LIMIT_Y, BAR_HALF_EXTENTS, BAR_LIMIT, BAR_NORMALS, BAR_P1, BAR_P2,
+	BAR_POSITION, BAR_SPEED, BatchEngine, RADIUS, WALL_LEFT, WALL_LOWER, WALL_RIGHT, bounce_directions,
+	impact_times,
+)
+
+BAR_STOP_P1 = BAR_P2 + 1
+BAR_STOP_P2 = BAR_P2 + 2
+
+# Bound on events resolved per match per advance, so a degenerate pinch
+# between a bar and a wall cannot stall the loop.
+MAX_EVENTS = 16
+
+BAR_X = np.array([-BAR_POSITION, BAR_POSITION])
+# Distance from a bar centre, along its normal, at which a pushed ball is
+# put: just clear of the bar.
+BAR_CLEARANCE = BAR_HALF_EXTENTS[0] + RADIUS + 1e-9
+
+
+class EventDrivenEngine(BatchEngine):
+	"""Analytic variant of BatchEngine that only does work at collisions.
+
+	Between events a ball moves in a straight line and a held bar slides at
+	constant speed, so each row stores its state at ``origin_time`` plus the
+	time and kind of its next event. ``step()`` resolves only the rows whose
+	event is due and then evaluates every position in closed form for the
+	broadcast. Events are resolved at their exact time whenever the engine
+	is next advanced, so the scheduler only has to wake up to broadcast.
+	"""
+
+	def __init__(self, capacity=64, clock=time.monotonic):
+		self.clock = clock
+		super().__init__(capacity)
+
+	def _allocate(self, capacity):
+		super()._allocate(capacity)
+		self.origin_time = np.zeros(capacity)
+		self.origin_position = np.zeros((capacity, 3))
+		self.origin_bar_y = np.zeros((capacity, 2))
+		self.next_event = np.full(capacity, np.inf)
+		self.next_kind = np.zeros(capacity, np.intp)
+		self.next_face = np.zeros(capacity, np.intp)
+		self.columns += (self.origin_time, self.origin_position, self.origin_bar_y,
+			self.next_event, self.next_kind, self.next_face)
+
+	def reset(self, row):
+		super().reset(row)
+		self.origin_time[row] = self.clock()
+		self.origin_position[row] = self.sphere_position[row]
+		self.origin_bar_y[row] = self.bar_position[row, :, 1]
+		self._schedule(np.array([row]))
+
+	def load(self, handle, sphere_position, sphere_direction, sphere_speed, bar_position, held=False):
+		super().load(handle, sphere_position, sphere_direction, sphere_speed, bar_position, held)
+		row = self.handle_row[handle]
+		self.origin_time[row] = self.clock()
+		self.origin_position[row] = self.sphere_position[row]
+		self.origin_bar_y[row] = self.bar_position[row, :, 1]
+		self._schedule(np.array([row]))
+
+	def set_held(self, handle, player, key, pressed):
+		rows = np.array([self.handle_row[handle]])
+		now = self.clock()
+		self._advance_rows(rows, now)
+		self._materialize(rows, np.array([now]))
+		self.held[rows[0], player - 1, key] = pressed
+		self._schedule(rows)
+
+	def step(self, dt=None):
+		self.compact()
+		n = self.size
+		if n == 0:
+			return
+		now = self.clock()
+		self._advance_rows(np.arange(n), now)
+		self.evaluate(now)
+
+	def evaluate(self, now):
+		n = self.size
+		elapsed = now - self.origin_time[:n]
+		velocity = self.sphere_direction[:n] * self.sphere_speed[:n, None]
+		position = self.sphere_position[:n]
+		np.multiply(velocity, elapsed[:, None], out=position)
+		position += self.origin_position[:n]
+		bar_y = self.bar_position[:n, :, 1]
+		np.clip(self.origin_bar_y[:n] + self._bar_velocity(slice(0, n)) * elapsed[:, None],
+			-BAR_LIMIT, BAR_LIMIT, out=bar_y)
+		self.sphere_box[:n, 0] = position - RADIUS
+		self.sphere_box[:n, 1] = position + RADIUS
+		self.bar_box[:n, :, 0, 1] = bar_y - BAR_HALF_EXTENTS[1]
+		self.bar_box[:n, :, 1, 1] = bar_y + BAR_HALF_EXTENTS[1]
+
+	def _bar_velocity(self, rows):
+		held = self.held[rows]
+		velocity = (held[..., 0].astype(np.float64) - held[..., 1]) * BAR_SPEED
+		y = self.origin_bar_y[rows]
+		# A bar pressed against its stop does not move.
+		velocity[(velocity > 0) & (y >= BAR_LIMIT)] = 0.0
+		velocity[(velocity < 0) & (y <= -BAR_LIMIT)] = 0.0
+		return velocity
+
+	def _advance_rows(self, rows, now):
+		for _ in range(MAX_EVENTS):
+			due = rows[self.next_event[rows] <= now]
+			if due.size == 0:
+				return
+			self._materialize(due, self.next_event[due])
+			self._resolve(due)
+			self._schedule(due)
+		due = rows[self.next_event[rows] <= now]
+		if due.size:
+			# Out of budget with events still due: carry on from now, kept
+			# inside the arena, rather than leave an event in the past for
+			# evaluate() to run straight through.
+			self._materialize(due, np.full(due.size, now))
+			self.origin_position[due, 0] = np.clip(self.origin_position[due, 0], -BALL_LIMIT_X, BALL_LIMIT_X)
+			self.origin_position[due, 1] = np.clip(self.origin_position[due, 1], -BALL_LIMIT_Y, BALL_LIMIT_Y)
+			self._schedule(due)
+
+	def _materialize(self, rows, at):
+		elapsed = at - self.origin_time[rows]
+		velocity = self.sphere_direction[rows] * self.sphere_speed[rows, None]
+		self.origin_position[rows] += velocity * elapsed[:, None]
+		self.origin_bar_y[rows] = np.clip(
+			self.origin_bar_y[rows] + self._bar_velocity(rows) * elapsed[:, None],
+			-BAR_LIMIT, BAR_LIMIT)
+		self.origin_time[rows] = at
+
+	def _resolve(self, rows):
+		kind = self.next_kind[rows]
+		direction = self.sphere_direction
+		direction[rows[kind <= WALL_LOWER], 1] *= -1.0
+		goal = (kind == WALL_RIGHT) | (kind == WALL_LEFT)
+		if goal.any():
+			goal_rows = rows[goal]
+			self.concede(goal_rows, goal_rows, (kind[goal] == WALL_RIGHT).astype(np.intp))
+		bar = (kind == BAR_P1) | (kind == BAR_P2)
+		if bar.any():
+			hit = rows[bar]
+			player = kind[bar] - BAR_P1
+			bar_position = np.zeros((hit.size, 3))
+			bar_position[:, 0] = BAR_X[player]
+			bar_position[:, 1] = self.origin_bar_y[hit, player]
+			face = self.next_face[hit]
+			direction[hit] = bounce_directions(direction[hit], self.origin_position[hit],
+				bar_position, player, face)
+			# Off an end of a bar sliding towards it, the ball cannot get away:
+			# the bar is faster. Put it in front of the bar, heading away, the
+			# way BatchEngine pushes out a ball a bar has moved onto.
+			bar_velocity = self._bar_velocity(hit)[np.arange(hit.size), player]
+			caught = (face == 1) & (bar_velocity * (self.origin_position[hit, 1] - bar_position[:, 1]) > 0.0)
+			if caught.any():
+				pushed = hit[caught]
+				player = player[caught]
+				self.origin_position[pushed, 0] = BAR_X[player] + BAR_NORMALS[player, 0] * BAR_CLEARANCE
+				direction[pushed] = bounce_directions(direction[pushed], self.origin_position[pushed],
+					bar_position[caught], player)
+		stopped = kind >= BAR_STOP_P1
+		if stopped.any():
+			# Snap onto the stop so the bar reads as parked, not a hair short.
+			stop_rows = rows[stopped]
+			player = kind[stopped] - BAR_STOP_P1
+			self.origin_bar_y[stop_rows, player] = np.copysign(BAR_LIMIT, self.origin_bar_y[stop_rows, player])
+
+	def serve(self, rows, player):
+		super().serve(rows, player)
+		self.origin_position[rows] = self.sphere_position[rows]
+
+	def _schedule(self, rows):
+		position = self.origin_position[rows]
+		velocity = self.sphere_direction[rows] * self.sphere_speed[rows, None]
+		bar_velocity = self._bar_velocity(rows)
+		bar_y = self.origin_bar_y[rows]
+
+		centre = np.zeros((rows.size, 2, 3))
+		centre[:, :, 0] = BAR_X
+		centre[:, :, 1] = bar_y
+		extent = BAR_HALF_EXTENTS + RADIUS
+		moving = np.zeros((rows.size, 2, 3))
+		moving[:, :, 1] = bar_velocity
+
+		toi = np.empty((rows.size, BAR_STOP_P2 + 1))
+		near = impact_times(position, velocity, centre - extent, centre + extent, toi, moving)
+		with np.errstate(divide='ignore', invalid='ignore'):
+			stop = np.where(bar_velocity > 0, (BAR_LIMIT - bar_y) / bar_velocity,
+				np.where(bar_velocity < 0, (-BAR_LIMIT - bar_y) / bar_velocity, np.inf))
+		toi[:, BAR_STOP_P1:] = stop
+
+		kind = toi.argmin(axis=1)
+		k = np.arange(rows.size)
+		self.next_kind[rows] = kind
+		self.next_event[rows] = self.origin_time[rows] + toi[k, kind]
+		player = np.clip(kind - BAR_P1, 0, 1)
+		self.next_face[rows] = near[k, player].argmax(axis=1)
@@ -0,0 +1,30 @@
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from pong.sharding import LOBBY_SHARD, shard_channel
+
+
+class Command(BaseCommand):
+	help = "Move every match off a running shard to another one; the shard exits once it is empty."
+
+	def add_arguments(self, parser):
+		parser.add_argument('shard', type=int)
+		parser.add_argument('--to', type=int, dest='target', help="shard that takes the matches; default is the next one")
+
+	def handle(self, *args, shard, target, **options):
+		shards = getattr(settings, 'PONG_SHARDS', 0)
+		if not 0 <= shard < shards:
+			raise CommandError(f"shard must be in [0, {shards}); check PONG_SHARDS")
+		if target is None:
+			target = (shard + 1) % shards
+		if not 0 <= target < shards or target == shard:
+			raise CommandError(f"--to must be another shard in [0, {shards})")
+		if shard == LOBBY_SHARD and getattr(settings, 'PONG_REGISTRY', 'lobby') == 'lobby':
+			raise CommandError(f"shard {LOBBY_SHARD} runs the lobby; use PONG_REGISTRY = 'redis' to drain it")
+		async_to_sync(get_channel_layer().send)(shard_channel(shard), {
+			'type': 'shard.drain',
+			'to': target,
+		})
+		self.stdout.write(f"asked shard {shard} to hand its matches to shard {target}")
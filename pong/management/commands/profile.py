@@ -0,0 +1,33 @@
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from pong.profiling import MAX_SECONDS, MODES
+from pong.sharding import shard_channel
+
+
+class Command(BaseCommand):
+	help = "Profile a running shard for a few seconds. The output is written to PONG_PROFILE_DIR on the shard's host."
+
+	def add_arguments(self, parser):
+		parser.add_argument('shard', type=int)
+		parser.add_argument('--seconds', type=float, default=10.0)
+		parser.add_argument('--mode', choices=MODES, default='cprofile')
+		parser.add_argument('--match', dest='match_id', help="only profile this match's tick")
+
+	def handle(self, *args, shard, seconds, mode, match_id, **options):
+		shards = getattr(settings, 'PONG_SHARDS', 0)
+		if not 0 <= shard < shards:
+			raise CommandError(f"shard must be in [0, {shards}); check PONG_SHARDS")
+		if match_id is not None and mode != 'cprofile':
+			raise CommandError("only cprofile can be scoped to one match")
+		if not 0 < seconds <= MAX_SECONDS:
+			raise CommandError(f"--seconds must be in (0, {MAX_SECONDS}]")
+		async_to_sync(get_channel_layer().send)(shard_channel(shard), {
+			'type': 'profile.start',
+			'seconds': seconds,
+			'mode': mode,
+			'match_id': match_id,
+		})
+		self.stdout.write(f"asked shard {shard} to profile for {seconds}s; see its log for the output path")
@@ -0,0 +1,46 @@
+import os
+import time
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+
+from pong.replay import read_log, replay
+
+
+class Command(BaseCommand):
+	help = "Replay recorded input logs headlessly and check them against the recorded outcome."
+
+	def add_arguments(self, parser):
+		parser.add_argument('paths', nargs='+', help="log files or directories of them")
+
+	def handle(self, *args, paths, **options):
+		files = []
+		for path in paths:
+			if os.path.isdir(path):
+				files.extend(os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith('.pong'))
+			else:
+				files.append(path)
+
+		by_rate = defaultdict(list)
+		for path in files:
+			header, events = read_log(path)
+			by_rate[float(header['dt'])].append((path, header, events))
+
+		mismatches = unfinished = match_ticks = 0
+		elapsed = 0.0
+		for logs in by_rate.values():
+			start = time.perf_counter()
+			results = replay([(header, events) for _, header, events in logs])
+			elapsed += time.perf_counter() - start
+			for (path, header, _), (sphere, bars) in zip(logs, results):
+				if not header['end_tick']:
+					unfinished += 1
+					continue
+				match_ticks += int(header['end_tick']) - int(header['start_tick'])
+				if sphere != header['final_sphere_position'].tolist() or bars != header['final_bar_position'].tolist():
+					mismatches += 1
+					self.stderr.write(f"mismatch: {path}")
+
+		self.stdout.write(f"{len(files)} logs, {unfinished} unfinished, {mismatches} mismatched")
+		if elapsed:
+			self.stdout.write(f"{match_ticks} match-ticks in {elapsed:.3f}s ({match_ticks / elapsed:,.0f}/s)")
@@ -0,0 +1,42 @@
+import asyncio
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from pong.consumers import ARENA, ARENA_NAME, WINNING_SCORE, PongConsumer
+from pong.metrics import REGISTRY, serve
+from pong.sharding import ShardWorker, shard_channel
+
+
+class Command(BaseCommand):
+	help = "Run one simulation shard. Start one per core, indices 0 to PONG_SHARDS - 1."
+
+	def add_arguments(self, parser):
+		parser.add_argument('index', type=int)
+		parser.add_argument('--metrics-port', type=int,
+			help="Port for this shard's /metrics; defaults to PONG_SHARD_METRICS_PORT plus the index.")
+		parser.add_argument('--metrics-host', default='0.0.0.0')
+
+	def handle(self, *args, index, metrics_port, metrics_host, **options):
+		shards = getattr(settings, 'PONG_SHARDS', 0)
+		if not 0 <= index < shards:
+			raise CommandError(f"index must be in [0, {shards}); check PONG_SHARDS")
+		worker = ShardWorker(index, shards, get_channel_layer(), PongConsumer.scheduler, PongConsumer.fanout,
+			registry=PongConsumer.registry, profiler=PongConsumer.profiler,
+			recorder=PongConsumer.recorder, players=ARENA.players, spectators=PongConsumer.spectators,
+			results=PongConsumer.results, winning_score=WINNING_SCORE, arena=ARENA_NAME)
+		if metrics_port is None:
+			base = getattr(settings, 'PONG_SHARD_METRICS_PORT', None)
+			metrics_port = base + index if base is not None else None
+		self.stdout.write(f"shard {index}/{shards} listening on {shard_channel(index)}")
+		asyncio.run(self.run(worker, metrics_host, metrics_port))
+
+	async def run(self, worker, host, port):
+		if port is None:
+			await worker.run()
+			return
+		# The shard's loop metrics only exist in this process.
+		async with await serve(REGISTRY, host, port):
+			self.stdout.write(f"metrics on http://{host}:{port}/metrics")
+			await worker.run()
@@ -0,0 +1,64 @@
+import itertools
+from collections import deque
+
+
+class Matchmaker:
+	"""FIFO matchmaking with constant-time join and lookup.
+
+	Half-filled matches wait in a queue; ``players`` maps a channel name to
+	its ``(match_id, player_num)``. Abandoned matches are dropped lazily when
+	they reach the head of the queue.
+	"""
+
+	def __init__(self, max_size=2):
+		self.max_size = max_size
+		self.matches = {}
+		self.players = {}
+		self.waiting = deque()
+		self._ids = itertools.count(1)
+
+	def join(self, channel_name):
+		while self.waiting:
+			match_id = self.waiting[0]
+			members = self.matches.get(match_id)
+			if members is not None and len(members) < self.max_size:
+				break
+			self.waiting.popleft()
+		else:
+			match_id = self.new_id()
+			self.matches[match_id] = members = []
+			self.waiting.append(match_id)
+		members.append(channel_name)
+		if len(members) == self.max_size:
+			self.waiting.popleft()
+		player_num = len(members)
+		self.players[channel_name] = (match_id, player_num)
+		return match_id, player_num
+
+	def new_id(self):
+		return f"match_{next(self._ids)}"
+
+	def seat(self, match_id, player_num, channel_name):
+		"""Put a resuming player back in its seat; returns True once all are taken.
+
+		The match never enters the queue. Seats nobody has taken yet hold None.
+		"""
+		members = self.matches.setdefault(match_id, [None] * self.max_size)
+		members[player_num - 1] = channel_name
+		self.players[channel_name] = (match_id, player_num)
+		return None not in members
+
+	def end(self, match_id):
+		members = [channel_name for channel_name in self.matches.pop(match_id, ()) if channel_name is not None]
+		for channel_name in members:
+			self.players.pop(channel_name, None)
+		return members
+
+	def lookup(self, channel_name):
+		return self.players.get(channel_name)
+
+	def members(self, match_id):
+		return self.matches.get(match_id, ())
+
+	def __len__(self):
+		return len(self.matches)
@@ -0,0 +1,208 @@
+import asyncio
+from bisect import bisect_left
+
+# Upper bounds, in seconds, for the loop's latency histograms.
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+
+
+class Counter:
+	__slots__ = ('name', 'help', 'value')
+
+	kind = 'counter'
+
+	def __init__(self, name, help):
+		self.name = name
+		self.help = help
+		self.value = 0
+
+	def inc(self, amount=1):
+		self.value += amount
+
+	def samples(self):
+		yield self.name, '', self.value
+
+
+class Gauge:
+	"""Read at scrape time, so it costs nothing in the loop.
+
+	``kind='counter'`` exposes a monotonic value kept elsewhere.
+	"""
+
+	__slots__ = ('name', 'help', 'read', 'kind')
+
+	def __init__(self, name, help, read, kind='gauge'):
+		self.name = name
+		self.help = help
+		self.read = read
+		self.kind = kind
+
+	def samples(self):
+		value = self.read()
+		if value is not None:
+			yield self.name, '', value
+
+
+class Histogram:
+	"""Fixed buckets allocated up front; ``observe`` only bumps counters.
+
+	Everything runs on the event loop thread, including the views that
+	read metrics, so no locking is needed.
+	"""
+
+	__slots__ = ('name', 'help', 'bounds', 'counts', 'sum', 'count')
+
+	kind = 'histogram'
+
+	def __init__(self, name, help, bounds=LATENCY_BUCKETS):
+		self.name = name
+		self.help = help
+		self.bounds = tuple(bounds)
+		self.counts = [0] * (len(self.bounds) + 1)
+		self.sum = 0.0
+		self.count = 0
+
+	def observe(self, value):
+		self.counts[bisect_left(self.bounds, value)] += 1
+		self.sum += value
+		self.count += 1
+
+	def quantile(self, q):
+		"""Upper bound of the bucket holding the ``q`` quantile."""
+		target = q * self.count
+		seen = 0
+		for bound, count in zip(self.bounds, self.counts):
+			seen += count
+			if seen >= target:
+				return bound
+		return float('inf')
+
+	def samples(self):
+		seen = 0
+		for bound, count in zip(self.bounds, self.counts):
+			seen += count
+			yield self.name + '_bucket', f'{{le="{bound}"}}', seen
+		yield self.name + '_bucket', '{le="+Inf"}', self.count
+		yield self.name + '_sum', '', self.sum
+		yield self.name + '_count', '', self.count
+
+
+class Registry:
+	def __init__(self):
+		self.metrics = []
+
+	def register(self, metric):
+		self.metrics.append(metric)
+		return metric
+
+	def counter(self, name, help):
+		return self.register(Counter(name, help))
+
+	def gauge(self, name, help, read, kind='gauge'):
+		return self.register(Gauge(name, help, read, kind))
+
+	def histogram(self, name, help, bounds=LATENCY_BUCKETS):
+		return self.register(Histogram(name, help, bounds))
+
+	def render(self):
+		"""Prometheus text exposition format, version 0.0.4."""
+		lines = []
+		for metric in self.metrics:
+			lines.append(f'# HELP {metric.name} {metric.help}')
+			lines.append(f'# TYPE {metric.name} {metric.kind}')
+			for name, labels, value in metric.samples():
+				lines.append(f'{name}{labels} {value}')
+		lines.append('')
+		return '\n'.join(lines)
+
+
+REGISTRY = Registry()
+
+
+async def serve(registry, host, port):
+	"""Start serving ``registry`` over plain HTTP; returns the asyncio server.
+
+	For processes without Django in front, such as shards. Every request
+	gets the exposition, whatever its path, rendered on the loop thread.
+	"""
+	async def handle(reader, writer):
+		try:
+			await reader.readuntil(b'\r\n\r\n')
+			body = registry.render().encode()
+			writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+				+ f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode() + body)
+			await writer.drain()
+		except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+			pass
+		finally:
+			writer.close()
+
+	return await asyncio.start_server(handle, host, port)
+
+
+class LoopMetrics:
+	"""Instruments for the tick loop, the fanout and the consumers."""
+
+	def __init__(self, registry=REGISTRY):
+		self.registry = registry
+		self.tick_duration = registry.histogram(
+			'pong_tick_duration_seconds', 'Time spent in one scheduler tick.')
+		self.tick_lag = registry.histogram(
+			'pong_tick_lag_seconds', 'How late each tick started against its deadline.')
+		self.tick_overruns = registry.counter(
+			'pong_tick_overruns_total', 'Ticks that took longer than the tick interval.')
+		self.broadcast_duration = registry.histogram(
+			'pong_broadcast_duration_seconds', 'Time to encode and publish every match frame in a tick.')
+		self.frames = registry.counter(
+			'pong_match_frames_total', 'Match frames encoded and published.')
+		self.frame_bytes = registry.counter(
+			'pong_match_frame_bytes_total', 'Binary size of those frames, before fanout to members.')
+		self.channel_send_duration = registry.histogram(
+			'pong_channel_send_seconds', 'Latency of channel layer sends to remote members.')
+		self.outbound_dropped = registry.counter(
+			'pong_outbound_frames_dropped_total', 'Unsent frames replaced by a newer one, or refused by a full channel layer.')
+		self.outbound_lag = registry.histogram(
+			'pong_outbound_lag_seconds', 'How long frames waited in a socket outbox before being written.')
+		self.inputs = registry.counter(
+			'pong_input_messages_total', 'Messages received from clients.')
+		self.inputs_dropped = registry.counter(
+			'pong_input_dropped_total', 'Client messages dropped by the rate limit.')
+		self.results_written = registry.counter(
+			'pong_match_results_written_total', 'Finished matches saved to the database.')
+		self.result_transactions = registry.counter(
+			'pong_match_result_transactions_total', 'Transactions used to save them.')
+		self.results_dropped = registry.counter(
+			'pong_match_results_dropped_total', 'Finished matches dropped while the database refused writes.')
+
+	def watch(self, scheduler, fanout, channel_layer=None, spectators=None, outboxes=None, results=None):
+		registry = self.registry
+		registry.gauge('pong_active_matches', 'Matches registered with the scheduler.',
+			lambda: len(scheduler.matches))
+		registry.gauge('pong_engine_rows', 'Live rows in the physics engine.',
+			lambda: len(scheduler.engine) if scheduler.engine is not None else None)
+		registry.gauge('pong_local_sockets', 'Sockets attached to the local fanout.',
+			lambda: len(fanout.consumers))
+		registry.gauge('pong_skipped_ticks_total', 'Ticks dropped after falling too far behind.',
+			lambda: scheduler.skipped_ticks, 'counter')
+		if spectators is not None:
+			registry.gauge('pong_spectators', 'Spectators watching matches from this process.',
+				lambda: len(spectators))
+		if outboxes is not None:
+			registry.gauge('pong_outbound_queued', 'Messages waiting in socket outboxes.',
+				lambda: sum(len(outbox) for outbox in outboxes))
+			registry.gauge('pong_outbound_max_lag_seconds', 'How long the most stalled socket has had frames waiting.',
+				lambda: max((outbox.current_lag() for outbox in outboxes), default=0.0))
+		if results is not None:
+			registry.gauge('pong_match_results_pending', 'Finished matches waiting to be saved.',
+				lambda: len(results))
+		if channel_layer is not None:
+			registry.gauge('pong_channel_layer_queue_depth', 'Messages waiting in the in-process channel layer.',
+				lambda: channel_layer_depth(channel_layer()))
+
+
+def channel_layer_depth(layer):
+	# Only the in-memory layer keeps its queues in this process.
+	channels = getattr(layer, 'channels', None)
+	if channels is None:
+		return None
+	return sum(queue.qsize() for queue in channels.values())
+
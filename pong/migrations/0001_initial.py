@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Match',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('match_id', models.CharField(max_length=64)),
+                ('arena', models.CharField(max_length=32)),
+                ('started_at', models.DateTimeField()),
+                ('ended_at', models.DateTimeField(db_index=True)),
+                ('winner', models.PositiveSmallIntegerField()),
+            ],
+            options={
+                'verbose_name_plural': 'matches',
+            },
+        ),
+        migrations.CreateModel(
+            name='Result',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('player_num', models.PositiveSmallIntegerField()),
+                ('score', models.PositiveSmallIntegerField()),
+                ('won', models.BooleanField()),
+                ('match', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='results', to='pong.match')),
+            ],
+            options={
+                'ordering': ['player_num'],
+                'constraints': [models.UniqueConstraint(fields=('match', 'player_num'), name='unique_result_per_player')],
+            },
+        ),
+    ]
@@ -1,3 +1,32 @@
 from django.db import models
 
-# Create your models here.
+
+class Match(models.Model):
+    """A match that was played to the end."""
+
+    match_id = models.CharField(max_length=64)
+    arena = models.CharField(max_length=32)
+    started_at = models.DateTimeField()
+    ended_at = models.DateTimeField(db_index=True)
+    winner = models.PositiveSmallIntegerField()
+
+    class Meta:
+        verbose_name_plural = 'matches'
+
+    def __str__(self):
+        return f'{self.match_id} ({self.ended_at:%Y-%m-%d %H:%M})'
+
+
+class Result(models.Model):
+    """One player's final score in a match."""
+
+    match = models.ForeignKey(Match, on_delete=models.CASCADE, related_name='results')
+    player_num = models.PositiveSmallIntegerField()
+    score = models.PositiveSmallIntegerField()
+    won = models.BooleanField()
+
+    class Meta:
+        ordering = ['player_num']
+        constraints = [
+            models.UniqueConstraint(fields=['match', 'player_num'], name='unique_result_per_player'),
+        ]
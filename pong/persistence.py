@@ -0,0 +1,103 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+
+from channels.db import database_sync_to_async
+from django.db import transaction
+
+from .models import Match, Result
+
+logger = logging.getLogger(__name__)
+
+# After failed writes the wait between flushes doubles, up to this many times.
+MAX_BACKOFF = 6
+
+
+class ResultWriter:
+	"""Write-behind queue for the results of finished matches.
+
+	``record()`` only appends to a list, so the tick never waits on the
+	database. The first record starts a task that, every ``interval``
+	seconds, takes everything queued and writes it from a worker thread:
+	``batch_size`` matches per transaction, each a bulk insert of matches
+	and one of their results. The task exits once the queue is empty, so a
+	burst of thousands of finished matches costs a handful of transactions.
+
+	Matches a failed write did not save go back to the front of the queue,
+	and flushes back off until the database takes writes again. At most
+	``max_pending`` matches are kept meanwhile; the oldest are dropped.
+	"""
+
+	def __init__(self, interval=1.0, batch_size=500, metrics=None, max_pending=100000):
+		self.interval = interval
+		self.batch_size = batch_size
+		self.metrics = metrics
+		self.max_pending = max_pending
+		self.pending = []
+		self.failures = 0
+		self._task = None
+
+	def __len__(self):
+		return len(self.pending)
+
+	def record(self, match_id, arena, started_at, scores, winner):
+		"""Queue a finished match; ``started_at`` is a time.time() timestamp."""
+		self.pending.append((match_id, arena, started_at, datetime.now(timezone.utc), scores, winner))
+		self._trim()
+		self._start()
+
+	def _start(self):
+		if self._task is None or self._task.done():
+			self._task = asyncio.get_running_loop().create_task(self.run())
+
+	async def run(self):
+		while self.pending:
+			await asyncio.sleep(self.interval * 2 ** min(self.failures, MAX_BACKOFF))
+			await self.flush()
+		self._task = None
+
+	async def flush(self):
+		"""Write everything queued so far."""
+		batch, self.pending = self.pending, []
+		if not batch:
+			return
+		try:
+			await database_sync_to_async(self.write)(batch)
+		except Exception:
+			# ``batch`` now holds only what was not committed.
+			self.failures += 1
+			logger.exception("could not save %d match results; retrying", len(batch))
+			self.pending[:0] = batch
+			self._trim()
+			self._start()
+		else:
+			self.failures = 0
+
+	def _trim(self):
+		dropped = len(self.pending) - self.max_pending
+		if dropped <= 0:
+			return
+		del self.pending[:dropped]
+		logger.error("result queue is full; dropped the %d oldest match results", dropped)
+		if self.metrics is not None:
+			self.metrics.results_dropped.inc(dropped)
+
+	def write(self, batch):
+		# Committed chunks are removed from ``batch`` as it goes.
+		while batch:
+			chunk = batch[:self.batch_size]
+			with transaction.atomic():
+				matches = Match.objects.bulk_create([
+					Match(match_id=match_id, arena=arena, started_at=datetime.fromtimestamp(started_at, timezone.utc),
+						ended_at=ended_at, winner=winner)
+					for match_id, arena, started_at, ended_at, _, winner in chunk
+				])
+				Result.objects.bulk_create([
+					Result(match=match, player_num=player_num, score=score, won=player_num == winner)
+					for match, (_, _, _, _, scores, winner) in zip(matches, chunk)
+					for player_num, score in enumerate(scores, 1)
+				])
+			del batch[:len(chunk)]
+			if self.metrics is not None:
+				self.metrics.results_written.inc(len(chunk))
+				self.metrics.result_transactions.inc()
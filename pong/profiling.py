@@ -0,0 +1,130 @@
+import asyncio
+import cProfile
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+MODES = ('cprofile', 'sample')
+MAX_SECONDS = 300
+
+
+class ProfilerBusy(Exception):
+	pass
+
+
+class StackSampler:
+	"""Samples one thread's Python stack from a background thread.
+
+	Output is in collapsed-stack form (``outer;inner count`` per line), which
+	flamegraph.pl and speedscope read directly.
+	"""
+
+	def __init__(self, thread_id, interval=0.005):
+		self.thread_id = thread_id
+		self.interval = interval
+		self.stacks = Counter()
+		self._stop = threading.Event()
+		self._thread = threading.Thread(target=self._run, name='pong-sampler', daemon=True)
+
+	def start(self):
+		self._thread.start()
+
+	def stop(self):
+		self._stop.set()
+		self._thread.join()
+
+	def _run(self):
+		while not self._stop.wait(self.interval):
+			frame = sys._current_frames().get(self.thread_id)
+			stack = []
+			while frame is not None:
+				code = frame.f_code
+				stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+				frame = frame.f_back
+			self.stacks[';'.join(reversed(stack))] += 1
+
+	def dump(self, path):
+		with open(path, 'w') as f:
+			for stack, count in self.stacks.most_common():
+				f.write(f'{stack} {count}\n')
+
+
+class Profiler:
+	"""Turns profiling on for ``seconds`` in a live worker, then off again.
+
+	Covers either the whole event loop thread or, with cProfile only, the
+	tick callback of one match; a single match's callback is far too short
+	for the sampler to catch. Batch physics runs once for every match, so a
+	match-scoped profile shows that match's encoding and publishing, plus
+	whatever the loop runs if the callback suspends. One session runs at a
+	time; the result is written to ``directory`` when it ends.
+	"""
+
+	def __init__(self, scheduler, directory):
+		self.scheduler = scheduler
+		self.directory = directory
+		self.session = None
+
+	def start(self, seconds, mode='cprofile', match_id=None):
+		"""Start a session on the running loop and return its output path."""
+		if self.session is not None:
+			raise ProfilerBusy("a profiling session is already running")
+		if mode not in MODES:
+			raise ValueError(f"mode must be one of {MODES}")
+		if not 0 < seconds <= MAX_SECONDS:
+			raise ValueError(f"seconds must be in (0, {MAX_SECONDS}]")
+		step = None
+		if match_id is not None:
+			if mode != 'cprofile':
+				raise ValueError("only cprofile can be scoped to one match")
+			step = self.scheduler.matches.get(match_id)
+			if step is None:
+				raise KeyError(match_id)
+
+		os.makedirs(self.directory, exist_ok=True)
+		scope = match_id or 'worker'
+		suffix = '.pstats' if mode == 'cprofile' else '.folded'
+		path = os.path.join(self.directory, f'{os.getpid()}-{int(time.time())}-{scope}{suffix}')
+
+		profile = sampler = None
+		if mode == 'cprofile':
+			profile = cProfile.Profile()
+		else:
+			sampler = StackSampler(threading.get_ident())
+
+		if step is not None:
+			async def profiled_step():
+				profile.enable()
+				try:
+					await step()
+				finally:
+					profile.disable()
+			self.scheduler.matches[match_id] = profiled_step
+		elif profile is not None:
+			profile.enable()
+		else:
+			sampler.start()
+
+		def stop():
+			if step is not None:
+				# Only put the original back if the match is still running.
+				if self.scheduler.matches.get(match_id) is profiled_step:
+					self.scheduler.matches[match_id] = step
+			elif profile is not None:
+				profile.disable()
+			if profile is not None:
+				profile.dump_stats(path)
+			else:
+				sampler.stop()
+				sampler.dump(path)
+			self.session = None
+			logger.info("profile written to %s", path)
+
+		self.session = asyncio.get_running_loop().call_later(seconds, stop)
+		logger.info("profiling %s with %s for %ss", scope, mode, seconds)
+		return path
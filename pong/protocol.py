@@ -0,0 +1,197 @@
+import json
+import struct
+
+import numpy as np
+
+from .engine import HALF_WIDTH
+
+# Clients opt in to binary frames by offering this WebSocket subprotocol.
+SUBPROTOCOL_BINARY = 'pong.v1.binary'
+
+FRAME_POSITIONS = 1
+FRAME_DELTA = 2
+
+# Coordinates are sent as int16 fixed point; 1/8192 of an arena unit is far
+# below what the renderer can show and still covers the +-3 unit arena.
+SCALE = 8192.0
+
+# Largest coordinate an int16 holds at SCALE, just under 4 units.
+MAX_EXTENT = np.iinfo(np.int16).max / SCALE
+
+# Coordinates in a classic frame: sphere / p1 bar / p2 bar xyz. Arenas send
+# every ball and then every bar.
+CLASSIC_COORDS = 9
+
+
+def positions_frame(coords):
+	# Keyframe: type, tick, server time in ms, then the coordinates.
+	return np.dtype([
+		('type', 'u1'),
+		('tick', '<u4'),
+		('time', '<u4'),
+		('coords', '<i2', (coords,)),
+	])
+
+
+POSITIONS_FRAME = positions_frame(CLASSIC_COORDS)
+
+# Delta: type, tick, server time in ms, ticks since the keyframe it applies
+# to, bitmask of the coordinates that differ from that keyframe, then those
+# coordinates in order. Frames of more than 16 coordinates continue the
+# mask in one more u16 per 16 coordinates, right after this header.
+DELTA_HEADER = struct.Struct('<BIIHH')
+MAX_COORDS = 63
+
+
+def mask_words(coords):
+	return -(-coords // 16)
+
+
+def positions_text(match, tick, time):
+	"""JSON form of a match's frame, for clients without binary support.
+
+	Arenas with more than one ball or two bars also list all of them.
+	"""
+	engine = match.engine
+	row = match.row
+	spheres = engine.sphere_position[row].reshape(-1, 3).tolist()
+	bars = engine.bar_position[row].tolist()
+	message = {
+		'type': 'positions',
+		'tick': tick,
+		'time': time,
+		'sphere_position': spheres[0],
+		'p1_bar_position': bars[0],
+		'p2_bar_position': bars[1]
+	}
+	if len(spheres) > 1 or len(bars) > 2:
+		message['sphere_positions'] = spheres
+		message['bar_positions'] = bars
+	return json.dumps(message)
+
+
+class FrameEncoder:
+	"""Encodes the frame of every match in one vectorized pass.
+
+	Deltas are taken against the match's last keyframe rather than the
+	previous frame, so any single frame can be dropped without breaking the
+	stream. Both players of a match receive the same bytes.
+
+	``extent`` is the largest distance from the centre, along any axis, of
+	anything in the arena; arenas beyond MAX_EXTENT are refused rather than
+	having their coordinates wrap around.
+	"""
+
+	def __init__(self, keyframe_interval=60, coords=CLASSIC_COORDS, extent=HALF_WIDTH):
+		if coords > MAX_COORDS:
+			raise ValueError(f"frames hold at most {MAX_COORDS} coordinates")
+		if extent > MAX_EXTENT:
+			raise ValueError(f"frames hold coordinates up to {MAX_EXTENT:.4f}, not {extent}")
+		self.keyframe_interval = keyframe_interval
+		self.coords = coords
+		self.frame_dtype = positions_frame(coords)
+		self.coord_bits = 1 << np.arange(coords)
+		self.extra_mask = struct.Struct(f'<{mask_words(coords) - 1}H')
+		self.pending_keyframes = set()
+		self._resize(0)
+
+	def _resize(self, capacity):
+		frames = np.zeros(capacity, self.frame_dtype)
+		frames['type'] = FRAME_POSITIONS
+		baseline = np.zeros((capacity, self.coords), '<i2')
+		key_tick = np.zeros(capacity, np.int64)
+		if capacity:
+			size = self.frames.size
+			baseline[:size] = self.baseline
+			key_tick[:size] = self.key_tick
+		self.frames = frames
+		self.baseline = baseline
+		self.key_tick = key_tick
+		self.is_key = np.ones(capacity, bool)
+		self.changed = np.zeros((capacity, self.coords), bool)
+		self.mask = np.zeros(capacity, np.int64)
+
+	def encoded_bytes(self, n):
+		"""Total binary size of the first ``n`` frames of the last encode."""
+		# Keyframes change nothing against their own baseline, so every
+		# changed coordinate belongs to a delta.
+		keys = np.count_nonzero(self.is_key[:n])
+		header = DELTA_HEADER.size + self.extra_mask.size
+		return int(self.frame_dtype.itemsize * keys + header * (n - keys) + 2 * np.count_nonzero(self.changed[:n]))
+
+	def request_keyframe(self, handle):
+		self.pending_keyframes.add(handle)
+
+	def encode(self, engine, tick, time=0):
+		n = engine.size
+		if self.frames.size < engine.capacity:
+			self._resize(engine.capacity)
+		frames = self.frames[:n]
+		frames['tick'] = tick
+		frames['time'] = time
+		coords = frames['coords']
+		spheres = engine.sphere_position[:n].reshape(n, -1)
+		coords[:, :spheres.shape[1]] = np.rint(spheres * SCALE)
+		coords[:, spheres.shape[1]:] = np.rint(engine.bar_position[:n].reshape(n, -1) * SCALE)
+
+		is_key = self.is_key[:n]
+		np.greater_equal(tick - self.key_tick[:n], self.keyframe_interval, out=is_key)
+		for row in engine.dirty_rows:
+			is_key[row] = True
+		engine.dirty_rows.clear()
+		for handle in self.pending_keyframes:
+			row = engine.handle_row.get(handle)
+			if row is not None:
+				is_key[row] = True
+		self.pending_keyframes.clear()
+
+		baseline = self.baseline[:n]
+		baseline[is_key] = coords[is_key]
+		self.key_tick[:n][is_key] = tick
+		changed = self.changed[:n]
+		np.not_equal(coords, baseline, out=changed)
+		np.dot(changed, self.coord_bits, out=self.mask[:n])
+
+	def keyframe(self, row):
+		"""The row's full positions, whether or not this tick sends a delta."""
+		return self.frames[row:row + 1].tobytes()
+
+	def frame(self, row):
+		if self.is_key[row]:
+			return self.keyframe(row)
+		frame = self.frames[row]
+		tick = int(frame['tick'])
+		mask = int(self.mask[row])
+		header = DELTA_HEADER.pack(FRAME_DELTA, tick, int(frame['time']), tick - int(self.key_tick[row]), mask & 0xffff)
+		if self.extra_mask.size:
+			header += self.extra_mask.pack(*((mask >> shift) & 0xffff for shift in range(16, self.coords, 16)))
+		return header + frame['coords'][self.changed[row]].tobytes()
+
+
+class FrameDecoder:
+	"""Client-side counterpart of FrameEncoder, used by tests and tools."""
+
+	def __init__(self, coords=CLASSIC_COORDS):
+		self.frame_dtype = positions_frame(coords)
+		self.coord_bits = 1 << np.arange(coords)
+		self.extra_mask = struct.Struct(f'<{mask_words(coords) - 1}H')
+		self.key_tick = None
+		self.keyframe = None
+
+	def decode(self, data):
+		"""Return ``(tick, time, coords)`` or ``None`` if the keyframe is missing."""
+		if data[0] == FRAME_POSITIONS:
+			frame = np.frombuffer(data, self.frame_dtype, count=1)[0]
+			self.key_tick = int(frame['tick'])
+			self.keyframe = frame['coords'].copy()
+			return self.key_tick, int(frame['time']), (self.keyframe / SCALE).tolist()
+		_, tick, time, age, mask = DELTA_HEADER.unpack_from(data)
+		if self.keyframe is None or tick - age != self.key_tick:
+			return None
+		for shift, word in zip(range(16, 64, 16), self.extra_mask.unpack_from(data, DELTA_HEADER.size)):
+			mask |= word << shift
+		coords = self.keyframe.copy()
+		changed = (mask & self.coord_bits) != 0
+		coords[changed] = np.frombuffer(data, '<i2', offset=DELTA_HEADER.size + self.extra_mask.size)
+		return tick, time, (coords / SCALE).tolist()
+
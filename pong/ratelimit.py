@@ -0,0 +1,22 @@
+import time
+
+
+class TokenBucket:
+	"""Allows bursts of ``capacity`` events, refilling at ``rate`` per second."""
+
+	__slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+	def __init__(self, rate, capacity):
+		self.rate = rate
+		self.capacity = capacity
+		self.tokens = capacity
+		self.updated = time.monotonic()
+
+	def allow(self):
+		now = time.monotonic()
+		self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+		self.updated = now
+		if self.tokens < 1.0:
+			return False
+		self.tokens -= 1.0
+		return True
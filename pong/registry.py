@@ -0,0 +1,182 @@
+import base64
+
+from django.conf import settings
+from redis.asyncio import Redis
+
+# Pops stale or full matches off the head of the queue, then joins the first
+# open one or opens a new one. Mirrors Matchmaker.join, but runs atomically
+# inside Redis so every node sees the same queue.
+# KEYS: waiting, players, ids. ARGV: channel, max_size, members key prefix.
+JOIN = """
+local match_id
+while true do
+	match_id = redis.call('LINDEX', KEYS[1], 0)
+	if not match_id then break end
+	local size = redis.call('LLEN', ARGV[3] .. match_id)
+	if size > 0 and size < tonumber(ARGV[2]) then break end
+	redis.call('LPOP', KEYS[1])
+	match_id = nil
+end
+if not match_id then
+	match_id = 'match_' .. redis.call('INCR', KEYS[3])
+	redis.call('RPUSH', KEYS[1], match_id)
+end
+local size = redis.call('RPUSH', ARGV[3] .. match_id, ARGV[1])
+if size == tonumber(ARGV[2]) then
+	redis.call('LPOP', KEYS[1])
+end
+redis.call('HSET', KEYS[2], ARGV[1], match_id)
+return {match_id, size}
+"""
+
+# Ends the caller's match and returns its id and members. Only the first
+# member to leave gets them, so the match is torn down exactly once.
+# KEYS: players. ARGV: channel, members key prefix.
+LEAVE = """
+local match_id = redis.call('HGET', KEYS[1], ARGV[1])
+if not match_id then return false end
+local key = ARGV[2] .. match_id
+local members = redis.call('LRANGE', key, 0, -1)
+redis.call('DEL', key)
+for _, member in ipairs(members) do
+	redis.call('HDEL', KEYS[1], member)
+end
+return {match_id, members}
+"""
+
+# KEYS: lease. ARGV: owner, ttl in ms.
+RENEW = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+	return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# KEYS: lease. ARGV: owner.
+RELEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+	return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Saved matches whose lease has expired, as a flat list of id, snapshot.
+# KEYS: snapshots. ARGV: lease prefix.
+ORPHANS = """
+local orphans = {}
+local saved = redis.call('HGETALL', KEYS[1])
+for i = 1, #saved, 2 do
+	if redis.call('EXISTS', ARGV[1] .. saved[i]) == 0 then
+		table.insert(orphans, saved[i])
+		table.insert(orphans, saved[i + 1])
+	end
+end
+return orphans
+"""
+
+
+def redis_from_settings():
+	"""Client for the Redis that the default channel layer already uses."""
+	host = settings.CHANNEL_LAYERS['default']['CONFIG']['hosts'][0]
+	if isinstance(host, str):
+		return Redis.from_url(host, decode_responses=True)
+	if isinstance(host, dict):
+		host = dict(host)
+		address = host.pop('address', None)
+		if address is not None:
+			return Redis.from_url(address, decode_responses=True, **host)
+		return Redis(decode_responses=True, **host)
+	return Redis(host=host[0], port=host[1], decode_responses=True)
+
+
+class RedisRegistry:
+	"""Matchmaking queue, match registry and owner leases shared by all nodes.
+
+	Pairing and teardown are Lua scripts, so two nodes can never put a
+	third player into a match or end it twice. A match is simulated by
+	whichever node holds its lease; the holder renews it while it runs the
+	match and loses it if it stops, so the simulation runs at most once.
+	Holders also save a snapshot of each match as they renew, so that a
+	live shard can take over a match whose lease expired with its owner.
+
+	The scripts touch keys derived from their arguments, so they need a
+	single Redis rather than Redis Cluster.
+	"""
+
+	def __init__(self, client, max_size=2, prefix='pong:', lease_ttl=10.0):
+		self.client = client
+		self.max_size = max_size
+		self.prefix = prefix
+		self.lease_ttl = lease_ttl
+		self.waiting_key = prefix + 'waiting'
+		self.players_key = prefix + 'players'
+		self.ids_key = prefix + 'match_ids'
+		self.members_prefix = prefix + 'match:'
+		self.lease_prefix = prefix + 'lease:'
+		self.shard_prefix = prefix + 'shard:'
+		self.snapshots_key = prefix + 'snapshots'
+		self._join = client.register_script(JOIN)
+		self._leave = client.register_script(LEAVE)
+		self._renew = client.register_script(RENEW)
+		self._release = client.register_script(RELEASE)
+		self._orphans = client.register_script(ORPHANS)
+
+	async def join(self, channel_name):
+		match_id, player_num = await self._join(
+			keys=[self.waiting_key, self.players_key, self.ids_key],
+			args=[channel_name, self.max_size, self.members_prefix])
+		return match_id, int(player_num)
+
+	async def leave(self, channel_name):
+		"""Return ``(match_id, members)`` of the match ended, or ``None``."""
+		result = await self._leave(keys=[self.players_key], args=[channel_name, self.members_prefix])
+		if not result:
+			return None
+		return result[0], result[1]
+
+	async def lookup(self, channel_name):
+		return await self.client.hget(self.players_key, channel_name)
+
+	async def members(self, match_id):
+		return await self.client.lrange(self.members_prefix + match_id, 0, -1)
+
+	async def claim(self, match_id, owner):
+		ttl = int(self.lease_ttl * 1000)
+		return bool(await self.client.set(self.lease_prefix + match_id, owner, nx=True, px=ttl))
+
+	async def renew(self, match_ids, owner):
+		"""Extend the leases ``owner`` holds; return the ids it no longer holds."""
+		ttl = int(self.lease_ttl * 1000)
+		async with self.client.pipeline(transaction=False) as pipe:
+			for match_id in match_ids:
+				await self._renew(keys=[self.lease_prefix + match_id], args=[owner, ttl], client=pipe)
+			renewed = await pipe.execute()
+		return [match_id for match_id, ok in zip(match_ids, renewed) if not ok]
+
+	async def release(self, match_id, owner):
+		await self._release(keys=[self.lease_prefix + match_id], args=[owner])
+
+	async def owner(self, match_id):
+		return await self.client.get(self.lease_prefix + match_id)
+
+	async def heartbeat(self, index):
+		"""Mark shard ``index`` alive for one lease period."""
+		await self.client.set(self.shard_prefix + str(index), 1, px=int(self.lease_ttl * 1000))
+
+	async def live_shards(self, shards):
+		alive = await self.client.mget([self.shard_prefix + str(index) for index in range(shards)])
+		return [index for index, value in enumerate(alive) if value is not None]
+
+	async def save(self, snapshots):
+		"""Keep the latest snapshot of each match in ``{match_id: snapshot}``."""
+		if snapshots:
+			await self.client.hset(self.snapshots_key,
+				mapping={match_id: base64.b64encode(data).decode() for match_id, data in snapshots.items()})
+
+	async def forget(self, match_id):
+		await self.client.hdel(self.snapshots_key, match_id)
+
+	async def orphans(self):
+		"""``(match_id, snapshot)`` of every saved match that nobody holds."""
+		saved = await self._orphans(keys=[self.snapshots_key], args=[self.lease_prefix])
+		return [(saved[i], base64.b64decode(saved[i + 1])) for i in range(0, len(saved), 2)]
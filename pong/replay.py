@@ -0,0 +1,156 @@
+import os
+
+import numpy as np
+
+from .engine import BatchEngine
+
+MAGIC = b'PONGLOG2'
+
+# Start state, including keys already held by a restored match, then the
+# end tick and final positions, which are filled in
+# when the match ends. end_tick stays 0 if the worker died first.
+LOG_HEADER = np.dtype([
+	('magic', 'S8'),
+	('dt', '<f8'),
+	('start_tick', '<u4'),
+	('end_tick', '<u4'),
+	('sphere_position', '<f8', (3,)),
+	('sphere_direction', '<f8', (3,)),
+	('sphere_speed', '<f8'),
+	('bar_position', '<f8', (2, 3)),
+	('held', 'u1', (2, 2)),
+	('final_sphere_position', '<f8', (3,)),
+	('final_bar_position', '<f8', (2, 3)),
+])
+
+# One held-key change, 7 bytes. ``tick`` is the scheduler tick it arrived
+# after, so it takes effect in step ``tick + 1``.
+LOG_EVENT = np.dtype([
+	('tick', '<u4'),
+	('player', 'u1'),
+	('key', 'u1'),
+	('pressed', 'u1'),
+])
+
+
+class InputLog:
+	"""Writes one match's start state and every input change to ``path``.
+
+	Physics is a pure function of the start state, the tick interval and
+	which keys were held in which step, so this is enough to replay the
+	match exactly with the fixed-step engine.
+	"""
+
+	def __init__(self, path, match, scheduler):
+		self.scheduler = scheduler
+		self.header = np.zeros(1, LOG_HEADER)
+		header = self.header[0]
+		header['magic'] = MAGIC
+		header['dt'] = scheduler.interval
+		header['start_tick'] = scheduler.tick_count
+		header['sphere_position'] = match.sphere_position
+		header['sphere_direction'] = match.sphere_direction
+		header['sphere_speed'] = match.sphere_speed
+		header['bar_position'] = match.engine.bar_position[match.row]
+		header['held'] = match.engine.held[match.row]
+		self.event = np.zeros(1, LOG_EVENT)
+		self.file = open(path, 'wb')
+		self.file.write(self.header.tobytes())
+
+	def record(self, player, key, pressed):
+		event = self.event[0]
+		event['tick'] = self.scheduler.tick_count
+		event['player'] = player
+		event['key'] = key
+		event['pressed'] = pressed
+		self.file.write(self.event.tobytes())
+
+	def close(self, match):
+		header = self.header[0]
+		header['end_tick'] = self.scheduler.tick_count
+		header['final_sphere_position'] = match.sphere_position
+		header['final_bar_position'] = match.engine.bar_position[match.row]
+		self.file.seek(0)
+		self.file.write(self.header.tobytes())
+		self.file.close()
+
+
+class Recorder:
+	"""Opens an InputLog in ``directory`` for every match it is given."""
+
+	def __init__(self, directory, scheduler):
+		self.directory = directory
+		self.scheduler = scheduler
+		os.makedirs(directory, exist_ok=True)
+
+	def open(self, match):
+		path = os.path.join(self.directory, f'{match.match_id}-{os.getpid()}.pong')
+		match.log = InputLog(path, match, self.scheduler)
+
+
+def read_log(path):
+	"""Return the header and a memory-mapped array of input events.
+
+	A log cut short by a crash is read up to its last whole event.
+	"""
+	header = np.fromfile(path, LOG_HEADER, count=1)[0]
+	if header['magic'] != MAGIC:
+		raise ValueError(f"{path} is not a pong input log")
+	count = (os.path.getsize(path) - LOG_HEADER.itemsize) // LOG_EVENT.itemsize
+	if count == 0:
+		return header, np.zeros(0, LOG_EVENT)
+	return header, np.memmap(path, LOG_EVENT, mode='r', offset=LOG_HEADER.itemsize, shape=(count,))
+
+
+def replay(logs):
+	"""Re-run every ``(header, events)`` log in one engine, without sleeping.
+
+	All logs must share a tick interval. Each match starts at step 0 of the
+	replay and is removed once it reaches its own end tick. Returns, per
+	log, the sphere and bar positions when it ended.
+	"""
+	if not logs:
+		return []
+	dt = logs[0][0]['dt']
+	if any(header['dt'] != dt for header, _ in logs):
+		raise ValueError("logs recorded at different tick rates must be replayed separately")
+
+	engine = BatchEngine(capacity=len(logs))
+	handles = []
+	lengths = []
+	for header, events in logs:
+		handle = engine.add()
+		engine.load(handle, header['sphere_position'], header['sphere_direction'],
+			header['sphere_speed'], header['bar_position'], header['held'].astype(bool))
+		handles.append(handle)
+		end = header['end_tick'] or (int(events['tick'].max()) + 1 if len(events) else header['start_tick'])
+		lengths.append(int(end) - int(header['start_tick']))
+
+	# Every input of every log in replay order: (step it applies to, log).
+	owner = np.concatenate([np.full(len(events), i) for i, (_, events) in enumerate(logs)])
+	events = np.concatenate([events for _, events in logs])
+	starts = np.concatenate([np.full(len(e), h['start_tick'], np.int64) for h, e in logs])
+	applies = events['tick'].astype(np.int64) - starts
+	order = np.argsort(applies, kind='stable')
+
+	results = [None] * len(logs)
+	finishing = np.argsort(lengths, kind='stable')
+	next_event = next_finish = 0
+	for step in range(max(lengths) + 1):
+		while next_finish < len(logs) and lengths[finishing[next_finish]] == step:
+			i = finishing[next_finish]
+			sphere, p1, p2 = engine.positions(handles[i])
+			results[i] = (sphere, [p1, p2])
+			engine.remove(handles[i])
+			next_finish += 1
+		while next_event < len(order) and applies[order[next_event]] <= step:
+			k = order[next_event]
+			i = owner[k]
+			if results[i] is None:
+				event = events[k]
+				engine.set_held(handles[i], int(event['player']), int(event['key']), bool(event['pressed']))
+			next_event += 1
+		if next_finish == len(logs):
+			break
+		engine.step(dt)
+	return results
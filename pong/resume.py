@@ -0,0 +1,20 @@
+import base64
+
+from django.core import signing
+
+SALT = 'pong.resume'
+
+
+def resume_token(key, player_num, snapshot):
+	"""A signed token that puts ``player_num`` back into the snapshotted match.
+
+	``key`` names the match across workers; the snapshot travels inside the
+	token, so whichever worker the player reconnects to can continue it.
+	"""
+	return signing.dumps([key, player_num, base64.b64encode(snapshot).decode()], salt=SALT)
+
+
+def read_resume_token(token, max_age):
+	"""Return ``(key, player_num, snapshot)``; raises signing.BadSignature."""
+	key, player_num, snapshot = signing.loads(token, salt=SALT, max_age=max_age)
+	return key, player_num, base64.b64decode(snapshot)
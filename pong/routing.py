@@ -1,8 +1,9 @@
-# chat/routing.py
-from django.urls import re_path
-
-from . import consumers
-
-websocket_urlpatterns = [
-    re_path('pong/', consumers.PongConsumer.as_asgi()),
+# chat/routing.py
+from django.urls import re_path
+
+from . import consumers
+
+websocket_urlpatterns = [
+    re_path(r'^pong/watch/(?P<match_id>[\w-]+)/$', consumers.SpectatorConsumer.as_asgi()),
+    re_path('pong/', consumers.PongConsumer.as_asgi()),
 ]
\ No newline at end of file
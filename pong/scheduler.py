@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class TickScheduler:
+	"""Drives every registered match from one task at a fixed rate.
+
+	Each tick advances the shared physics engine once. Every
+	``broadcast_every``-th tick it also encodes every match's frame and runs
+	the per-match callbacks that publish it, so the network rate can be set
+	lower than the simulation rate.
+
+	Deadlines are taken from the monotonic clock. When the loop falls behind
+	it runs up to ``max_catchup`` ticks back to back; anything beyond that is
+	skipped so a stall never turns into a burst of hundreds of steps.
+
+	A match whose step raises is unregistered and its ``abort`` callback, if
+	any, is awaited to end it and tell its players.
+
+	With ``metrics`` set, each tick's duration and lateness are recorded.
+	"""
+
+	def __init__(self, rate=60, broadcast_rate=None, max_catchup=5, engine=None, encoder=None, metrics=None):
+		self.rate = rate
+		self.engine = engine
+		self.encoder = encoder
+		self.metrics = metrics
+		self.interval = 1.0 / rate
+		self.broadcast_every = max(1, round(rate / (broadcast_rate or rate)))
+		self.broadcast_rate = rate / self.broadcast_every
+		self.max_catchup = max_catchup
+		self.matches = {}
+		self.aborts = {}
+		self.tick_count = 0
+		self.skipped_ticks = 0
+		# Server timestamp of the last broadcast, in ms since the scheduler
+		# was created; frames carry it so clients can interpolate.
+		self.frame_time = 0
+		self._epoch = time.monotonic()
+		self._task = None
+
+	def register(self, match_id, step, abort=None):
+		self.matches[match_id] = step
+		if abort is not None:
+			self.aborts[match_id] = abort
+		if self._task is None or self._task.done():
+			self._task = asyncio.get_running_loop().create_task(self.run())
+
+	def unregister(self, match_id):
+		self.matches.pop(match_id, None)
+		self.aborts.pop(match_id, None)
+
+	async def tick(self):
+		self.tick_count += 1
+		if self.engine is not None:
+			self.engine.step(self.interval)
+		if self.tick_count % self.broadcast_every:
+			return
+		started = time.monotonic()
+		self.frame_time = int((started - self._epoch) * 1000) & 0xffffffff
+		if self.encoder is not None:
+			self.encoder.encode(self.engine, self.tick_count, self.frame_time)
+			if self.metrics is not None:
+				self.metrics.frames.inc(self.engine.size)
+				self.metrics.frame_bytes.inc(self.encoder.encoded_bytes(self.engine.size))
+		# Steps are awaited in turn rather than gathered: a task per match
+		# per tick costs several times the physics.
+		for match_id, step in list(self.matches.items()):
+			try:
+				await step()
+			except Exception:
+				logger.exception("tick failed for %s", match_id)
+				await self.abort(match_id)
+		if self.engine is not None:
+			# Every match has had the chance to report its goals.
+			self.engine.scored.clear()
+		if self.metrics is not None:
+			self.metrics.broadcast_duration.observe(time.monotonic() - started)
+
+	async def abort(self, match_id):
+		abort = self.aborts.get(match_id)
+		self.unregister(match_id)
+		if abort is None:
+			return
+		try:
+			await abort()
+		except Exception:
+			logger.exception("could not end %s after its tick failed", match_id)
+
+	async def run(self):
+		metrics = self.metrics
+		deadline = time.monotonic()
+		while self.matches:
+			started = time.monotonic()
+			await self.tick()
+			now = time.monotonic()
+			if metrics is not None:
+				duration = now - started
+				metrics.tick_duration.observe(duration)
+				metrics.tick_lag.observe(max(0.0, started - deadline))
+				if duration > self.interval:
+					metrics.tick_overruns.inc()
+			deadline += self.interval
+			lag = now - deadline
+			if lag > self.interval * self.max_catchup:
+				missed = int(lag / self.interval)
+				self.skipped_ticks += missed
+				deadline += missed * self.interval
+			await asyncio.sleep(max(0.0, deadline - now))
+		self._task = None
@@ -0,0 +1,385 @@
+import asyncio
+import functools
+import logging
+import zlib
+
+from .matchmaking import Matchmaker
+from .protocol import positions_text
+from .snapshot import restore, snapshot
+from .state import MatchState
+
+logger = logging.getLogger(__name__)
+
+# The shard that also runs matchmaking for the whole deployment.
+LOBBY_SHARD = 0
+
+# How long a drained shard keeps forwarding messages that were already on
+# their way to it before it exits.
+DRAIN_GRACE = 2.0
+
+
+def shard_for(match_id, shards):
+	# crc32 rather than hash(): it must agree across processes.
+	return zlib.crc32(match_id.encode()) % shards
+
+
+def shard_channel(index):
+	return f'pong.shard.{index}'
+
+
+class ShardWorker:
+	"""Owns the matches whose ids hash to ``index`` and simulates them.
+
+	Web workers only hold sockets. They send joins and leaves to the lobby
+	shard, and input to the shard that owns the match, over the channel
+	layer; the owner publishes frames back to each member's channel. Shards
+	share nothing but these messages, so adding shard processes adds
+	simulation capacity.
+
+	With a ``registry`` the lobby is not used: web workers pair players in
+	Redis directly, and a shard only simulates a match once it holds the
+	match's lease. It then tells the members where to send input. Matches
+	left without an owner, because their shard died, are rehashed over the
+	shards still alive and continue from their last saved snapshot.
+
+	Web workers with spectators of a match subscribe a relay channel with
+	``match.watch``; the owner sends it one keyframe per spectator interval
+	through ``spectators``, whatever the number of spectators behind it.
+
+	``shard.drain`` moves every match to another shard as a snapshot, for
+	rolling restarts. The members' sockets stay where they are; they are
+	told the new owner, and the draining shard forwards whatever still
+	reaches it for a moment before ``run()`` returns.
+	"""
+
+	def __init__(self, index, shards, channel_layer, scheduler, fanout, registry=None, profiler=None, recorder=None, players=2,
+			spectators=None, results=None, winning_score=None, arena='classic'):
+		self.index = index
+		self.shards = shards
+		self.channel_layer = channel_layer
+		self.scheduler = scheduler
+		self.fanout = fanout
+		self.registry = registry
+		self.profiler = profiler
+		self.recorder = recorder
+		self.spectators = spectators
+		# Finished matches are queued on ``results``; without a
+		# ``winning_score`` matches only end when a player leaves.
+		self.results = results
+		self.winning_score = winning_score
+		self.arena = arena
+		self.channel = shard_channel(index)
+		self.matchmaker = Matchmaker(max_size=players) if index == LOBBY_SHARD and registry is None else None
+		self.matches = {}
+		self.members = {}
+		# Relay channels of web workers watching each match.
+		self.watchers = {}
+		# Set while draining: the shard that takes this one's matches, and
+		# the matches it has been given.
+		self.drain_target = None
+		self.handed_off = set()
+		self._stop_at = None
+		# Lobby only: owners of matches that were moved off their hashed shard.
+		self.moved = {}
+
+	def owner(self, match_id):
+		return self.moved.get(match_id) or shard_channel(shard_for(match_id, self.shards))
+
+	async def run(self):
+		renewal = None
+		if self.registry is not None:
+			renewal = asyncio.get_running_loop().create_task(self.renew_leases())
+		try:
+			await self.serve()
+		finally:
+			if renewal is not None:
+				renewal.cancel()
+
+	async def serve(self):
+		loop = asyncio.get_running_loop()
+		while True:
+			receive = self.channel_layer.receive(self.channel)
+			if self._stop_at is None:
+				message = await receive
+			else:
+				try:
+					message = await asyncio.wait_for(receive, max(0.0, self._stop_at - loop.time()))
+				except asyncio.TimeoutError:
+					return
+			handler = getattr(self, message['type'].replace('.', '_'), None)
+			if handler is None:
+				logger.warning("shard %d: unknown message %r", self.index, message['type'])
+				continue
+			try:
+				await handler(message)
+			except Exception:
+				logger.exception("shard %d: %s failed", self.index, message['type'])
+
+	async def lobby_join(self, message):
+		channel_name = message['channel']
+		match_id, player_num = self.matchmaker.join(channel_name)
+		await self.channel_layer.send(channel_name, {
+			'type': 'match_assigned',
+			'match_id': match_id,
+			'player_num': player_num,
+		})
+		if player_num == self.matchmaker.max_size:
+			await self.channel_layer.send(self.owner(match_id), {
+				'type': 'match.start',
+				'match_id': match_id,
+				'members': list(self.matchmaker.members(match_id)),
+			})
+
+	async def lobby_leave(self, message):
+		channel_name = message['channel']
+		player = self.matchmaker.lookup(channel_name)
+		if player is None:
+			return
+		match_id = player[0]
+		for member in self.matchmaker.end(match_id):
+			if member != channel_name:
+				await self.channel_layer.send(member, {
+					'type': 'send_disconnect_message',
+					'message': 'disconnect_all',
+				})
+		await self.channel_layer.send(self.owner(match_id), {
+			'type': 'match.end',
+			'match_id': match_id,
+		})
+		self.moved.pop(match_id, None)
+
+	async def lobby_moved(self, message):
+		self.moved[message['match_id']] = message['owner']
+
+	async def renew_leases(self):
+		registry = self.registry
+		while True:
+			await registry.heartbeat(self.index)
+			for match_id in await registry.renew(list(self.matches), self.channel):
+				logger.warning("shard %d: lost the lease on %s", self.index, match_id)
+				await self.drop(match_id)
+			tick = self.scheduler.tick_count
+			await registry.save({match_id: snapshot(match, tick) for match_id, match in self.matches.items()})
+			if self.drain_target is None:
+				await self.take_over()
+			await asyncio.sleep(registry.lease_ttl / 3)
+
+	async def take_over(self):
+		orphans = await self.registry.orphans()
+		if not orphans:
+			return
+		live = await self.registry.live_shards(self.shards)
+		for match_id, data in orphans:
+			if match_id in self.matches or live[shard_for(match_id, len(live))] != self.index:
+				continue
+			if not await self.registry.claim(match_id, self.channel):
+				continue
+			members = await self.registry.members(match_id)
+			if not members:
+				# Its players left while nobody ran it.
+				await self.registry.forget(match_id)
+				await self.registry.release(match_id, self.channel)
+				continue
+			tick = await self.adopt(match_id, data, members)
+			logger.warning("shard %d: took over orphaned %s from tick %d", self.index, match_id, tick)
+
+	async def match_start(self, message):
+		match_id = message['match_id']
+		if self.drain_target is not None:
+			await self.channel_layer.send(self.drain_target, message)
+			return
+		if self.registry is not None and not await self.registry.claim(match_id, self.channel):
+			return
+		self.members[match_id] = message['members']
+		self.matches[match_id] = match = MatchState(match_id, self.scheduler.engine)
+		if self.recorder is not None:
+			self.recorder.open(match)
+		self.scheduler.register(match_id, functools.partial(self.step, match_id), functools.partial(self.abort, match_id))
+		if self.registry is not None:
+			await self.registry.save({match_id: snapshot(match, self.scheduler.tick_count)})
+			for member in message['members']:
+				await self.channel_layer.send(member, {
+					'type': 'match_owner',
+					'owner': self.channel,
+				})
+
+	async def match_end(self, message):
+		match_id = message['match_id']
+		if await self.forward(message):
+			return
+		if self.registry is not None and match_id in self.matches:
+			await self.registry.forget(match_id)
+		await self.drop(match_id)
+
+	async def drop(self, match_id):
+		# Stops running the match here, whether it ended or is run elsewhere.
+		self.scheduler.unregister(match_id)
+		self.members.pop(match_id, None)
+		for channel in self.watchers.pop(match_id, ()):
+			await self.channel_layer.send(channel, {'type': 'spectator.end', 'match_id': match_id})
+		match = self.matches.pop(match_id, None)
+		if match is not None:
+			match.release()
+			if self.registry is not None:
+				await self.registry.release(match_id, self.channel)
+
+	async def abort(self, match_id):
+		# The match's tick failed; end it as if a player had left.
+		for member in self.members.get(match_id, ()):
+			await self.channel_layer.send(member, {
+				'type': 'send_disconnect_message',
+				'message': 'disconnect_all',
+			})
+		await self.match_end({'match_id': match_id})
+
+	async def match_input(self, message):
+		if await self.forward(message):
+			return
+		match = self.matches.get(message['match_id'])
+		if match is not None and match.handle is not None:
+			match.set_held(message['player'], message['key'], message['pressed'])
+
+	async def match_keyframe(self, message):
+		if await self.forward(message):
+			return
+		match = self.matches.get(message['match_id'])
+		if match is not None and match.handle is not None:
+			self.scheduler.encoder.request_keyframe(match.handle)
+
+	async def match_watch(self, message):
+		match_id = message['match_id']
+		if await self.forward(message):
+			return
+		if match_id not in self.matches:
+			await self.channel_layer.send(message['channel'], {'type': 'spectator.end', 'match_id': match_id})
+			return
+		self.watchers.setdefault(match_id, set()).add(message['channel'])
+
+	async def match_unwatch(self, message):
+		watchers = self.watchers.get(message['match_id'])
+		if watchers is not None:
+			watchers.discard(message['channel'])
+			if not watchers:
+				del self.watchers[message['match_id']]
+
+	async def forward(self, message):
+		# Messages for a match this shard has just handed off follow it.
+		if message['match_id'] not in self.handed_off:
+			return False
+		await self.channel_layer.send(self.drain_target, message)
+		return True
+
+	async def shard_drain(self, message):
+		if self.matchmaker is not None:
+			logger.error("shard %d runs the lobby and cannot be drained", self.index)
+			return
+		self.drain_target = target = shard_channel(message['to'])
+		tick = self.scheduler.tick_count
+		for match_id, match in list(self.matches.items()):
+			data = snapshot(match, tick)
+			self.scheduler.unregister(match_id)
+			del self.matches[match_id]
+			self.handed_off.add(match_id)
+			match.release()
+			# Let go of the lease first so the target can claim it. Should
+			# the target never do so, a live shard takes it over from here.
+			if self.registry is not None:
+				await self.registry.save({match_id: data})
+				await self.registry.release(match_id, self.channel)
+			await self.channel_layer.send(target, {
+				'type': 'match.migrate',
+				'match_id': match_id,
+				'members': self.members.pop(match_id),
+				'watchers': list(self.watchers.pop(match_id, ())),
+				'snapshot': data,
+			})
+		if self.results is not None:
+			await self.results.flush()
+		logger.info("shard %d: drained to %s", self.index, target)
+		self._stop_at = asyncio.get_running_loop().time() + DRAIN_GRACE
+
+	async def match_migrate(self, message):
+		match_id = message['match_id']
+		if self.registry is not None and not await self.registry.claim(match_id, self.channel):
+			logger.warning("shard %d: %s was claimed elsewhere during its move", self.index, match_id)
+			return
+		tick = await self.adopt(match_id, message['snapshot'], message['members'], message['watchers'])
+		if self.registry is None:
+			await self.channel_layer.send(shard_channel(LOBBY_SHARD), {
+				'type': 'lobby.moved',
+				'match_id': match_id,
+				'owner': self.channel,
+			})
+		logger.info("shard %d: took over %s from tick %d", self.index, match_id, tick)
+
+	async def adopt(self, match_id, data, members, watchers=()):
+		"""Continue a match from its snapshot here; returns the snapshot's tick."""
+		match, tick = restore(data, match_id, self.scheduler.engine)
+		self.matches[match_id] = match
+		self.members[match_id] = members
+		if watchers:
+			self.watchers[match_id] = set(watchers)
+		if self.recorder is not None:
+			self.recorder.open(match)
+		self.scheduler.register(match_id, functools.partial(self.step, match_id), functools.partial(self.abort, match_id))
+		for member in members:
+			await self.channel_layer.send(member, {
+				'type': 'match_owner',
+				'owner': self.channel,
+			})
+		return tick
+
+	async def profile_start(self, message):
+		if self.profiler is None:
+			logger.warning("shard %d: profiling is not available", self.index)
+			return
+		path = self.profiler.start(message['seconds'], message['mode'], message.get('match_id'))
+		logger.warning("shard %d: profiling for %ss into %s", self.index, message['seconds'], path)
+
+	async def step(self, match_id):
+		match = self.matches.get(match_id)
+		if match is None or match.handle is None:
+			return
+		scheduler = self.scheduler
+
+		def encode_text():
+			return positions_text(match, scheduler.tick_count, scheduler.frame_time)
+
+		await self.fanout.publish(
+			self.channel_layer,
+			self.members[match_id],
+			scheduler.encoder.frame(match.row),
+			encode_text
+		)
+		watchers = self.watchers.get(match_id)
+		if watchers and (self.spectators is None or self.spectators.due()):
+			frame = scheduler.encoder.keyframe(match.row)
+			text = encode_text()
+			for channel in watchers:
+				await self.channel_layer.send(channel, {
+					'type': 'spectator.frame',
+					'match_id': match_id,
+					'frame': frame,
+					'text': text,
+				})
+		if match.handle in scheduler.engine.scored:
+			scores = match.scores
+			for member in self.members[match_id]:
+				await self.channel_layer.send(member, {
+					'type': 'send_score',
+					'scores': scores,
+				})
+			winner = match.winner(self.winning_score) if self.winning_score is not None else None
+			if winner is not None:
+				await self.finish(match_id, match, winner)
+
+	async def finish(self, match_id, match, winner):
+		if self.results is not None:
+			self.results.record(match_id, self.arena, match.started_at, match.scores, winner)
+		for member in self.members[match_id]:
+			await self.channel_layer.send(member, {
+				'type': 'send_disconnect_message',
+				'message': 'match_over',
+			})
+		# Members leave the lobby or registry as their sockets close.
+		await self.match_end({'match_id': match_id})
@@ -0,0 +1,94 @@
+import numpy as np
+
+from .state import MatchState
+
+MAGIC = b'PONGSNP2'
+
+# Read first, to learn the shape of the rest.
+SNAPSHOT_HEADER = np.dtype([
+	('magic', 'S8'),
+	('balls', 'u1'),
+	('players', 'u1'),
+])
+
+
+def snapshot_dtype(balls=1, players=2):
+	"""Everything needed to continue a match: 134 bytes for a classic one.
+
+	``tick`` is the scheduler tick the snapshot was taken at and
+	``started_at`` the time the match began; held keys are kept so a bar
+	that was moving keeps moving.
+	"""
+	return np.dtype(SNAPSHOT_HEADER.descr + [
+		('tick', '<u4'),
+		('started_at', '<f8'),
+		('scores', '<u2', (players,)),
+		('sphere_position', '<f8', (balls, 3)),
+		('sphere_direction', '<f8', (balls, 3)),
+		('sphere_speed', '<f8', (balls,)),
+		('bar_position', '<f8', (players, 3)),
+		('held', 'u1', (players, 2)),
+	])
+
+
+def engine_shape(engine):
+	"""``(balls, players)`` of every row in ``engine``."""
+	return int(np.prod(engine.sphere_speed.shape[1:], dtype=int)), engine.bar_position.shape[1]
+
+
+def snapshot(match, tick):
+	"""Serialize a live match."""
+	engine = match.engine
+	row = match.row
+	balls, players = engine_shape(engine)
+	data = np.zeros(1, snapshot_dtype(balls, players))
+	record = data[0]
+	record['magic'] = MAGIC
+	record['balls'] = balls
+	record['players'] = players
+	record['tick'] = tick
+	record['started_at'] = match.started_at
+	record['scores'] = engine.scores[row]
+	record['sphere_position'] = engine.sphere_position[row].reshape(balls, 3)
+	record['sphere_direction'] = engine.sphere_direction[row].reshape(balls, 3)
+	record['sphere_speed'] = engine.sphere_speed[row]
+	record['bar_position'] = engine.bar_position[row]
+	record['held'] = engine.held[row]
+	return data.tobytes()
+
+
+def read_snapshot(data):
+	header = np.frombuffer(data, SNAPSHOT_HEADER, count=1)[0]
+	if header['magic'] != MAGIC:
+		raise ValueError("not a pong match snapshot")
+	dtype = snapshot_dtype(int(header['balls']), int(header['players']))
+	if len(data) != dtype.itemsize:
+		raise ValueError("truncated pong match snapshot")
+	return np.frombuffer(data, dtype, count=1)[0]
+
+
+def check_snapshot(data, engine):
+	"""Return the record in ``data``; raises ValueError unless ``engine`` can restore it."""
+	record = read_snapshot(data)
+	if (int(record['balls']), int(record['players'])) != engine_shape(engine):
+		raise ValueError("snapshot was taken in a different arena")
+	return record
+
+
+def restore(data, match_id, engine):
+	"""Return ``(match, tick)``: a new match in ``engine`` continuing ``data``.
+
+	The engine must run the same arena the snapshot was taken in.
+	"""
+	record = check_snapshot(data, engine)
+	match = MatchState(match_id, engine)
+	shape = engine.sphere_position.shape[1:]
+	engine.load(match.handle,
+		record['sphere_position'].reshape(shape),
+		record['sphere_direction'].reshape(shape),
+		record['sphere_speed'].reshape(engine.sphere_speed.shape[1:]),
+		record['bar_position'],
+		record['held'].astype(bool))
+	engine.scores[match.row] = record['scores']
+	match.started_at = float(record['started_at'])
+	return match, int(record['tick'])
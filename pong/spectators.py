@@ -0,0 +1,143 @@
+import asyncio
+import json
+
+# Frames queued between yields to the event loop, so a large audience never
+# holds up the tick for long.
+SEND_BATCH = 64
+
+
+class Audience:
+	"""The spectators of one match and the latest frame they have not seen.
+
+	Only the newest frame is kept: the tick overwrites it and wakes a
+	task, which queues those same bytes on every spectator's outbox. A
+	frame that arrives while the previous one is still being queued
+	replaces it.
+	"""
+
+	def __init__(self):
+		self.consumers = set()
+		self.text_consumers = 0
+		self.frame = None
+		self.text = None
+		self.wake = asyncio.Event()
+		self.task = asyncio.get_running_loop().create_task(self.deliver())
+
+	async def deliver(self):
+		while True:
+			await self.wake.wait()
+			self.wake.clear()
+			frame = self.frame
+			text = self.text
+			for sent, consumer in enumerate(list(self.consumers), 1):
+				if consumer.binary:
+					consumer.outbox.frame(bytes_data=frame)
+				else:
+					consumer.outbox.frame(text_data=text)
+				if sent % SEND_BATCH == 0:
+					await asyncio.sleep(0)
+
+
+class Spectators:
+	"""Every audience in this process, fed once per spectator interval.
+
+	Spectator frames are keyframes taken every ``every``-th broadcast, so a
+	spectator can start watching at any frame. With shards, the match runs
+	elsewhere: the process subscribes one relay channel to the owning shard
+	per watched match, whatever the number of spectators.
+	"""
+
+	def __init__(self, scheduler, rate):
+		self.scheduler = scheduler
+		self.every = max(1, round(scheduler.broadcast_rate / rate))
+		self.rate = scheduler.broadcast_rate / self.every
+		self.audiences = {}
+		self.relay = None
+		self._relay_task = None
+
+	def __len__(self):
+		return sum(len(audience.consumers) for audience in self.audiences.values())
+
+	def due(self):
+		scheduler = self.scheduler
+		return (scheduler.tick_count // scheduler.broadcast_every) % self.every == 0
+
+	def watch(self, match_id, consumer):
+		"""Add a spectator; returns True if it is the match's first."""
+		audience = self.audiences.get(match_id)
+		first = audience is None
+		if first:
+			audience = self.audiences[match_id] = Audience()
+		audience.consumers.add(consumer)
+		if not consumer.binary:
+			audience.text_consumers += 1
+		return first
+
+	def leave(self, match_id, consumer):
+		"""Remove a spectator; returns True if it was the match's last."""
+		audience = self.audiences.get(match_id)
+		if audience is None or consumer not in audience.consumers:
+			return False
+		audience.consumers.discard(consumer)
+		if not consumer.binary:
+			audience.text_consumers -= 1
+		if audience.consumers:
+			return False
+		audience.task.cancel()
+		del self.audiences[match_id]
+		return True
+
+	def publish(self, match_id, frame, encode_text):
+		audience = self.audiences.get(match_id)
+		if audience is None:
+			return
+		audience.frame = frame
+		audience.text = encode_text() if audience.text_consumers else None
+		audience.wake.set()
+
+	async def end(self, match_id):
+		audience = self.audiences.pop(match_id, None)
+		if audience is None:
+			return
+		audience.task.cancel()
+		message = json.dumps({'type': 'disconnect_message', 'message': 'match_over'})
+		for sent, consumer in enumerate(list(audience.consumers), 1):
+			await consumer.send(text_data=message)
+			await consumer.close()
+			if sent % SEND_BATCH == 0:
+				await asyncio.sleep(0)
+		self._release_relay()
+
+	async def subscribe(self, channel_layer, match_id, owner):
+		if self.relay is None:
+			self.relay = await channel_layer.new_channel()
+			self._relay_task = asyncio.get_running_loop().create_task(self.receive_relay(channel_layer, self.relay))
+		await channel_layer.send(owner, {
+			'type': 'match.watch',
+			'match_id': match_id,
+			'channel': self.relay,
+		})
+
+	async def unsubscribe(self, channel_layer, match_id, owner):
+		await channel_layer.send(owner, {
+			'type': 'match.unwatch',
+			'match_id': match_id,
+			'channel': self.relay,
+		})
+		self._release_relay()
+
+	def _release_relay(self):
+		# Nothing is watched any more, so stop listening until something is.
+		if self.audiences or self._relay_task is None:
+			return
+		task = self._relay_task
+		self.relay = self._relay_task = None
+		task.cancel()
+
+	async def receive_relay(self, channel_layer, relay):
+		while True:
+			message = await channel_layer.receive(relay)
+			if message['type'] == 'spectator.frame':
+				self.publish(message['match_id'], message['frame'], lambda: message['text'])
+			elif message['type'] == 'spectator.end':
+				await self.end(message['match_id'])
@@ -0,0 +1,126 @@
+import time
+
+from .engine import HALF_HEIGHT, HALF_WIDTH, KEY_DOWN, KEY_UP
+
+
+def _held_key(player, key):
+	def get(self):
+		return bool(self.engine.held[self.row, player - 1, key])
+
+	def set(self, pressed):
+		self.engine.held[self.row, player - 1, key] = pressed
+
+	return property(get, set)
+
+
+def _score(player):
+	def get(self):
+		return int(self.engine.scores[self.row, player - 1])
+
+	def set(self, score):
+		self.engine.scores[self.row, player - 1] = score
+
+	return property(get, set)
+
+
+class MatchState:
+	"""Per-match record; physics fields are views onto the engine's row.
+
+	Only identity and bookkeeping live on the instance. Arena geometry is
+	stored once on the class and shared by every match.
+	"""
+
+	__slots__ = ('match_id', 'engine', 'handle', 'log', 'started_at')
+
+	upper_plane_normal = (0.0, -1.0, 0.0)
+	upper_plane_constant = HALF_HEIGHT
+	lower_plane_normal = (0.0, 1.0, 0.0)
+	lower_plane_constant = HALF_HEIGHT
+	left_plane_normal = (1.0, 0.0, 0.0)
+	left_plane_constant = HALF_WIDTH
+	right_plane_normal = (-1.0, 0.0, 0.0)
+	right_plane_constant = HALF_WIDTH
+
+	def __init__(self, match_id, engine):
+		self.match_id = match_id
+		self.engine = engine
+		self.handle = engine.add()
+		# InputLog recording this match's input, if any.
+		self.log = None
+		self.started_at = time.time()
+
+	p1_moving_up = _held_key(1, KEY_UP)
+	p1_moving_down = _held_key(1, KEY_DOWN)
+	p2_moving_up = _held_key(2, KEY_UP)
+	p2_moving_down = _held_key(2, KEY_DOWN)
+	player_1_score = _score(1)
+	player_2_score = _score(2)
+
+	def release(self):
+		if self.handle is not None:
+			if self.log is not None:
+				self.log.close(self)
+				self.log = None
+			self.engine.remove(self.handle)
+			self.handle = None
+
+	@property
+	def row(self):
+		return self.engine.handle_row[self.handle]
+
+	@property
+	def sphere_position(self):
+		return self.engine.sphere_position[self.row]
+
+	@property
+	def sphere_direction(self):
+		return self.engine.sphere_direction[self.row]
+
+	@property
+	def sphere_speed(self):
+		return self.engine.sphere_speed[self.row]
+
+	@property
+	def sphere_bounding_box(self):
+		return self.engine.sphere_box[self.row]
+
+	@property
+	def p1_bar_position(self):
+		return self.engine.bar_position[self.row, 0]
+
+	@property
+	def p2_bar_position(self):
+		return self.engine.bar_position[self.row, 1]
+
+	@property
+	def p1_bar_box(self):
+		return self.engine.bar_box[self.row, 0]
+
+	@property
+	def p2_bar_box(self):
+		return self.engine.bar_box[self.row, 1]
+
+	@property
+	def scores(self):
+		return self.engine.scores[self.row].tolist()
+
+	def winner(self, winning_score):
+		"""Number of the player who has won, or None.
+
+		A player wins on reaching ``winning_score`` with the lead to
+		themselves. In an arena where one goal scores for several players at
+		once, leaders who reach it together play on until one is ahead.
+		"""
+		scores = self.scores
+		best = max(scores)
+		if best < winning_score or scores.count(best) > 1:
+			return None
+		return scores.index(best) + 1
+
+	def positions(self):
+		return self.engine.positions(self.handle)
+
+	def set_held(self, player, key, pressed):
+		self.engine.set_held(self.handle, player, key, pressed)
+		if self.log is not None:
+			self.log.record(player, key, pressed)
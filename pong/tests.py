@@ -1,3 +1,1281 @@
-from django.test import TestCase
+import asyncio
+import gc
+import json
+import os
+import pstats
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import tracemalloc
+import unittest
+from unittest import mock
+from urllib.parse import quote
 
-# Create your tests here.
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.db import DatabaseError
+from django.http import JsonResponse
+from django.test import SimpleTestCase, TestCase, override_settings
+
+import numpy as np
+
+from .arena import ARENAS, CLASSIC, FOUR_PLAYER, Arena, ArenaEngine, sweep_and_prune
+from .broadcast import LocalFanout, Outbox
+from .consumers import PongConsumer
+from .engine import BALL_LIMIT_X, BALL_LIMIT_Y, WALL_LEFT, WALL_LOWER, WALL_RIGHT, WALL_UPPER, BatchEngine
+from .events import EventDrivenEngine
+from .matchmaking import Matchmaker
+from .metrics import REGISTRY, LoopMetrics, Registry, serve
+from .models import Match, Result
+from .persistence import ResultWriter
+from .profiling import Profiler, ProfilerBusy
+from .protocol import DELTA_HEADER, FRAME_DELTA, FRAME_POSITIONS, SCALE, SUBPROTOCOL_BINARY, FrameDecoder, FrameEncoder
+from .registry import RedisRegistry
+from .replay import Recorder, read_log, replay
+from .resume import resume_token
+from .routing import websocket_urlpatterns
+from .scheduler import TickScheduler
+from .sharding import ShardWorker, shard_for
+from .snapshot import restore, snapshot
+from .state import MatchState
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+IN_MEMORY_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS)
+class MatchLifecycleTests(SimpleTestCase):
+    async def play_match(self):
+        application = PongConsumer.as_asgi()
+        first = WebsocketCommunicator(application, "/pong/")
+        second = WebsocketCommunicator(application, "/pong/")
+        await first.connect()
+        await second.connect()
+        await first.receive_json_from()
+        await second.receive_json_from()
+        await first.disconnect()
+        message = await second.receive_json_from()
+        while message["type"] != "disconnect_message":
+            message = await second.receive_json_from()
+        await second.disconnect()
+
+    async def settle(self):
+        await asyncio.sleep(3 * PongConsumer.scheduler.interval)
+        gc.collect()
+
+    async def test_disconnect_frees_match_state(self):
+        await self.play_match()
+        await self.settle()
+        self.assertEqual(len(PongConsumer.matchmaker), 0)
+        self.assertEqual(PongConsumer.matchmaker.players, {})
+        self.assertEqual(PongConsumer.groups_info, {})
+        self.assertEqual(len(PongConsumer.engine), 0)
+        self.assertEqual(PongConsumer.scheduler.matches, {})
+        self.assertEqual(PongConsumer.fanout.consumers, {})
+
+    async def test_metrics_view_reports_the_loop(self):
+        await self.play_match()
+        await self.settle()
+        response = await self.async_client.get("/pong/metrics/")
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn("pong_active_matches 0", body)
+        count = next(
+            line for line in body.splitlines()
+            if line.startswith("pong_tick_duration_seconds_count ")
+        )
+        self.assertGreater(int(count.split()[1]), 0)
+
+    async def test_metrics_and_debug_views_run_on_the_event_loop(self):
+        loop_thread = threading.get_ident()
+        threads = []
+        render = REGISTRY.render
+
+        def spy_render():
+            threads.append(threading.get_ident())
+            return render()
+
+        def spy_response(data):
+            threads.append(threading.get_ident())
+            return JsonResponse(data)
+
+        with mock.patch.object(REGISTRY, "render", spy_render), \
+                mock.patch("pong.views.JsonResponse", spy_response), self.settings(DEBUG=True):
+            self.assertEqual((await self.async_client.get("/pong/metrics/")).status_code, 200)
+            self.assertEqual((await self.async_client.get("/pong/debug/matches/")).status_code, 200)
+        self.assertEqual(threads, [loop_thread, loop_thread])
+
+    async def test_failed_tick_ends_the_match(self):
+        application = PongConsumer.as_asgi()
+        players = [WebsocketCommunicator(application, "/pong/") for _ in range(2)]
+        with mock.patch.object(PongConsumer.encoder, "frame", side_effect=RuntimeError("broken frame")), \
+                self.assertLogs("pong.scheduler", "ERROR"):
+            for player in players:
+                await player.connect()
+            for player in players:
+                message = await player.receive_json_from()
+                while message["type"] != "disconnect_message":
+                    message = await player.receive_json_from()
+                self.assertEqual(message["message"], "disconnect_all")
+        self.assertEqual(len(PongConsumer.matchmaker), 0)
+        self.assertEqual(PongConsumer.groups_info, {})
+        self.assertEqual(len(PongConsumer.engine), 0)
+        self.assertEqual(PongConsumer.scheduler.matches, {})
+        for player in players:
+            await player.disconnect()
+
+    async def test_repeated_matches_return_to_baseline(self):
+        # Warm up imports, caches and the channel layer before measuring.
+        for _ in range(20):
+            await self.play_match()
+        await self.settle()
+        baseline_tasks = len(asyncio.all_tasks())
+        tracemalloc.start()
+        baseline_memory = tracemalloc.get_traced_memory()[0]
+
+        for _ in range(1000):
+            await self.play_match()
+        await self.settle()
+
+        growth = tracemalloc.get_traced_memory()[0] - baseline_memory
+        tracemalloc.stop()
+        self.assertEqual(len(asyncio.all_tasks()), baseline_tasks)
+        self.assertEqual(len(PongConsumer.engine), 0)
+        self.assertIsNone(PongConsumer.scheduler._task)
+        # A leaked match costs kilobytes; 1000 of them would be megabytes.
+        self.assertLess(growth, 256 * 1024)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS)
+class InputTests(SimpleTestCase):
+    async def start_match(self):
+        application = PongConsumer.as_asgi()
+        players = [WebsocketCommunicator(application, "/pong/") for _ in range(2)]
+        for player in players:
+            await player.connect()
+        for player in players:
+            await player.receive_json_from()
+        return players, next(iter(PongConsumer.groups_info.values()))
+
+    async def end_match(self, players):
+        first, second = players
+        await first.disconnect()
+        message = await second.receive_json_from()
+        while message["type"] != "disconnect_message":
+            message = await second.receive_json_from()
+        await second.disconnect()
+
+    async def send(self, player, *messages):
+        # Every message is counted as it arrives, before it is handled.
+        received = PongConsumer.metrics.inputs.value + len(messages)
+        for message in messages:
+            if isinstance(message, str):
+                await player.send_to(text_data=message)
+            else:
+                await player.send_json_to(message)
+        for _ in range(1000):
+            if PongConsumer.metrics.inputs.value >= received:
+                break
+            await asyncio.sleep(0.001)
+
+    async def test_stale_and_repeated_input_is_ignored(self):
+        players, match = await self.start_match()
+        first = players[0]
+        await self.send(first, {"type": "keydown", "keycode": "ArrowUp", "seq": 2})
+        self.assertTrue(match.p1_moving_up)
+        # Older and repeated keyups for the same key lose to the keydown.
+        await self.send(first, {"type": "keyup", "keycode": "ArrowUp", "seq": 1},
+                        {"type": "keyup", "keycode": "ArrowUp", "seq": 2})
+        self.assertTrue(match.p1_moving_up)
+        # Each key has its own sequence.
+        await self.send(first, {"type": "keydown", "keycode": "ArrowDown", "seq": 1})
+        self.assertTrue(match.p1_moving_down)
+        await self.send(first, {"type": "keyup", "keycode": "ArrowUp", "seq": 3})
+        self.assertFalse(match.p1_moving_up)
+        self.assertFalse(match.p2_moving_up)
+        await self.end_match(players)
+
+    async def test_malformed_input_is_dropped(self):
+        players, match = await self.start_match()
+        first = players[0]
+        await self.send(first, *(
+            {"type": "keydown", "keycode": keycode, "seq": seq}
+            for keycode, seq in (("ArrowUp", "5"), ("ArrowUp", None), ("ArrowUp", [1]), (["ArrowUp"], 1))
+        ))
+        self.assertFalse(match.p1_moving_up)
+        await self.send(first, {"type": "keydown", "keycode": "ArrowUp", "seq": 1})
+        self.assertTrue(match.p1_moving_up)
+        await self.end_match(players)
+
+    def assertMatchFreed(self):
+        self.assertEqual(len(PongConsumer.matchmaker), 0)
+        self.assertEqual(PongConsumer.groups_info, {})
+        self.assertEqual(len(PongConsumer.engine), 0)
+        self.assertEqual(PongConsumer.scheduler.matches, {})
+        self.assertEqual(PongConsumer.fanout.consumers, {})
+
+    async def test_malformed_messages_are_ignored(self):
+        players, match = await self.start_match()
+        first = players[0]
+        await self.send(first, "not json", [1], {}, {"type": ["keydown"]}, {"type": "keydown", "keycode": "ArrowUp", "seq": 1})
+        self.assertTrue(match.p1_moving_up)
+        await self.end_match(players)
+        self.assertMatchFreed()
+
+    async def test_crashed_consumer_frees_its_match(self):
+        players, _ = await self.start_match()
+        first, second = players
+        with mock.patch.object(PongConsumer, "handle_key", side_effect=RuntimeError("broken input")):
+            await first.send_json_to({"type": "keydown", "keycode": "ArrowUp", "seq": 1})
+            with self.assertRaises(RuntimeError):
+                await first.wait()
+        message = await second.receive_json_from()
+        while message["type"] != "disconnect_message":
+            message = await second.receive_json_from()
+        self.assertEqual(message["message"], "disconnect_all")
+        await second.disconnect()
+        self.assertMatchFreed()
+
+    async def test_input_over_the_rate_limit_is_dropped(self):
+        dropped = PongConsumer.metrics.inputs_dropped.value
+        with mock.patch.object(PongConsumer, "input_rate", 0.0), mock.patch.object(PongConsumer, "input_burst", 3):
+            players, match = await self.start_match()
+            first = players[0]
+            await self.send(first, *(
+                {"type": "keydown" if seq % 2 else "keyup", "keycode": "ArrowUp", "seq": seq}
+                for seq in range(1, 6)
+            ))
+            self.assertEqual(PongConsumer.metrics.inputs_dropped.value - dropped, 2)
+            # The third message, a keydown, was the last one let through.
+            self.assertTrue(match.p1_moving_up)
+            await self.end_match(players)
+
+    async def test_control_messages_do_not_spend_the_key_allowance(self):
+        with mock.patch.object(PongConsumer, "input_rate", 0.0), mock.patch.object(PongConsumer, "input_burst", 1):
+            players, match = await self.start_match()
+            first = players[0]
+            await self.send(first, *([{"type": "keyframe_request"}] * 3), {"type": "keydown", "keycode": "ArrowUp", "seq": 1})
+            self.assertTrue(match.p1_moving_up)
+            # The allowance is spent, and a disconnect still gets through.
+            await first.send_json_to({"type": "disconnect"})
+            message = await first.receive_output()
+            while message["type"] != "websocket.close":
+                message = await first.receive_output()
+            await self.end_match(players)
+
+
+class MatchmakerTests(SimpleTestCase):
+    def test_match_ids_are_never_reused(self):
+        matchmaker = Matchmaker(max_size=2)
+        seen = set()
+        for round in range(50):
+            match_id, _ = matchmaker.join(f"first.{round}")
+            self.assertEqual(matchmaker.join(f"second.{round}"), (match_id, 2))
+            self.assertNotIn(match_id, seen)
+            seen.add(match_id)
+            matchmaker.end(match_id)
+        self.assertEqual(len(matchmaker), 0)
+
+    def test_abandoned_matches_are_pruned_from_the_queue(self):
+        matchmaker = Matchmaker(max_size=2)
+        abandoned, _ = matchmaker.join("gone")
+        matchmaker.end(abandoned)
+        # Left in the queue until the next join reaches it.
+        self.assertEqual(list(matchmaker.waiting), [abandoned])
+        match_id, player_num = matchmaker.join("first")
+        self.assertNotEqual(match_id, abandoned)
+        self.assertEqual(player_num, 1)
+        self.assertEqual(list(matchmaker.waiting), [match_id])
+        self.assertEqual(matchmaker.join("second"), (match_id, 2))
+        self.assertEqual(list(matchmaker.waiting), [])
+        self.assertEqual(matchmaker.players, {"first": (match_id, 1), "second": (match_id, 2)})
+
+
+class SchedulerTests(unittest.IsolatedAsyncioTestCase):
+    async def run_scheduler(self, scheduler, stalls, ticks):
+        # A fake clock that only moves when the scheduler sleeps or a tick
+        # stalls for the time given in ``stalls``.
+        clock = [0.0]
+        started = []
+
+        async def step():
+            started.append(clock[0])
+            clock[0] += stalls.get(len(started), 0.0)
+            if len(started) == ticks:
+                scheduler.unregister("match")
+
+        pause = asyncio.sleep
+
+        async def sleep(delay):
+            clock[0] += delay
+            await pause(0)
+
+        scheduler.matches["match"] = step
+        with mock.patch("pong.scheduler.time", mock.Mock(monotonic=lambda: clock[0])), \
+                mock.patch("pong.scheduler.asyncio.sleep", sleep):
+            await scheduler.run()
+        return [round(time, 6) for time in started]
+
+    async def test_late_ticks_are_caught_up(self):
+        scheduler = TickScheduler(rate=10, max_catchup=3)
+        started = await self.run_scheduler(scheduler, {3: 0.25}, 6)
+        # The two ticks due during the stall run back to back.
+        self.assertEqual(started, [0.0, 0.1, 0.2, 0.45, 0.45, 0.5])
+        self.assertEqual(scheduler.skipped_ticks, 0)
+
+    async def test_ticks_beyond_the_catchup_limit_are_skipped(self):
+        scheduler = TickScheduler(rate=10, max_catchup=3)
+        started = await self.run_scheduler(scheduler, {3: 1.05}, 6)
+        # One late tick, then back on the original schedule.
+        self.assertEqual(started, [0.0, 0.1, 0.2, 1.25, 1.3, 1.4])
+        self.assertEqual(scheduler.skipped_ticks, 9)
+
+    async def test_failed_match_is_aborted(self):
+        scheduler = TickScheduler(rate=120)
+        aborted = []
+
+        async def broken():
+            raise RuntimeError("broken step")
+
+        async def healthy():
+            tasks.append(asyncio.current_task())
+
+        async def abort():
+            aborted.append("broken")
+
+        tasks = []
+        with self.assertLogs("pong.scheduler", "ERROR"):
+            scheduler.register("broken", broken, abort)
+            scheduler.register("healthy", healthy)
+            await scheduler.tick()
+        self.assertEqual(aborted, ["broken"])
+        # Steps run in the ticking task, not one task each.
+        self.assertEqual(tasks, [asyncio.current_task()])
+        self.assertEqual(list(scheduler.matches), ["healthy"])
+        self.assertEqual(scheduler.aborts, {})
+        scheduler.unregister("healthy")
+        await scheduler._task
+
+
+class MetricsServerTests(unittest.IsolatedAsyncioTestCase):
+    async def test_shard_metrics_are_served_over_http(self):
+        registry = Registry()
+        registry.counter("pong_test_total", "A test counter.").inc(3)
+        server = await serve(registry, "127.0.0.1", 0)
+        async with server:
+            port = server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"GET /metrics HTTP/1.1\r\nHost: shard\r\n\r\n")
+            response = (await reader.read()).decode()
+            writer.close()
+        head, body = response.split("\r\n\r\n", 1)
+        self.assertTrue(head.startswith("HTTP/1.1 200 OK"))
+        self.assertIn("pong_test_total 3", body)
+
+
+class ProfilerTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.scheduler = TickScheduler(rate=120)
+        self.profiler = Profiler(self.scheduler, directory.name)
+
+    async def wait_for_session(self):
+        for _ in range(100):
+            if self.profiler.session is None:
+                break
+            await asyncio.sleep(0.01)
+        self.assertIsNone(self.profiler.session)
+
+    async def test_match_profile_is_written_and_its_step_restored(self):
+        async def step():
+            sum(range(1000))
+
+        self.scheduler.matches["match"] = step
+        path = self.profiler.start(0.05, match_id="match")
+        profiled_step = self.scheduler.matches["match"]
+        self.assertIsNot(profiled_step, step)
+        with self.assertRaises(ProfilerBusy):
+            self.profiler.start(0.05)
+        for _ in range(3):
+            await profiled_step()
+        await self.wait_for_session()
+        self.assertIs(self.scheduler.matches["match"], step)
+        functions = {name for _, _, name in pstats.Stats(path).stats}
+        self.assertIn("step", functions)
+
+    async def test_worker_sample_is_written(self):
+        path = self.profiler.start(0.05, mode="sample")
+        await self.wait_for_session()
+        self.assertTrue(os.path.isfile(path))
+        self.assertTrue(path.endswith(".folded"))
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS)
+class ShardingTests(SimpleTestCase):
+    async def test_match_is_simulated_by_its_owner(self):
+        await self.play_sharded_match(registry=None)
+
+    @unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+    async def test_registry_match_is_simulated_by_lease_holder(self):
+        client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+        registry = RedisRegistry(client)
+        with mock.patch.object(PongConsumer, "registry", registry):
+            await self.play_sharded_match(registry)
+        self.assertEqual(await client.keys("pong:lease:*"), [])
+        self.assertEqual(await client.hlen("pong:players"), 0)
+
+    @unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+    async def test_drained_shard_hands_its_match_over(self):
+        client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+        registry = RedisRegistry(client)
+        layer = get_channel_layer()
+        workers = [
+            ShardWorker(index, 2, layer, PongConsumer.scheduler, PongConsumer.fanout, registry)
+            for index in range(2)
+        ]
+        tasks = [asyncio.create_task(worker.run()) for worker in workers]
+        application = PongConsumer.as_asgi()
+        try:
+            with mock.patch.object(PongConsumer, "shards", 2), \
+                    mock.patch.object(PongConsumer, "registry", registry), \
+                    mock.patch("pong.sharding.DRAIN_GRACE", 0.1):
+                first = WebsocketCommunicator(application, "/pong/")
+                second = WebsocketCommunicator(application, "/pong/")
+                await first.connect()
+                await second.connect()
+                await first.receive_json_from()
+                await second.receive_json_from()
+                self.assertEqual((await second.receive_json_from())["type"], "positions")
+                old, new = workers if workers[0].matches else workers[::-1]
+                match_id = next(iter(old.matches))
+                old.matches[match_id].player_1_score = 4
+
+                await layer.send(old.channel, {"type": "shard.drain", "to": new.index})
+                await asyncio.wait_for(tasks[old.index], 1)
+                self.assertEqual(old.matches, {})
+                self.assertEqual(new.matches[match_id].player_1_score, 4)
+                self.assertEqual(await registry.owner(match_id), new.channel)
+
+                # Frames keep coming and input reaches the new owner.
+                self.assertEqual((await second.receive_json_from())["type"], "positions")
+                await first.send_json_to({"type": "keydown", "keycode": "ArrowUp", "seq": 1})
+                for _ in range(50):
+                    if new.matches[match_id].p1_moving_up:
+                        break
+                    await asyncio.sleep(0.01)
+                self.assertTrue(new.matches[match_id].p1_moving_up)
+
+                await first.disconnect()
+                message = await second.receive_json_from()
+                while message["type"] != "disconnect_message":
+                    message = await second.receive_json_from()
+                await second.disconnect()
+                await asyncio.sleep(3 * PongConsumer.scheduler.interval)
+        finally:
+            for task in tasks:
+                task.cancel()
+        self.assertEqual(new.matches, {})
+        self.assertEqual(await client.keys("pong:lease:*"), [])
+
+    @unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+    async def test_match_of_a_dead_shard_is_taken_over(self):
+        client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+        registry = RedisRegistry(client, lease_ttl=0.3)
+        layer = get_channel_layer()
+        workers = [
+            ShardWorker(index, 2, layer, PongConsumer.scheduler, PongConsumer.fanout, registry)
+            for index in range(2)
+        ]
+        tasks = [asyncio.create_task(worker.run()) for worker in workers]
+        application = PongConsumer.as_asgi()
+        try:
+            with mock.patch.object(PongConsumer, "shards", 2), \
+                    mock.patch.object(PongConsumer, "registry", registry):
+                first = WebsocketCommunicator(application, "/pong/")
+                second = WebsocketCommunicator(application, "/pong/")
+                await first.connect()
+                self.assertEqual((await first.receive_json_from())["player_num"], 1)
+                await second.connect()
+                await second.receive_json_from()
+                self.assertEqual((await second.receive_json_from())["type"], "positions")
+                dead, live = workers if workers[0].matches else workers[::-1]
+                match_id = next(iter(dead.matches))
+                dead.matches[match_id].player_1_score = 4
+                await asyncio.sleep(registry.lease_ttl / 2)
+
+                # The owner dies without letting go of anything.
+                tasks[dead.index].cancel()
+                for match in dead.matches.values():
+                    PongConsumer.scheduler.unregister(match.match_id)
+                    match.release()
+                for _ in range(100):
+                    if match_id in live.matches:
+                        break
+                    await asyncio.sleep(0.02)
+                self.assertEqual(live.matches[match_id].player_1_score, 4)
+                self.assertEqual(await registry.owner(match_id), live.channel)
+
+                # Frames come from the new owner and input reaches it.
+                self.assertEqual((await second.receive_json_from())["type"], "positions")
+                await first.send_json_to({"type": "keydown", "keycode": "ArrowUp", "seq": 1})
+                for _ in range(50):
+                    if live.matches[match_id].p1_moving_up:
+                        break
+                    await asyncio.sleep(0.01)
+                self.assertTrue(live.matches[match_id].p1_moving_up)
+
+                await first.disconnect()
+                message = await second.receive_json_from()
+                while message["type"] != "disconnect_message":
+                    message = await second.receive_json_from()
+                await second.disconnect()
+                await asyncio.sleep(3 * PongConsumer.scheduler.interval)
+        finally:
+            for task in tasks:
+                task.cancel()
+        self.assertEqual(live.matches, {})
+        self.assertEqual(await client.hlen("pong:snapshots"), 0)
+        self.assertEqual(PongConsumer.scheduler.matches, {})
+
+    async def play_sharded_match(self, registry):
+        layer = get_channel_layer()
+        workers = [
+            ShardWorker(index, 2, layer, PongConsumer.scheduler, PongConsumer.fanout, registry)
+            for index in range(2)
+        ]
+        tasks = [asyncio.create_task(worker.run()) for worker in workers]
+        application = PongConsumer.as_asgi()
+        try:
+            with mock.patch.object(PongConsumer, "shards", 2):
+                first = WebsocketCommunicator(application, "/pong/")
+                second = WebsocketCommunicator(application, "/pong/")
+                # Players are seated once connected, so the second waits.
+                await first.connect()
+                self.assertEqual((await first.receive_json_from())["player_num"], 1)
+                await second.connect()
+                self.assertEqual((await second.receive_json_from())["player_num"], 2)
+                self.assertEqual((await second.receive_json_from())["type"], "positions")
+                match_id = next(match_id for worker in workers for match_id in worker.matches)
+                owner = workers[shard_for(match_id, 2)]
+                self.assertIn(match_id, owner.matches)
+                self.assertNotIn(match_id, workers[1 - owner.index].matches)
+
+                spectator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f"/pong/watch/{match_id}/")
+                self.assertTrue((await spectator.connect())[0])
+                self.assertEqual((await spectator.receive_json_from())["type"], "spectate")
+                self.assertEqual((await spectator.receive_json_from())["type"], "positions")
+                self.assertEqual(len(owner.watchers[match_id]), 1)
+
+                await first.disconnect()
+                message = await second.receive_json_from()
+                while message["type"] != "disconnect_message":
+                    message = await second.receive_json_from()
+                await second.disconnect()
+                message = await spectator.receive_json_from()
+                while message["type"] != "disconnect_message":
+                    message = await spectator.receive_json_from()
+                await spectator.disconnect()
+                await asyncio.sleep(3 * PongConsumer.scheduler.interval)
+        finally:
+            for task in tasks:
+                task.cancel()
+        self.assertEqual(owner.matches, {})
+        if registry is None:
+            self.assertEqual(len(workers[0].matchmaker), 0)
+        self.assertEqual(PongConsumer.scheduler.matches, {})
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS)
+class SpectatorTests(SimpleTestCase):
+    async def test_spectators_share_one_stream(self):
+        application = URLRouter(websocket_urlpatterns)
+        first = WebsocketCommunicator(application, "/pong/")
+        second = WebsocketCommunicator(application, "/pong/")
+        await first.connect()
+        await second.connect()
+        await first.receive_json_from()
+        await second.receive_json_from()
+        match_id = next(iter(PongConsumer.groups_info))
+
+        unknown = WebsocketCommunicator(application, "/pong/watch/match_0/")
+        self.assertFalse((await unknown.connect())[0])
+
+        watchers = [
+            WebsocketCommunicator(application, f"/pong/watch/{match_id}/",
+                subprotocols=["pong.v1.binary"] if i % 2 else [])
+            for i in range(20)
+        ]
+        for watcher in watchers:
+            self.assertTrue((await watcher.connect())[0])
+            hello = await watcher.receive_json_from()
+            self.assertEqual(hello["type"], "spectate")
+        self.assertEqual(len(PongConsumer.spectators), 20)
+        # Wait for a frame that every spectator saw.
+        frames = [[await watcher.receive_output(1) for _ in range(3)] for watcher in watchers]
+        binary = [{message["bytes"] for message in received} for received in frames[1::2]]
+        self.assertTrue(set.intersection(*binary))
+        for message in frames[0]:
+            self.assertEqual(json.loads(message["text"])["type"], "positions")
+
+        # Spectator input is ignored, and players are unaffected.
+        await watchers[0].send_json_to({"type": "keydown", "keycode": "ArrowUp", "seq": 1})
+        self.assertFalse(PongConsumer.groups_info[match_id].p1_moving_up)
+
+        await first.disconnect()
+        await second.disconnect()
+        for watcher in watchers:
+            message = await watcher.receive_json_from()
+            while message["type"] != "disconnect_message":
+                message = await watcher.receive_json_from()
+            self.assertEqual(message["message"], "match_over")
+            self.assertEqual((await watcher.receive_output())["type"], "websocket.close")
+            await watcher.disconnect()
+        self.assertEqual(PongConsumer.spectators.audiences, {})
+
+
+class FrameTests(SimpleTestCase):
+    def engine_coords(self, engine, handle):
+        row = engine.handle_row[handle]
+        return np.concatenate([engine.sphere_position[row], engine.bar_position[row].ravel()])
+
+    def test_keyframes_and_deltas_round_trip(self):
+        rng = random.Random(5)
+        engine = BatchEngine()
+        encoder = FrameEncoder(keyframe_interval=30)
+        decoders = {engine.add(): FrameDecoder() for _ in range(5)}
+        kinds = set()
+        for tick in range(1, 121):
+            handle = rng.choice(list(decoders))
+            engine.set_held(handle, rng.choice((1, 2)), rng.choice((0, 1)), rng.random() < 0.5)
+            if tick == 60:
+                # Moves the last match into the freed row, which must then
+                # be sent as a keyframe.
+                handle = next(iter(decoders))
+                engine.remove(handle)
+                del decoders[handle]
+            engine.step()
+            encoder.encode(engine, tick, tick * 16)
+            for handle, decoder in decoders.items():
+                data = encoder.frame(engine.handle_row[handle])
+                kinds.add(data[0])
+                decoded = decoder.decode(data)
+                self.assertIsNotNone(decoded)
+                self.assertEqual(decoded[:2], (tick, tick * 16))
+                np.testing.assert_allclose(decoded[2], self.engine_coords(engine, handle), atol=0.5 / SCALE)
+        self.assertEqual(kinds, {FRAME_POSITIONS, FRAME_DELTA})
+
+    def test_requested_keyframe_lets_a_late_client_decode(self):
+        engine = BatchEngine()
+        encoder = FrameEncoder(keyframe_interval=30)
+        handle = engine.add()
+        engine.step()
+        encoder.encode(engine, 1)
+        engine.step()
+        encoder.encode(engine, 2)
+        late = FrameDecoder()
+        data = encoder.frame(0)
+        self.assertEqual(data[0], FRAME_DELTA)
+        self.assertIsNone(late.decode(data))
+
+        encoder.request_keyframe(handle)
+        engine.step()
+        encoder.encode(engine, 3)
+        data = encoder.frame(0)
+        self.assertEqual(data[0], FRAME_POSITIONS)
+        np.testing.assert_allclose(late.decode(data)[2], self.engine_coords(engine, handle), atol=0.5 / SCALE)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS)
+class KeyframeRequestTests(SimpleTestCase):
+    async def receive_frame(self, player):
+        message = await player.receive_output()
+        while "bytes" not in message:
+            message = await player.receive_output()
+        return message["bytes"]
+
+    async def test_keyframe_request_is_answered_at_once(self):
+        application = PongConsumer.as_asgi()
+        players = [WebsocketCommunicator(application, "/pong/", subprotocols=[SUBPROTOCOL_BINARY]) for _ in range(2)]
+        for player in players:
+            await player.connect()
+        first = players[0]
+        # Wait for a delta early in its keyframe interval, so the next
+        # scheduled keyframe is still far off.
+        interval = PongConsumer.encoder.keyframe_interval
+        frame = await self.receive_frame(first)
+        while frame[0] != FRAME_DELTA or DELTA_HEADER.unpack_from(frame)[3] >= interval // 2:
+            frame = await self.receive_frame(first)
+        decoder = FrameDecoder()
+        self.assertIsNone(decoder.decode(frame))
+
+        await first.send_json_to({"type": "keyframe_request"})
+        # At most one delta was already on its way.
+        for _ in range(3):
+            frame = await self.receive_frame(first)
+            if frame[0] == FRAME_POSITIONS:
+                break
+        self.assertEqual(frame[0], FRAME_POSITIONS)
+        self.assertIsNotNone(decoder.decode(frame))
+
+        await first.disconnect()
+        message = await players[1].receive_output()
+        while message.get("text") is None or "disconnect_message" not in message["text"]:
+            message = await players[1].receive_output()
+        await players[1].disconnect()
+
+
+class OutboxTests(unittest.IsolatedAsyncioTestCase):
+    async def test_stalled_socket_keeps_latest_frames_and_every_control_message(self):
+        written = []
+        unblock = asyncio.Event()
+
+        async def stalled_send(message):
+            await unblock.wait()
+            written.append(message)
+
+        class Consumer:
+            binary = True
+
+        stalled, healthy = Consumer(), Consumer()
+        stalled.outbox = Outbox(stalled_send)
+        healthy_written = []
+
+        async def healthy_send(message):
+            healthy_written.append(message)
+
+        healthy.outbox = Outbox(healthy_send)
+        fanout = LocalFanout()
+        fanout.attach("stalled", stalled)
+        fanout.attach("healthy", healthy)
+
+        await stalled.outbox.send({"type": "websocket.accept"})
+        await asyncio.sleep(0)
+        for tick in range(1, 101):
+            kind = FRAME_POSITIONS if tick % 30 == 1 else FRAME_DELTA
+            frame = bytes([kind, tick])
+            # Never waits on the stalled socket.
+            await asyncio.wait_for(fanout.publish(None, ["stalled", "healthy"], frame, None), 0.01)
+            if tick == 50:
+                await stalled.outbox.send({"type": "websocket.send", "text": "player_num"})
+            await asyncio.sleep(0)
+
+        self.assertEqual(len(healthy_written), 100)
+        self.assertEqual(len(stalled.outbox), 3)
+        self.assertGreater(stalled.outbox.current_lag(), 0)
+        unblock.set()
+        await asyncio.sleep(0.01)
+
+        # Control messages go ahead of waiting frames.
+        self.assertEqual(written[0]["type"], "websocket.accept")
+        self.assertEqual(written[1]["text"], "player_num")
+        # The keyframe of tick 91 and the latest delta against it.
+        self.assertEqual([message["bytes"] for message in written[2:]],
+            [bytes([FRAME_POSITIONS, 91]), bytes([FRAME_DELTA, 100])])
+        self.assertEqual(stalled.outbox.dropped, 98)
+        self.assertEqual(len(stalled.outbox), 0)
+        stalled.outbox.close()
+        healthy.outbox.close()
+
+    async def test_socket_too_far_behind_is_closed(self):
+        written = []
+        unblock = asyncio.Event()
+
+        async def stalled_send(message):
+            await unblock.wait()
+            written.append(message)
+
+        outbox = Outbox(stalled_send, max_control=10)
+        await outbox.send({"type": "websocket.accept"})
+        await asyncio.sleep(0)
+        for i in range(12):
+            await outbox.send({"type": "websocket.send", "text": str(i)})
+            outbox.frame(bytes_data=bytes([FRAME_POSITIONS, i]))
+        self.assertEqual(len(outbox), 2)
+        unblock.set()
+        await asyncio.sleep(0.01)
+        # The accept was already being written; everything after the cap
+        # gave way to the close.
+        self.assertEqual([message["type"] for message in written], ["websocket.accept", "websocket.close"])
+        self.assertEqual(written[1]["code"], 1013)
+        outbox.close()
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS)
+class DrainTests(SimpleTestCase):
+    async def test_drained_match_resumes_from_tokens(self):
+        application = PongConsumer.as_asgi()
+        first = WebsocketCommunicator(application, "/pong/")
+        second = WebsocketCommunicator(application, "/pong/")
+        await first.connect()
+        await second.connect()
+        await first.receive_json_from()
+        await second.receive_json_from()
+        self.assertEqual((await second.receive_json_from())["type"], "positions")
+        match = next(iter(PongConsumer.groups_info.values()))
+        match.player_2_score = 3
+
+        with mock.patch.object(PongConsumer, "draining", False):
+            self.assertEqual(await PongConsumer.drain(), 1)
+            tokens = []
+            for player in (first, second):
+                message = await player.receive_json_from()
+                while message["type"] != "resume":
+                    message = await player.receive_json_from()
+                tokens.append(message["token"])
+                self.assertEqual((await player.receive_output())["type"], "websocket.close")
+                await player.disconnect()
+            self.assertEqual(PongConsumer.groups_info, {})
+            late = WebsocketCommunicator(application, "/pong/")
+            self.assertFalse((await late.connect())[0])
+
+        forged = WebsocketCommunicator(application, "/pong/?resume=" + quote(tokens[0][:-1] + "x"))
+        self.assertFalse((await forged.connect())[0])
+        second = WebsocketCommunicator(application, f"/pong/?resume={quote(tokens[1])}")
+        self.assertTrue((await second.connect())[0])
+        self.assertEqual((await second.receive_json_from())["player_num"], 2)
+        # Nothing moves until every player is back.
+        self.assertEqual(PongConsumer.groups_info, {})
+        first = WebsocketCommunicator(application, f"/pong/?resume={quote(tokens[0])}")
+        self.assertTrue((await first.connect())[0])
+        self.assertEqual((await first.receive_json_from())["player_num"], 1)
+        self.assertEqual((await first.receive_json_from())["type"], "positions")
+        resumed = next(iter(PongConsumer.groups_info.values()))
+        self.assertEqual(resumed.player_2_score, 3)
+        # A seat can only be taken back once.
+        again = WebsocketCommunicator(application, f"/pong/?resume={quote(tokens[0])}")
+        self.assertFalse((await again.connect())[0])
+
+        await first.disconnect()
+        message = await second.receive_json_from()
+        while message["type"] != "disconnect_message":
+            message = await second.receive_json_from()
+        await second.disconnect()
+        self.assertEqual(PongConsumer.resuming, {})
+
+    async def test_unusable_snapshot_is_refused(self):
+        application = PongConsumer.as_asgi()
+        other_arena = snapshot(MatchState("match_1", ArenaEngine(Arena(balls=2))), 0)
+        for data in (b"not a snapshot", other_arena):
+            player = WebsocketCommunicator(application, "/pong/?resume=" + quote(resume_token("key", 1, data)))
+            self.assertFalse((await player.connect())[0])
+        self.assertEqual(PongConsumer.resuming, {})
+        self.assertEqual(len(PongConsumer.matchmaker), 0)
+
+
+class SnapshotTests(SimpleTestCase):
+    def test_restored_match_continues_exactly(self):
+        for make_engine in (BatchEngine, lambda: ArenaEngine(Arena(balls=3))):
+            engine = make_engine()
+            match = MatchState("match_1", engine)
+            for _ in range(40):
+                engine.step()
+            match.set_held(1, 0, True)
+            match.player_1_score = 7
+            match.started_at = 1234.5
+            data = snapshot(match, 40)
+
+            copy = make_engine()
+            restored, tick = restore(data, "match_1", copy)
+            self.assertEqual(tick, 40)
+            self.assertEqual(restored.player_1_score, 7)
+            self.assertEqual(restored.started_at, 1234.5)
+            self.assertTrue(restored.p1_moving_up)
+            for _ in range(100):
+                engine.step()
+                copy.step()
+            np.testing.assert_array_equal(copy.sphere_position[:1], engine.sphere_position[:1])
+            np.testing.assert_array_equal(copy.bar_position[:1], engine.bar_position[:1])
+
+    def test_snapshot_must_match_the_arena(self):
+        data = snapshot(MatchState("match_1", BatchEngine()), 0)
+        with self.assertRaises(ValueError):
+            restore(data, "match_1", ArenaEngine(Arena(balls=2)))
+        with self.assertRaises(ValueError):
+            restore(data[:-1], "match_1", BatchEngine())
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS)
+class ResultTests(TestCase):
+    def test_goal_scores_and_serves_towards_the_loser(self):
+        engine = BatchEngine()
+        match = MatchState("match_1", engine)
+        match.sphere_position[:] = (-2.95, 1.0, 0.0)
+        match.sphere_direction[:] = (-1.0, 0.0, 0.0)
+        engine.step()
+        self.assertEqual(match.scores, [0, 1])
+        self.assertIn(match.handle, engine.scored)
+        self.assertLess(abs(match.sphere_position[0]), 0.1)
+        self.assertLess(match.sphere_direction[0], 0.0)
+
+    def test_shared_lead_is_not_a_win(self):
+        engine = ArenaEngine(FOUR_PLAYER)
+        match = MatchState("match_1", engine)
+        for scores, winner in (([4, 4, 4, 0], None), ([5, 5, 5, 0], None), ([6, 6, 5, 1], None),
+                               ([7, 6, 6, 2], 1), ([5, 5], None)):
+            engine.scores[match.row, :len(scores)] = scores
+            engine.scores[match.row, len(scores):] = 0
+            self.assertEqual(match.winner(5), winner, scores)
+
+    async def test_won_match_is_saved_behind_the_tick(self):
+        writer = ResultWriter(interval=60)
+        with mock.patch.object(PongConsumer, "results", writer):
+            application = PongConsumer.as_asgi()
+            first = WebsocketCommunicator(application, "/pong/")
+            second = WebsocketCommunicator(application, "/pong/")
+            await first.connect()
+            await second.connect()
+            await first.receive_json_from()
+            await second.receive_json_from()
+            match = next(iter(PongConsumer.groups_info.values()))
+            match.player_2_score = 4
+            match.sphere_position[:] = (-2.9, 1.0, 0.0)
+            match.sphere_direction[:] = (-1.0, 0.0, 0.0)
+
+            message = await first.receive_json_from()
+            while message["type"] != "score":
+                message = await first.receive_json_from()
+            self.assertEqual(message["scores"], [0, 5])
+            message = await first.receive_json_from()
+            while message["type"] != "disconnect_message":
+                message = await first.receive_json_from()
+            self.assertEqual(message["message"], "match_over")
+            self.assertEqual(PongConsumer.groups_info, {})
+            await first.disconnect()
+            await second.disconnect()
+
+            # Nothing has touched the database yet.
+            self.assertEqual(len(writer), 1)
+            self.assertEqual(await Match.objects.acount(), 0)
+            await writer.flush()
+        saved = await Match.objects.aget()
+        self.assertEqual(saved.winner, 2)
+        self.assertEqual([(result.player_num, result.score, result.won) async for result in saved.results.all()],
+                         [(1, 0, False), (2, 5, True)])
+
+    async def test_burst_of_results_takes_few_transactions(self):
+        metrics = LoopMetrics(Registry())
+        writer = ResultWriter(interval=60, batch_size=500, metrics=metrics)
+        for i in range(2000):
+            writer.record(f"match_{i}", "classic", 0.0, [5, i % 5], 1)
+        await writer.flush()
+        self.assertEqual(metrics.result_transactions.value, 4)
+        self.assertEqual(metrics.results_written.value, 2000)
+        self.assertEqual(len(writer), 0)
+        self.assertEqual(await Match.objects.acount(), 2000)
+        self.assertEqual(await Match.objects.filter(results__won=True).acount(), 2000)
+
+    async def test_failed_write_is_retried_without_duplicates(self):
+        metrics = LoopMetrics(Registry())
+        writer = ResultWriter(interval=60, batch_size=10, metrics=metrics)
+        for i in range(30):
+            writer.record(f"match_{i}", "classic", 0.0, [5, 0], 1)
+        bulk_create = Result.objects.bulk_create
+        calls = []
+
+        def fail_second_chunk(objs):
+            calls.append(len(objs))
+            if len(calls) == 2:
+                raise DatabaseError("database is locked")
+            return bulk_create(objs)
+
+        with mock.patch.object(Result.objects, "bulk_create", fail_second_chunk), \
+                self.assertLogs("pong.persistence", "ERROR"):
+            await writer.flush()
+        # The first chunk was committed; the other two are queued again.
+        self.assertEqual(len(writer), 20)
+        self.assertEqual(writer.failures, 1)
+        self.assertEqual(await Match.objects.acount(), 10)
+        await writer.flush()
+        self.assertEqual(writer.failures, 0)
+        self.assertEqual(await Match.objects.acount(), 30)
+        self.assertEqual(len({match_id async for match_id in Match.objects.values_list("match_id", flat=True)}), 30)
+
+    async def test_queue_is_bounded_while_writes_fail(self):
+        metrics = LoopMetrics(Registry())
+        writer = ResultWriter(interval=60, metrics=metrics, max_pending=10)
+        with mock.patch.object(ResultWriter, "write", side_effect=DatabaseError("disk I/O error")), \
+                self.assertLogs("pong.persistence", "ERROR"):
+            for i in range(8):
+                writer.record(f"match_{i}", "classic", 0.0, [5, 0], 1)
+            await writer.flush()
+            for i in range(8, 15):
+                writer.record(f"match_{i}", "classic", 0.0, [5, 0], 1)
+        self.assertEqual(len(writer), 10)
+        self.assertEqual(metrics.results_dropped.value, 5)
+        self.assertEqual(writer.pending[0][0], "match_5")
+
+
+@unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+class RedisRegistryTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        server = fakeredis.FakeServer()
+        # Two nodes sharing one Redis.
+        self.nodes = [
+            RedisRegistry(fakeredis.aioredis.FakeRedis(server=server, decode_responses=True))
+            for _ in range(2)
+        ]
+
+    async def test_players_on_different_nodes_are_paired(self):
+        first, second = self.nodes
+        self.assertEqual(await first.join("a"), ("match_1", 1))
+        self.assertEqual(await second.join("b"), ("match_1", 2))
+        self.assertEqual(await first.join("c"), ("match_2", 1))
+        self.assertEqual(await second.leave("b"), ("match_1", ["a", "b"]))
+        self.assertIsNone(await first.leave("a"))
+        self.assertEqual(await second.join("d"), ("match_2", 2))
+
+    async def test_concurrent_joins_fill_every_match_exactly(self):
+        joins = [self.nodes[i % 2].join(f"player_{i}") for i in range(100)]
+        results = await asyncio.gather(*joins)
+        sizes = {}
+        for match_id, player_num in results:
+            sizes[match_id] = max(sizes.get(match_id, 0), player_num)
+        self.assertEqual(sorted(sizes.values()), [2] * 50)
+
+    async def test_lease_has_a_single_owner(self):
+        first, second = self.nodes
+        self.assertTrue(await first.claim("match_1", "shard_0"))
+        self.assertFalse(await second.claim("match_1", "shard_1"))
+        self.assertEqual(await second.renew(["match_1"], "shard_1"), ["match_1"])
+        await second.release("match_1", "shard_1")
+        self.assertEqual(await first.owner("match_1"), "shard_0")
+        self.assertEqual(await first.renew(["match_1"], "shard_0"), [])
+        await first.release("match_1", "shard_0")
+        self.assertTrue(await second.claim("match_1", "shard_1"))
+
+
+class ReplayTests(SimpleTestCase):
+    def test_replay_reproduces_recorded_matches_exactly(self):
+        rng = random.Random(7)
+        scheduler = TickScheduler(rate=120)
+        engine = BatchEngine()
+        with tempfile.TemporaryDirectory() as directory:
+            recorder = Recorder(directory, scheduler)
+            live = []
+            final = {}
+            # Matches start, take input and end at random ticks, sharing
+            # the engine the way concurrent matches do.
+            for tick in range(2000):
+                if rng.random() < 0.03:
+                    match = MatchState(f"match_{tick}", engine)
+                    recorder.open(match)
+                    live.append(match)
+                for match in list(live):
+                    if rng.random() < 0.05:
+                        match.set_held(rng.choice((1, 2)), rng.choice((0, 1)), rng.random() < 0.5)
+                    if rng.random() < 0.003 or tick == 1999:
+                        final[match.match_id] = match.positions()
+                        match.release()
+                        live.remove(match)
+                scheduler.tick_count += 1
+                engine.step(scheduler.interval)
+
+            names = sorted(os.listdir(directory))
+            logs = [read_log(os.path.join(directory, name)) for name in names]
+            results = replay(logs)
+            self.assertEqual(len(results), len(final))
+            for name, (sphere, bars) in zip(names, results):
+                recorded = final[name.rsplit("-", 1)[0]]
+                self.assertEqual(sphere, recorded[0])
+                self.assertEqual(bars, [recorded[1], recorded[2]])
+            # Drop the memory maps before the directory is removed.
+            del logs
+
+    def test_replay_of_a_restored_match_starts_with_its_held_keys(self):
+        scheduler = TickScheduler(rate=120)
+        engine = BatchEngine()
+        match = MatchState("match_1", engine)
+        match.set_held(1, 0, True)
+        for _ in range(20):
+            engine.step(scheduler.interval)
+        data = snapshot(match, 20)
+
+        copy = BatchEngine()
+        with tempfile.TemporaryDirectory() as directory:
+            restored, _ = restore(data, "match_1", copy)
+            Recorder(directory, scheduler).open(restored)
+            for _ in range(60):
+                scheduler.tick_count += 1
+                copy.step(scheduler.interval)
+            final = restored.positions()
+            restored.release()
+
+            name, = os.listdir(directory)
+            logs = [read_log(os.path.join(directory, name))]
+            (sphere, bars), = replay(logs)
+            self.assertEqual(sphere, final[0])
+            self.assertEqual(bars, [final[1], final[2]])
+            self.assertGreater(final[1][1], 0.5)
+            del logs
+
+
+class SweptCollisionTests(SimpleTestCase):
+    # 30 Hz and a ball fast enough to cross two arena units per step: far
+    # more than a bar's width, so a ball tested only where it ends up
+    # would pass through.
+    DT = 1 / 30
+    SPEED = 60.0
+
+    def launch(self, position, direction, speed=SPEED):
+        engine = BatchEngine()
+        match = MatchState("match_1", engine)
+        match.sphere_position[:] = position
+        match.sphere_direction[:] = direction
+        engine.sphere_speed[match.row] = speed
+        engine.step(self.DT)
+        return match
+
+    def test_fast_ball_bounces_off_a_bar(self):
+        match = self.launch((-1.0, 0.0, 0.0), (-1.0, 0.0, 0.0))
+        self.assertGreater(match.sphere_direction[0], 0.0)
+        # 1.42 units to the bar's face, then the rest of the step back.
+        self.assertAlmostEqual(match.sphere_position[0], -1.84)
+        self.assertEqual(match.scores, [0, 0])
+
+    def test_fast_ball_bounces_off_a_wall(self):
+        match = self.launch((0.0, 1.0, 0.0), (0.0, 1.0, 0.0))
+        self.assertLess(match.sphere_direction[1], 0.0)
+        self.assertAlmostEqual(match.sphere_position[1], -0.08)
+
+    def test_bounces_beyond_the_limit_stay_in_the_arena(self):
+        # Twenty units straight up and down would take seven bounces;
+        # after MAX_BOUNCES the rest of the step is dropped.
+        match = self.launch((0.0, 0.0, 0.0), (0.0, 1.0, 0.0), speed=600.0)
+        # The fourth bounce was off the lower wall.
+        self.assertAlmostEqual(match.sphere_position[1], -BALL_LIMIT_Y)
+        self.assertGreater(match.sphere_direction[1], 0.0)
+        self.assertEqual(match.sphere_position[0], 0.0)
+
+
+class EventDrivenEngineTests(SimpleTestCase):
+    def run_engines(self, seed, matches, dt, steps, input_chance):
+        # Both engines get the same key changes at the same instants; both
+        # are yielded after every step.
+        rng = random.Random(seed)
+        now = [0.0]
+        batch = BatchEngine()
+        events = EventDrivenEngine(clock=lambda: now[0])
+        handles = [(batch.add(), events.add()) for _ in range(matches)]
+        for _ in range(steps):
+            if rng.random() < input_chance:
+                first, second = rng.choice(handles)
+                held = (rng.choice((1, 2)), rng.choice((0, 1)), rng.random() < 0.5)
+                batch.set_held(first, *held)
+                events.set_held(second, *held)
+            now[0] += dt
+            batch.step(dt)
+            events.step(dt)
+            yield batch, events
+
+    def assertInArena(self, engine, matches):
+        position = engine.sphere_position[:matches]
+        self.assertTrue(np.all(np.abs(position[:, 0]) <= BALL_LIMIT_X + 1e-9))
+        self.assertTrue(np.all(np.abs(position[:, 1]) <= BALL_LIMIT_Y + 1e-9))
+
+    def test_agrees_with_the_batch_engine(self):
+        moved = False
+        for batch, events in self.run_engines(0, 20, 1 / 120, 600, 0.05):
+            np.testing.assert_allclose(events.sphere_position[:20], batch.sphere_position[:20], atol=1e-9)
+            np.testing.assert_allclose(events.bar_position[:20], batch.bar_position[:20], atol=1e-9)
+            self.assertInArena(events, 20)
+            moved = moved or np.any(events.bar_position[:20, :, 1] != 0.0)
+        self.assertTrue(moved)
+        np.testing.assert_array_equal(events.scores[:20], batch.scores[:20])
+
+    def test_held_bars_never_throw_the_ball_out(self):
+        # Coarse steps and constant key changes: bars often slide into the
+        # ball end first, faster than it can get away.
+        for seed in (0, 3):
+            for _, events in self.run_engines(seed, 50, 1 / 20, 2000, 0.5):
+                self.assertInArena(events, 50)
+
+
+class ArenaTests(SimpleTestCase):
+    def test_classic_arena_matches_the_batch_engine(self):
+        rng = random.Random(11)
+        batch = BatchEngine()
+        arena = ArenaEngine(CLASSIC)
+        handles = [(batch.add(), arena.add()) for _ in range(20)]
+        for _ in range(2000):
+            if rng.random() < 0.3:
+                first, second = rng.choice(handles)
+                held = (rng.choice((1, 2)), rng.choice((0, 1)), rng.random() < 0.5)
+                batch.set_held(first, *held)
+                arena.set_held(second, *held)
+            batch.step(1 / 120)
+            arena.step(1 / 120)
+        self.assertTrue(np.array_equal(batch.sphere_position[:20], arena.sphere_position[:20, 0]))
+        self.assertTrue(np.array_equal(batch.bar_position[:20], arena.bar_position[:20]))
+        self.assertTrue(np.array_equal(batch.scores[:20], arena.scores[:20]))
+        self.assertGreater(batch.scores[:20].sum(), 0)
+
+    def test_sweep_and_prune_finds_every_overlap(self):
+        rng = np.random.default_rng(5)
+        lo = rng.uniform(0, 10, (300, 3))
+        hi = lo + rng.uniform(0, 0.6, (300, 3))
+        first, second = sweep_and_prune(lo, hi)
+        found = {tuple(sorted(pair)) for pair in zip(first.tolist(), second.tolist())}
+        expected = {
+            (a, b) for a in range(300) for b in range(a + 1, 300)
+            if np.all(lo[a] <= hi[b]) and np.all(lo[b] <= hi[a])
+        }
+        self.assertEqual(found, expected)
+
+    def test_balls_stay_inside_a_crowded_arena(self):
+        arena = Arena(width=4.0, height=4.0, goals=(WALL_LEFT, WALL_RIGHT, WALL_LOWER, WALL_UPPER), balls=12)
+        engine = ArenaEngine(arena)
+        for _ in range(10):
+            engine.add()
+        engine.held[:10, :, 0] = True
+        for step in range(3000):
+            if step % 400 == 0:
+                engine.held[:10] = ~engine.held[:10]
+            engine.step(1 / 120)
+            position = engine.sphere_position[:10, :, :2]
+            self.assertTrue(np.all(np.abs(position) <= np.array(arena.ball_limit) + 1e-9))
+        slide = engine.bar_position[:10, np.arange(4), arena.slide]
+        self.assertTrue(np.all(np.abs(slide) <= arena.limit + 1e-9))
+
+    def test_frames_wider_than_one_mask_word_round_trip(self):
+        arena = Arena(goals=(WALL_LEFT, WALL_RIGHT, WALL_LOWER, WALL_UPPER), balls=3)
+        engine = ArenaEngine(arena)
+        handle = engine.add()
+        encoder = FrameEncoder(keyframe_interval=30, coords=arena.coords, extent=arena.extent)
+        decoder = FrameDecoder(coords=arena.coords)
+        engine.held[0, 2, 0] = True
+        for tick in range(1, 100):
+            engine.step(1 / 60)
+            encoder.encode(engine, tick)
+            _, _, coords = decoder.decode(encoder.frame(engine.row(handle)))
+            spheres, bars = engine.positions(handle)
+            expected = np.concatenate([np.ravel(spheres), np.ravel(bars)])
+            self.assertTrue(np.allclose(coords, expected, atol=1 / 8192))
+
+    def test_arena_too_large_for_frames_is_refused(self):
+        for arena in ARENAS.values():
+            FrameEncoder(coords=arena.coords, extent=arena.extent)
+        arena = Arena(width=10.0, goals=(WALL_LEFT, WALL_RIGHT, WALL_LOWER, WALL_UPPER))
+        with self.assertRaises(ValueError):
+            FrameEncoder(coords=arena.coords, extent=arena.extent)
+
+
+class PhysicsImportTests(SimpleTestCase):
+    def test_physics_imports_without_django(self):
+        # Replay tools, benchmarks and load generators step matches
+        # without a settings module or an event loop.
+        code = (
+            "import sys\n"
+            "import pong.engine, pong.events, pong.replay, pong.state\n"
+            "assert not any(name.split('.')[0] in ('django', 'channels') for name in sys.modules)\n"
+        )
+        environment = {key: value for key, value in os.environ.items() if key != "DJANGO_SETTINGS_MODULE"}
+        subprocess.run([sys.executable, "-c", code], check=True, env=environment,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -1,7 +1,12 @@
-from django.urls import path
-
-from . import views
-
-urlpatterns = [
-    path('', views.index),
+from django.urls import path
+
+from . import views
+
+urlpatterns = [
+    path('', views.index),
+    path('metrics/', views.metrics),
+    path('debug/matches/', views.debug_matches),
+    path('debug/matches/<str:match_id>/', views.debug_matches),
+    path('debug/profile/', views.profile),
+    path('debug/drain/', views.drain),
 ]
\ No newline at end of file
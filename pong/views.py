@@ -2,9 +2,107 @@ from django.shortcuts import render
 
 # Create your views here.
 
-from django.http import HttpResponse
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, HttpResponse, JsonResponse
+from django.views.decorators.http import require_POST
+
+from .consumers import PongConsumer
+from .metrics import REGISTRY
+from .profiling import ProfilerBusy
 
 
 
 def index(request):
-    return render(request, 'pong/pong.html')
\ No newline at end of file
+    return render(request, 'pong/pong.html')
+
+
+# The metrics and debug views read containers the tick loop changes, so
+# they are async and run on the event loop thread rather than in a sync
+# view's worker thread, where iterating them could race with the loop.
+async def metrics(request):
+    return HttpResponse(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def describe_match(match):
+    engine = match.engine
+    row = match.row
+    encoder = PongConsumer.encoder
+    members = PongConsumer.matchmaker.members(match.match_id)
+    outbound = {}
+    for channel_name in members:
+        consumer = PongConsumer.fanout.consumers.get(channel_name)
+        if consumer is not None:
+            outbound[channel_name] = {
+                'queued': len(consumer.outbox),
+                'lag_seconds': consumer.outbox.current_lag(),
+                'dropped': consumer.outbox.dropped,
+            }
+    return {
+        'match_id': match.match_id,
+        'handle': match.handle,
+        'row': row,
+        'members': list(members),
+        'outbound': outbound,
+        'score': match.scores,
+        'sphere_position': match.sphere_position.tolist(),
+        'sphere_direction': match.sphere_direction.tolist(),
+        'sphere_speed': match.sphere_speed.tolist(),
+        'bar_positions': engine.bar_position[row].tolist(),
+        'held': engine.held[row].tolist(),
+        'keyframe_tick': int(encoder.key_tick[row]) if row < encoder.key_tick.size else None,
+    }
+
+
+async def debug_matches(request, match_id=None):
+    # Exposes other players' channel names, so keep it to staff.
+    if not (settings.DEBUG or (await request.auser()).is_staff):
+        raise Http404
+    scheduler = PongConsumer.scheduler
+    matches = {
+        key: match for key, match in PongConsumer.groups_info.items()
+        if match.handle is not None
+    }
+    if match_id is not None:
+        if match_id not in matches:
+            raise Http404
+        return JsonResponse(describe_match(matches[match_id]))
+    metrics = PongConsumer.metrics
+    return JsonResponse({
+        'tick_count': scheduler.tick_count,
+        'skipped_ticks': scheduler.skipped_ticks,
+        'tick_p99_seconds': metrics.tick_duration.quantile(0.99),
+        'tick_overruns': metrics.tick_overruns.value,
+        'matches': [describe_match(match) for match in matches.values()],
+    })
+
+
+@require_POST
+async def profile(request):
+    # Async so the profiler starts on the event loop thread, where the
+    # game loop runs, rather than in a sync view's worker thread.
+    user = await request.auser()
+    if not user.is_staff:
+        raise PermissionDenied
+    try:
+        seconds = float(request.POST.get('seconds', 10))
+        mode = request.POST.get('mode', 'cprofile')
+        path = PongConsumer.profiler.start(seconds, mode, request.POST.get('match') or None)
+    except ProfilerBusy as e:
+        return JsonResponse({'error': str(e)}, status=409)
+    except KeyError:
+        raise Http404
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({'path': str(path), 'seconds': seconds, 'mode': mode})
+
+
+@require_POST
+async def drain(request):
+    # Drains this process only; shards are drained with `manage.py drain`.
+    user = await request.auser()
+    if not user.is_staff:
+        raise PermissionDenied
+    if PongConsumer.shards:
+        return JsonResponse({'error': "matches run on shards; use manage.py drain"}, status=400)
+    return JsonResponse({'matches': await PongConsumer.drain()})